@@ -1,4 +1,4 @@
 """
 Package containing the trackit application.
 """
-from trackit import util, main, data, configuration, exceptions
+from trackit import util, main, data, configuration, exceptions, watch, journal, sync, report, server, calendars, shell, fsck, columnar, cache, metrics, parallel, maintenance, memory, stats, tags
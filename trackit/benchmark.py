@@ -0,0 +1,69 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Benchmarks of the storage backends.
+
+Run with python -m trackit.benchmark [intervals], it prints the seconds
+each backend spends on the operations commands use the most.
+"""
+
+import sqlite3
+import sys
+import time
+
+from trackit.data import Data
+from trackit.memory import MemoryData
+
+BACKENDS = (
+    ('sqlite', lambda: Data(sqlite3.connect(":memory:"))),
+    ('memory', MemoryData),
+)
+
+
+def _fill(data, intervals):
+    tasks = [data.tasks.create("task {}".format(i)) for i in range(10)]
+    for i in xrange(intervals):
+        task = tasks[i % len(tasks)]
+        data.intervals.start(task, i * 100)
+        data.intervals.stop(task, i * 100 + 50)
+    return tasks
+
+
+def _lookups(data, intervals):
+    span = intervals * 100
+    for i in xrange(1000):
+        when = (i * 7919 % intervals) * 100 + 75
+        data.intervals.check_overlap(when)
+        data.intervals.between(when, when + 1000)
+        data.intervals.in_progress()
+    data.intervals.between(0, span)
+
+
+def run(intervals=10000):
+    """Time filling every backend with intervals and looking them up.
+
+    Returns a list of (backend, operation, seconds).
+
+    Arguments:
+    - `intervals`: the number of task intervals to create.
+    """
+    timings = []
+    for name, create in BACKENDS:
+        started = time.time()
+        data = create()
+        _fill(data, intervals)
+        timings.append((name, 'start/stop', time.time() - started))
+        started = time.time()
+        _lookups(data, intervals)
+        timings.append((name, 'lookups', time.time() - started))
+    return timings
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for backend, operation, seconds in run(count):
+        print "{}\t{}\t{:.3f} seconds".format(backend, operation, seconds)
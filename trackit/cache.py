@@ -0,0 +1,113 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Cache of report results.
+
+Results are keyed on the report function and its arguments, and are only
+valid for the revision of the database they were computed at. The
+revision is bumped by triggers on every change to tasks and task
+intervals, so a cached result is returned until the data changes.
+"""
+
+import cPickle as pickle
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+from trackit.data import Task, database_path, revision
+
+
+def _normalize(argument):
+    if isinstance(argument, Task):
+        return argument.task_id
+    return argument
+
+
+def _depends_on_clock(data, until):
+    """True if a report ending at until counts an interval up to now."""
+    if until is not None and until <= time.time():
+        return False
+    with closing(data.conn.cursor()) as cursor:
+        cursor.execute("SELECT 1 FROM TASKINTERVAL WHERE STOP_TIME IS NULL"
+                       " LIMIT 1")
+        return cursor.fetchone() is not None
+
+
+class ReportCache(object):
+    """Bounded cache of report results, evicting the least recently used.
+
+    It is safe to share between threads.
+    """
+
+    def __init__(self, size=128, path=None):
+        """Create a ReportCache, loading it from path if it exists.
+
+        Arguments:
+        - `size`: the maximum number of results to keep.
+        - `path`: optional Path to persist the cache to with save().
+        """
+        self.size = size
+        self.path = path
+        self.version = None
+        self.results = OrderedDict()
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+        if path is not None and path.exists():
+            try:
+                with path.open('rb') as inf:
+                    self.version, self.results = pickle.load(inf)
+            except (EOFError, ValueError, TypeError, pickle.UnpicklingError):
+                pass
+
+    def get(self, data, report, **arguments):
+        """The result of report(data, **arguments), computed only when it
+        is not cached for the current revision of data.
+
+        Reports without an until or ending in the future, that count
+        intervals in progress up to now, depend on the clock and are not
+        cached.
+
+        Arguments:
+        - `data`: the Data to report on.
+        - `report`: the report function, like report.totals.
+        - `arguments`: the keyword arguments to report.
+        """
+        if _depends_on_clock(data, arguments.get('until')):
+            return report(data, **arguments)
+        version = (database_path(data.conn), revision(data.conn))
+        key = (report.__name__,) + tuple(sorted(
+            (name, _normalize(value)) for name, value in arguments.items()))
+        with self.lock:
+            if version != self.version:
+                self.version = version
+                self.results.clear()
+            if key in self.results:
+                self.hits += 1
+                result = self.results.pop(key)
+                self.results[key] = result
+                return result
+            self.misses += 1
+        result = report(data, **arguments)
+        with self.lock:
+            if version == self.version:
+                self.results[key] = result
+                while len(self.results) > self.size:
+                    self.results.popitem(last=False)
+        return result
+
+    def save(self):
+        """Write the cache to its path, replacing the file atomically."""
+        if self.path is None:
+            return
+        temporary = '{}.tmp'.format(self.path.path)
+        with self.lock:
+            with open(temporary, 'wb') as outf:
+                pickle.dump((self.version, self.results), outf,
+                            pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary, self.path.path)
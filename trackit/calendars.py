@@ -0,0 +1,400 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Precomputed local calendar for reporting.
+
+The CALENDAR table holds one row per local day with the unix times the day
+starts and stops at. Reports join against it instead of converting every
+interval to local time in Python, which also keeps them correct on days
+that are 23 or 25 hours long because of DST.
+
+Local times are worked out by Zone from the compiled timezone database of
+the operating system, without touching the TZ of the process, so threads
+can use different timezones at the same time.
+"""
+
+import bisect
+import calendar as calendar_
+import datetime
+import math
+import os
+import re
+import struct
+import time
+
+from trackit.data import ClosesCursor, _migrate
+from trackit.exceptions import TrackitException
+from trackit.util import dumb_constructor
+
+# Labels of the periods days can be grouped into
+PERIODS = {
+    'day': "DAY",
+    'week': "WEEK",
+    'month': "MONTH",
+}
+
+# Where the compiled timezone database is looked for, unless TZDIR is set
+ZONEINFO = ('/usr/share/zoneinfo', '/usr/lib/zoneinfo',
+            '/usr/share/lib/zoneinfo')
+
+DAY = 24 * 60 * 60
+
+EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+
+class UnknownTimezone(TrackitException):
+    """There is no timezone by that name."""
+    pass
+
+
+def _clock(text):
+    """Seconds of a POSIX TZ offset or time, like -1 or 2:30."""
+    sign = -1 if text.startswith('-') else 1
+    parts = [int(part) for part in text.lstrip('+-').split(':')]
+    parts += [0] * (3 - len(parts))
+    return sign * (parts[0] * 3600 + parts[1] * 60 + parts[2])
+
+
+def _rule_date(year, rule):
+    """The datetime.date a POSIX TZ date rule, like M3.5.0, falls on in
+    year."""
+    if rule.startswith('J'):
+        # 1 to 365, February 29th is never counted
+        day = int(rule[1:])
+        leap = calendar_.isleap(year) and day >= 60
+        return datetime.date(year, 1, 1) + datetime.timedelta(day - 1 + leap)
+    if not rule.startswith('M'):
+        return datetime.date(year, 1, 1) + datetime.timedelta(int(rule))
+    month, week, weekday = [int(part) for part in rule[1:].split('.')]
+    first = datetime.date(year, month, 1)
+    # weekday counts from Sunday, date.weekday() from Monday
+    day = 1 + (weekday - (first.weekday() + 1)) % 7 + (week - 1) * 7
+    while day > calendar_.monthrange(year, month)[1]:
+        day -= 7
+    return first.replace(day=day)
+
+
+class _Rule(object):
+    """Offsets from a POSIX TZ string, like CET-1CEST,M3.5.0,M10.5.0/3,
+    which timezone files use for times after their last transition."""
+
+    NAME = r"(?:<[^>]*>|[A-Za-z]+)"
+    OFFSET = r"[-+]?\d+(?::\d+){0,2}"
+    PATTERN = re.compile(
+        r"^{name}(?P<std>{offset})(?:(?P<summer>{name})(?P<dst>{offset})?"
+        r"(?:,(?P<start>[^,/]+)(?:/(?P<start_time>{offset}))?"
+        r",(?P<end>[^,/]+)(?:/(?P<end_time>{offset}))?)?)?$"
+        .format(name=NAME, offset=OFFSET))
+
+    def __init__(self, text):
+        match = _Rule.PATTERN.match(text)
+        if match is None:
+            raise UnknownTimezone("Can not parse TZ rule {}".format(text))
+        # POSIX offsets are west of UTC
+        self.std = -_clock(match.group('std'))
+        self.dst = None
+        if match.group('summer'):
+            self.dst = self.std + 3600
+            if match.group('dst'):
+                self.dst = -_clock(match.group('dst'))
+        self.start = (match.group('start') or 'M3.2.0',
+                      _clock(match.group('start_time') or '2'))
+        self.end = (match.group('end') or 'M11.1.0',
+                    _clock(match.group('end_time') or '2'))
+
+    def _local(self, year, rule):
+        day, seconds = rule
+        return (_rule_date(year, day).toordinal() - EPOCH) * DAY + seconds
+
+    def utcoffset(self, when):
+        if self.dst is None:
+            return self.std
+        day = EPOCH + int(math.floor((when + self.std) / float(DAY)))
+        year = datetime.date.fromordinal(day).year
+        # The start is given in standard time, the end in daylight time
+        start = self._local(year, self.start) - self.std
+        end = self._local(year, self.end) - self.dst
+        if start < end:
+            summer = start <= when < end
+        else:
+            summer = not end <= when < start
+        return self.dst if summer else self.std
+
+
+def _tzif(content):
+    """(transitions, offsets, initial offset, rule) from the contents of a
+    compiled timezone file."""
+    if content[:4] != 'TZif':
+        raise ValueError("Not a timezone file")
+    header = struct.Struct('>4sc15x6l')
+    _, version, utc, std, leaps, count, types, chars = \
+        header.unpack_from(content)
+    offset, size, kind = header.size, 4, 'l'
+    if version >= '2':
+        # Skip the 32 bit data for the 64 bit data that follows it
+        offset += count * 5 + types * 6 + chars + leaps * 8 + std + utc
+        _, _, utc, std, leaps, count, types, chars = \
+            header.unpack_from(content, offset)
+        offset, size, kind = offset + header.size, 8, 'q'
+    transitions = list(struct.unpack_from('>{}{}'.format(count, kind),
+                                          content, offset))
+    offset += count * size
+    indexes = struct.unpack_from('>{}B'.format(count), content, offset)
+    offset += count
+    utcoffsets = [struct.unpack_from('>l', content, offset + 6 * i)[0]
+                  for i in range(types)]
+    offset += types * 6 + chars + leaps * (size + 4) + std + utc
+    footer = content[offset:].strip('\n') if version >= '2' else ''
+    return (transitions, [utcoffsets[index] for index in indexes],
+            utcoffsets[0], _Rule(footer) if footer else None)
+
+
+class Zone(object):
+    """Conversion between unix time and the local time of a timezone."""
+
+    def __init__(self, name=None):
+        """Create a Zone, reading its timezone file.
+
+        Arguments:
+        - `name`: name of a timezone, like Europe/Oslo. None for the
+          timezone of the process.
+        """
+        self.name = name
+        if name is None:
+            return
+        if name.startswith('/') or '..' in name.split('/'):
+            raise UnknownTimezone("No such timezone: {}".format(name))
+        directories = [os.environ['TZDIR']] if 'TZDIR' in os.environ \
+            else ZONEINFO
+        for directory in directories:
+            try:
+                with open(os.path.join(directory, name), 'rb') as inf:
+                    content = inf.read()
+            except IOError:
+                continue
+            try:
+                (self.transitions, self.offsets, self.initial,
+                 self.rule) = _tzif(content)
+            except (ValueError, struct.error):
+                continue
+            return
+        raise UnknownTimezone("No such timezone: {}".format(name))
+
+    def utcoffset(self, when):
+        """Seconds local time is ahead of UTC at unix time when."""
+        if self.name is None:
+            second = int(math.floor(when))
+            return calendar_.timegm(time.localtime(second)) - second
+        i = bisect.bisect_right(self.transitions, when)
+        if i == 0:
+            return self.initial
+        if i == len(self.transitions) and self.rule is not None:
+            return self.rule.utcoffset(when)
+        return self.offsets[i - 1]
+
+    def localtime(self, when):
+        """The local time at unix time when, as a naive datetime."""
+        return datetime.datetime(1970, 1, 1) + datetime.timedelta(
+            seconds=when + self.utcoffset(when))
+
+    def date(self, when):
+        """The local day unix time when is in, as a datetime.date."""
+        local = when + self.utcoffset(when)
+        return datetime.date.fromordinal(
+            EPOCH + int(math.floor(local / float(DAY))))
+
+    def midnight(self, day):
+        """Unix time of the start of the local day, a datetime.date.
+
+        Where midnight is skipped by a DST change, the day starts at the
+        change."""
+        local = (day.toordinal() - EPOCH) * DAY
+        offsets = set(self.utcoffset(local + i * DAY) for i in range(-2, 3))
+        found = [local - offset for offset in offsets
+                 if self.utcoffset(local - offset) == offset]
+        if found:
+            return min(found)
+        # Midnight is in a gap, find the change between the candidates
+        low = local - max(offsets)
+        high = local - min(offsets)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.date(middle) < day:
+                low = middle
+            else:
+                high = middle
+        return high
+
+
+# Zones by name, reading a timezone file once per process is enough
+_zones = {}
+
+def lookup(name):
+    """The Zone of the timezone name, None for the process timezone.
+
+    Arguments:
+    - `name`: name of a timezone, like Europe/Oslo.
+    """
+    if name not in _zones:
+        _zones[name] = Zone(name)
+    return _zones[name]
+
+
+def days(first, last, local):
+    """Rows for the CALENDAR table for the local days first to last.
+
+    Arguments:
+    - `first`: the first datetime.date.
+    - `last`: the last datetime.date.
+    - `local`: the Zone of the days.
+    """
+    one = datetime.timedelta(days=1)
+    day = first
+    start = local.midnight(day)
+    while day <= last:
+        year, week, _ = day.isocalendar()
+        stop = local.midnight(day + one)
+        yield (day.isoformat(), start, stop,
+               "{:04d}-W{:02d}".format(year, week),
+               "{:04d}-{:02d}".format(day.year, day.month))
+        day, start = day + one, stop
+
+
+class Calendar(ClosesCursor):
+    """Repository for the precomputed calendar of one timezone.
+
+    Only cover() writes to the database. Everything else works on
+    read-only connections, computing the days the calendar does not have
+    yet.
+    """
+
+    SCHEMA = """
+    CREATE TABLE CALENDAR(
+        DAY TEXT,
+        START_TIME REAL NOT NULL,
+        STOP_TIME REAL NOT NULL,
+        WEEK TEXT NOT NULL,
+        MONTH TEXT NOT NULL,
+        PRIMARY KEY(DAY)
+    );
+"""
+    MIGRATIONS = (
+        "CREATE INDEX IF NOT EXISTS CALENDAR_START ON CALENDAR(START_TIME)",
+        "CREATE TABLE IF NOT EXISTS CALENDARZONE(TIMEZONE TEXT)",
+    )
+
+    @dumb_constructor
+    def __init__(self, conn, zone=None):
+        """Create a Calendar. Nothing is written until cover() is called.
+
+        Arguments:
+        - `conn`: sqlite3 database connection.
+        - `zone`: name of the timezone, None for the local timezone.
+        """
+        self.local = lookup(zone)
+
+    def _stored(self):
+        """True if the CALENDAR table exists and is for this timezone."""
+        with self.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM SQLITE_MASTER WHERE TYPE = 'table'"
+                           " AND NAME = 'CALENDARZONE'")
+            if cursor.fetchone() is None:
+                return False
+            cursor.execute("SELECT TIMEZONE FROM CALENDARZONE")
+            row = cursor.fetchone()
+            return row is not None and row[0] == (self.zone or '')
+
+    def _bounds(self):
+        with self.cursor() as cursor:
+            cursor.execute("SELECT MIN(START_TIME), MAX(STOP_TIME)"
+                           " FROM CALENDAR")
+            return cursor.fetchone()
+
+    def covers(self, since, until):
+        """True if the CALENDAR table has every day from since to until.
+
+        Arguments:
+        - `since`: unix time.
+        - `until`: unix time.
+        """
+        if not self._stored():
+            return False
+        first, last = self._bounds()
+        return first is not None and first <= since and until < last
+
+    def cover(self, since, until):
+        """Make sure the CALENDAR table has every day from since to until.
+
+        This registers the schema, and throws away a calendar that was
+        made for another timezone.
+
+        Arguments:
+        - `since`: unix time.
+        - `until`: unix time.
+        """
+        with self.cursor() as cursor:
+            _migrate(cursor, Calendar.SCHEMA, Calendar.MIGRATIONS)
+            if not self._stored():
+                cursor.execute("DELETE FROM CALENDAR")
+                cursor.execute("DELETE FROM CALENDARZONE")
+                cursor.execute("INSERT INTO CALENDARZONE(TIMEZONE) VALUES(?)",
+                               (self.zone or '',))
+        first, last = self._bounds()
+        if first is not None and first <= since and until < last:
+            return
+        wanted_first = self.local.date(since)
+        wanted_last = self.local.date(until)
+        if first is None:
+            missing = [(wanted_first, wanted_last)]
+        else:
+            have_first = self.local.date(first)
+            have_last = self.local.date(last - 1)
+            one = datetime.timedelta(days=1)
+            missing = [(wanted_first, have_first - one),
+                       (have_last + one, wanted_last)]
+        rows = [row for first_day, last_day in missing
+                for row in days(first_day, last_day, self.local)]
+        with self.cursor() as cursor:
+            cursor.executemany("INSERT INTO CALENDAR(DAY, START_TIME,"
+                               " STOP_TIME, WEEK, MONTH) VALUES(?, ?, ?, ?, ?)",
+                               rows)
+
+    def rows(self, since, until):
+        """The CALENDAR rows of the days from since to until, computed if
+        the table does not have them.
+
+        Arguments:
+        - `since`: unix time.
+        - `until`: unix time.
+        """
+        if self.covers(since, until):
+            with self.cursor() as cursor:
+                cursor.execute("SELECT DAY, START_TIME, STOP_TIME, WEEK, MONTH"
+                               " FROM CALENDAR WHERE STOP_TIME > ?"
+                               " AND START_TIME <= ? ORDER BY START_TIME",
+                               (since, until))
+                return [tuple(row) for row in cursor.fetchall()]
+        return list(days(self.local.date(since), self.local.date(until),
+                         self.local))
+
+    def day(self, label):
+        """The (start, stop) unix times of a local day.
+
+        Arguments:
+        - `label`: the day as YYYY-MM-DD.
+        """
+        day = datetime.datetime.strptime(label, "%Y-%m-%d").date()
+        return (self.local.midnight(day),
+                self.local.midnight(day + datetime.timedelta(days=1)))
+
+    def day_of(self, when):
+        """The local day, as YYYY-MM-DD, that when is in.
+
+        Arguments:
+        - `when`: unix time.
+        """
+        return self.local.date(when).isoformat()
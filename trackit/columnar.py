@@ -0,0 +1,212 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Binary columnar export of task intervals.
+
+An export is a HEADER followed by three little-endian columns with one
+item per task interval, ordered by start time: the task ids as 64 bit
+integers, then start and stop times as doubles. Stop times of intervals
+in progress are NaN. The task names follow as a dictionary of
+(task id, length, utf-8 name) entries.
+
+Columns are 8 byte aligned, so a reader can map the file into memory and
+look items up in place, without parsing anything but the header.
+"""
+
+import array
+import bisect
+import mmap
+import os
+import struct
+import sys
+from contextlib import closing
+
+from trackit.exceptions import TrackitException
+
+MAGIC = 'TKIC'
+VERSION = 1
+
+# magic, version, number of task intervals, number of tasks
+HEADER = struct.Struct('<4sIQQ')
+# task id, length of the utf-8 encoded name that follows
+ENTRY = struct.Struct('<qI')
+
+NAN = float('nan')
+
+
+def _int64_code():
+    for code in 'ql':
+        try:
+            if array.array(code).itemsize == 8:
+                return code
+        except ValueError:
+            pass
+    raise ImportError("No 64 bit integer array type on this platform")
+
+# array type code of 64 bit integers, 'q' only exists from Python 3.3
+INT64 = _int64_code()
+
+
+class InvalidExport(TrackitException):
+    """The file is not a columnar export this version can read."""
+    pass
+
+
+def _little_endian(items):
+    if sys.byteorder == 'big':
+        items.byteswap()
+    return items
+
+
+def write(data, path):
+    """Export the task intervals and task names of data to path.
+
+    Returns the number of task intervals written.
+
+    Arguments:
+    - `data`: the Data to export.
+    - `path`: Path of the file to write.
+    """
+    tasks, starts = array.array(INT64), array.array('d')
+    stops = array.array('d')
+    with closing(data.conn.cursor()) as cursor:
+        cursor.execute("SELECT TASK, START_TIME, STOP_TIME FROM TASKINTERVAL"
+                       " ORDER BY START_TIME")
+        for task, start, stop in cursor:
+            tasks.append(task)
+            starts.append(start)
+            stops.append(NAN if stop is None else stop)
+        cursor.execute("SELECT TASK, NAME FROM TASK ORDER BY TASK")
+        names = cursor.fetchall()
+    with path.open('wb') as outf:
+        outf.write(HEADER.pack(MAGIC, VERSION, len(tasks), len(names)))
+        for column in (tasks, starts, stops):
+            _little_endian(column).tofile(outf)
+        for task, name in names:
+            encoded = name.encode('utf-8')
+            outf.write(ENTRY.pack(task, len(encoded)) + encoded)
+    return len(tasks)
+
+
+class Column(object):
+    """Read-only sequence of the items of one column of a mapped export.
+
+    Items are unpacked from the mapping when they are looked up, so
+    creating a Column costs nothing. Starts are sorted, so the bisect
+    module can search that column in place.
+    """
+
+    def __init__(self, mapped, offset, length, code):
+        """Create a Column.
+
+        Arguments:
+        - `mapped`: the mmap of the export.
+        - `offset`: offset of the first item in mapped.
+        - `length`: the number of items.
+        - `code`: struct type code of the items.
+        """
+        self.mapped = mapped
+        self.offset = offset
+        self.length = length
+        self.code = code
+        self.item = struct.Struct('<' + code)
+        self.array_code = INT64 if code == 'q' else code
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("Column index out of range")
+        return self.item.unpack_from(
+            self.mapped, self.offset + index * self.item.size)[0]
+
+    def __iter__(self):
+        for index in xrange(self.length):
+            yield self[index]
+
+    def view(self):
+        """Zero-copy read-only buffer of the raw little-endian bytes of the
+        column. Use array() for a copy of the items."""
+        return buffer(self.mapped, self.offset, self.length * self.item.size)
+
+    def array(self):
+        """A copy of the column as an array.array."""
+        items = array.array(self.array_code)
+        items.fromstring(self.mapped[self.offset:self.offset +
+                                     self.length * self.item.size])
+        return _little_endian(items)
+
+
+class Export(object):
+    """Memory-mapped reader of a columnar export.
+
+    Opening an export only reads the header and the task names, no matter
+    how many task intervals there are.
+    """
+
+    def __init__(self, path):
+        """Open the export at path.
+
+        Arguments:
+        - `path`: Path of the export.
+        """
+        with path.open('rb') as inf:
+            # Empty files can not be mapped
+            if os.fstat(inf.fileno()).st_size < HEADER.size:
+                raise InvalidExport("{} is too short".format(path.path))
+            self.mapped = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, intervals, tasks = HEADER.unpack_from(self.mapped)
+        if magic != MAGIC or version != VERSION:
+            raise InvalidExport("{} is not a version {} export"
+                                .format(path.path, VERSION))
+        offset = HEADER.size
+        self.task_ids = Column(self.mapped, offset, intervals, 'q')
+        offset += intervals * 8
+        self.starts = Column(self.mapped, offset, intervals, 'd')
+        offset += intervals * 8
+        self.stops = Column(self.mapped, offset, intervals, 'd')
+        offset += intervals * 8
+        self.names = {}
+        for _ in xrange(tasks):
+            task, length = ENTRY.unpack_from(self.mapped, offset)
+            offset += ENTRY.size
+            self.names[task] = self.mapped[offset:offset + length] \
+                .decode('utf-8')
+            offset += length
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        """The (task name, start, stop) of a task interval, stop is None
+        for the interval in progress."""
+        stop = self.stops[index]
+        return (self.names[self.task_ids[index]], self.starts[index],
+                None if stop != stop else stop)
+
+    def between(self, since, until):
+        """The range of indices of task intervals starting in the window.
+
+        Arguments:
+        - `since`: unix time the window starts at.
+        - `until`: unix time the window ends at.
+        """
+        return xrange(bisect.bisect_left(self.starts, since),
+                      bisect.bisect_left(self.starts, until))
+
+    def close(self):
+        """Unmap the export."""
+        self.mapped.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
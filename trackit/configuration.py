@@ -17,7 +17,14 @@ HOME = Path('$HOME').join('.trackit')
 
 DEFAULT = {
     'database': 'db.sqlite',
-    'encoding': 'utf-8'
+    'encoding': 'utf-8',
+    'journal': False,
+    'journal_compact_after': 100,
+    'timezone': None,
+    'report_cache_size': 128,
+    'report_cache_persist': False,
+    'metrics': None,
+    'maintenance_budget': 0.05
 }
 
 
@@ -82,8 +89,38 @@ def _to_path(home=None):
     else:
         return home
 
-def get_db(configuration):
-    return sqlite3.connect(configuration['_home'].join(configuration['database']).path)
+def db_path(configuration):
+    """The Path of the database file configured in configuration."""
+    return configuration['_home'].join(configuration['database'])
+
+def journal_path(configuration):
+    """The Path of the start/stop journal in the trackit home."""
+    return configuration['_home'].join('journal')
+
+def report_cache_path(configuration):
+    """The Path of the persisted report cache in the trackit home."""
+    return configuration['_home'].join('reportcache')
+
+def metrics_path(configuration):
+    """The Path of the metrics file, None if metrics are not enabled.
+
+    A relative path in the configuration is relative to the trackit
+    home."""
+    if not configuration.get('metrics'):
+        return None
+    return configuration['_home'].join(configuration['metrics'])
+
+def get_db(configuration, **options):
+    """Connect to the configured database, passing options on to
+    sqlite3.connect.
+
+    New databases are created with incremental vacuum enabled."""
+    path = db_path(configuration)
+    new = not path.exists()
+    conn = sqlite3.connect(path.path, **options)
+    if new:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    return conn
 
 def load_configuration(home=None):
     """Loads configuration into a ChainMap.
@@ -8,8 +8,12 @@
 Interface to the data models used in trackit.
 """
 
+import base64
+import itertools
+import json
 import sqlite3
 import time
+from collections import OrderedDict
 from contextlib import closing
 from trackit.util import dumb_constructor, DefaultRepr
 from trackit.exceptions import TrackitException
@@ -28,6 +32,18 @@ class InconsistentTaskIntervals(TrackitException):
     it should only be possible to track one at a time."""
     pass
 
+class TaskCycle(TrackitException):
+    """Raised when a task would become its own ancestor."""
+    pass
+
+class InvalidPageToken(TrackitException):
+    """A continuation token was not produced by a page query."""
+    pass
+
+class InvalidPageLimit(TrackitException):
+    """A page was asked for with room for no items."""
+    pass
+
 class ClosesCursor(object):
     """Inherit to get context managed cursor, enabling the following idiom:
 
@@ -44,18 +60,165 @@ class ClosesCursor(object):
         return closing(self.conn.cursor())
 
 def _execute_with_except(cursor, sql):
-    """Ignore sqlite3 exceptions when executing this sql."""
+    """Ignore sqlite3 exceptions when executing this sql.
+
+    Returns True if the sql was executed without exceptions."""
     try:
         cursor.execute(sql)
+        return True
     except sqlite3.OperationalError:
-        pass
+        return False
+
+def _migrate(cursor, schema, migrations):
+    """Register schema and apply migrations, in order.
+
+    Migrations are statements that change the schema after it was first
+    created. They must fail or do nothing when already applied. A
+    migration may also be a (migration, backfill) pair, where backfill is
+    only executed when migration succeeds."""
+    _execute_with_except(cursor, schema)
+    for migration in migrations:
+        if isinstance(migration, tuple):
+            migration, backfill = migration
+            if _execute_with_except(cursor, migration):
+                _execute_with_except(cursor, backfill)
+        else:
+            _execute_with_except(cursor, migration)
+
+def _chunks(items, size=500):
+    """Split items into lists of at most size elements, to stay below the
+    limit SQLite has on the number of parameters in a statement."""
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def _placeholders(items):
+    return ", ".join("?" * len(items))
+
+# Every statement the repositories run, by name, so that tests can check
+# their query plans. Statements on lists of ids have {} where the
+# placeholders of the list go.
+STATEMENTS = OrderedDict()
+
+def _statement(name, sql):
+    """Register sql in STATEMENTS as name and return it."""
+    STATEMENTS[name] = sql
+    return sql
+
+def _encode_token(position):
+    """Opaque continuation token for a keyset position."""
+    return base64.urlsafe_b64encode(json.dumps(position))
+
+def _check_limit(limit):
+    """Raise InvalidPageLimit unless a page of limit items holds any."""
+    if limit < 1:
+        raise InvalidPageLimit("The limit of a page must be positive: {}"
+                               .format(limit))
+
+def _decode_token(token, size):
+    """Keyset position of length size from a continuation token."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(str(token)))
+    except (TypeError, ValueError):
+        raise InvalidPageToken("Malformed continuation token: {}"
+                               .format(token))
+    if not isinstance(position, list) or len(position) != size:
+        raise InvalidPageToken("Wrong kind of continuation token: {}"
+                               .format(token))
+    return position
+
+def data_version(conn):
+    """Read PRAGMA data_version from conn.
+
+    The value changes whenever another connection commits to the database,
+    it does not change for commits made through conn itself."""
+    with closing(conn.cursor()) as cursor:
+        cursor.execute("PRAGMA data_version")
+        return cursor.fetchone()[0]
+
+REVISION = _statement('revision', "SELECT REVISION FROM REVISION")
+
+def revision(conn):
+    """The revision of the database in conn.
 
+    The revision is stored in the database and bumped by every change to
+    tasks and task intervals, whichever connection made the change."""
+    with closing(conn.cursor()) as cursor:
+        cursor.execute(REVISION)
+        return cursor.fetchone()[0]
+
+def database_path(conn):
+    """The path of the file of the main database of conn, '' if it is an
+    in-memory database.
+
+    The pragma is read as a table, since the sqlite3 module commits
+    pending changes before a PRAGMA statement."""
+    with closing(conn.cursor()) as cursor:
+        cursor.execute("SELECT FILE FROM PRAGMA_DATABASE_LIST"
+                       " WHERE NAME = 'main'")
+        row = cursor.fetchone()
+    return row[0] or '' if row else ''
+
+def _copy_attached(memory, path):
+    """Copy the database file at path into memory, table by table.
+
+    Indexes and triggers are created after the rows are copied, so that
+    triggers do not fire and indexes are built in one go."""
+    memory.execute("ATTACH DATABASE ? AS SOURCE", (path,))
+    with closing(memory.cursor()) as cursor:
+        cursor.execute("SELECT TYPE, NAME, SQL FROM SOURCE.SQLITE_MASTER"
+                       " WHERE SQL IS NOT NULL ORDER BY TYPE != 'table'")
+        schema = cursor.fetchall()
+        tables = [name for kind, name, sql in schema if kind == 'table'
+                  and not name.startswith('sqlite_')]
+        for kind, name, sql in schema:
+            if name in tables:
+                cursor.execute(sql)
+        if 'sqlite_sequence' in [name for _, name, _ in schema]:
+            tables.append('sqlite_sequence')
+        for name in tables:
+            cursor.execute('INSERT INTO MAIN."{0}" SELECT * FROM'
+                           ' SOURCE."{0}"'.format(name))
+        memory.commit()
+        for kind, name, sql in schema:
+            if kind != 'table':
+                cursor.execute(sql)
+    memory.execute("DETACH DATABASE SOURCE")
+
+def snapshot(conn):
+    """Copy the database of conn into a new in-memory connection.
+
+    Reads against the copy do not hold locks on the database file, so
+    writers are never blocked by them. Changes to the copy are lost.
+
+    Arguments:
+    - `conn`: sqlite3 database connection to copy.
+    """
+    memory = sqlite3.connect(':memory:')
+    path = database_path(conn)
+    if hasattr(conn, 'backup'):
+        conn.backup(memory)
+    elif path:
+        _copy_attached(memory, path)
+    else:
+        memory.executescript('\n'.join(conn.iterdump()))
+    return memory
 
 class Task(DefaultRepr):
-    """Model for a Task."""
+    """Model for a Task.
+
+    total_seconds, interval_count and last_worked are maintained by the
+    database. total_seconds only counts stopped task intervals. parent is
+    the id of the parent task, None for top level tasks."""
+
+    COLUMNS = ("TASK", "NAME", "DESCRIPTION", "TOTAL_SECONDS",
+               "INTERVAL_COUNT", "LAST_WORKED", "PARENT")
+
+    # Separates the names of tasks in a task path, like project/task
+    SEPARATOR = "/"
 
     @dumb_constructor
-    def __init__(self, _task_id, name, description):
+    def __init__(self, _task_id, name, description, total_seconds=0,
+                 interval_count=0, last_worked=None, parent=None):
         pass
 
     @property
@@ -63,6 +226,16 @@ class Task(DefaultRepr):
         """Readonly - the row id of the task."""
         return self._task_id
 
+    @classmethod
+    def columns(cls, alias=None):
+        """The columns of TASK for map_row(), as sql.
+
+        Arguments:
+        - `alias`: the alias of TASK in the query, if any.
+        """
+        prefix = "" if alias is None else alias + "."
+        return ", ".join(prefix + column for column in cls.COLUMNS)
+
     @classmethod
     def map_row(cls, row):
         return cls(*row)
@@ -78,6 +251,191 @@ class Tasks(ClosesCursor):
         PRIMARY KEY(TASK)
     );
 """
+    MIGRATIONS = (
+        "CREATE INDEX IF NOT EXISTS TASK_NAME ON TASK(NAME)",
+        # REVISION is bumped on every change to TASK and TASKINTERVAL, the
+        # CHANGED column of a row is the revision it was last changed in.
+        "CREATE TABLE IF NOT EXISTS REVISION(REVISION INTEGER NOT NULL)",
+        "INSERT INTO REVISION(REVISION) SELECT 0"
+        " WHERE NOT EXISTS (SELECT 1 FROM REVISION)",
+        "ALTER TABLE TASK ADD COLUMN CHANGED INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS TASK_CHANGED ON TASK(CHANGED)",
+        # Running totals, kept up to date by triggers on TASKINTERVAL.
+        "ALTER TABLE TASK ADD COLUMN TOTAL_SECONDS REAL NOT NULL DEFAULT 0",
+        "ALTER TABLE TASK ADD COLUMN INTERVAL_COUNT INTEGER NOT NULL"
+        " DEFAULT 0",
+        ("ALTER TABLE TASK ADD COLUMN LAST_WORKED REAL",
+         """
+    UPDATE TASK SET
+        TOTAL_SECONDS = (SELECT COALESCE(SUM(STOP_TIME - START_TIME), 0)
+                         FROM TASKINTERVAL I WHERE I.TASK = TASK.TASK),
+        INTERVAL_COUNT = (SELECT COUNT(*) FROM TASKINTERVAL I
+                          WHERE I.TASK = TASK.TASK),
+        LAST_WORKED = (SELECT MAX(COALESCE(STOP_TIME, START_TIME))
+                       FROM TASKINTERVAL I WHERE I.TASK = TASK.TASK)
+"""),
+        "CREATE INDEX IF NOT EXISTS TASK_TOTAL_SECONDS ON TASK(TOTAL_SECONDS)",
+        "CREATE INDEX IF NOT EXISTS TASK_LAST_WORKED ON TASK(LAST_WORKED)",
+        "CREATE INDEX IF NOT EXISTS TASK_INTERVAL_COUNT"
+        " ON TASK(INTERVAL_COUNT)",
+        """
+    CREATE TRIGGER IF NOT EXISTS TASK_INSERTED AFTER INSERT ON TASK BEGIN
+        UPDATE REVISION SET REVISION = REVISION + 1;
+        UPDATE TASK SET CHANGED = (SELECT REVISION FROM REVISION)
+        WHERE TASK = new.TASK;
+    END
+""",
+        """
+    CREATE TRIGGER IF NOT EXISTS TASK_UPDATED
+    AFTER UPDATE OF NAME, DESCRIPTION ON TASK BEGIN
+        UPDATE REVISION SET REVISION = REVISION + 1;
+        UPDATE TASK SET CHANGED = (SELECT REVISION FROM REVISION)
+        WHERE TASK = new.TASK;
+    END
+""",
+        """
+    CREATE TRIGGER IF NOT EXISTS TASK_DELETED AFTER DELETE ON TASK BEGIN
+        UPDATE REVISION SET REVISION = REVISION + 1;
+    END
+""",
+        # Tasks form a tree. TASKCLOSURE has a row for every ancestor of
+        # every task, including the task itself at depth 0, so that whole
+        # subtrees are found with one join instead of a recursive walk.
+        "ALTER TABLE TASK ADD COLUMN PARENT INTEGER REFERENCES TASK(TASK)",
+        "CREATE INDEX IF NOT EXISTS TASK_PARENT_NAME ON TASK(PARENT, NAME)",
+        ("""
+    CREATE TABLE TASKCLOSURE(
+        ANCESTOR INTEGER NOT NULL,
+        DESCENDANT INTEGER NOT NULL,
+        DEPTH INTEGER NOT NULL,
+        PRIMARY KEY(ANCESTOR, DESCENDANT)
+    )
+""", "INSERT INTO TASKCLOSURE(ANCESTOR, DESCENDANT, DEPTH)"
+         " SELECT TASK, TASK, 0 FROM TASK"),
+        "CREATE INDEX IF NOT EXISTS TASKCLOSURE_DESCENDANT"
+        " ON TASKCLOSURE(DESCENDANT, DEPTH)",
+        """
+    CREATE TRIGGER IF NOT EXISTS TASKCLOSURE_INSERTED
+    AFTER INSERT ON TASK BEGIN
+        INSERT INTO TASKCLOSURE(ANCESTOR, DESCENDANT, DEPTH)
+        SELECT new.TASK, new.TASK, 0;
+        INSERT INTO TASKCLOSURE(ANCESTOR, DESCENDANT, DEPTH)
+        SELECT ANCESTOR, new.TASK, DEPTH + 1 FROM TASKCLOSURE
+        WHERE DESCENDANT = new.PARENT;
+    END
+""",
+        # Moving a task cuts its subtree loose from the old ancestors and
+        # attaches it below every ancestor of the new parent.
+        """
+    CREATE TRIGGER IF NOT EXISTS TASKCLOSURE_MOVED
+    AFTER UPDATE OF PARENT ON TASK BEGIN
+        DELETE FROM TASKCLOSURE
+        WHERE DESCENDANT IN (SELECT DESCENDANT FROM TASKCLOSURE
+                             WHERE ANCESTOR = new.TASK)
+        AND ANCESTOR NOT IN (SELECT DESCENDANT FROM TASKCLOSURE
+                             WHERE ANCESTOR = new.TASK);
+        INSERT INTO TASKCLOSURE(ANCESTOR, DESCENDANT, DEPTH)
+        SELECT A.ANCESTOR, D.DESCENDANT, A.DEPTH + D.DEPTH + 1
+        FROM TASKCLOSURE A, TASKCLOSURE D
+        WHERE A.DESCENDANT = new.PARENT AND D.ANCESTOR = new.TASK;
+    END
+""",
+        """
+    CREATE TRIGGER IF NOT EXISTS TASK_MOVED
+    AFTER UPDATE OF PARENT ON TASK BEGIN
+        UPDATE REVISION SET REVISION = REVISION + 1;
+        UPDATE TASK SET CHANGED = (SELECT REVISION FROM REVISION)
+        WHERE TASK = new.TASK;
+    END
+""",
+        # Children of a deleted task move up to its parent.
+        """
+    CREATE TRIGGER IF NOT EXISTS TASKCLOSURE_DELETED
+    AFTER DELETE ON TASK BEGIN
+        DELETE FROM TASKCLOSURE
+        WHERE ANCESTOR = old.TASK OR DESCENDANT = old.TASK;
+        UPDATE TASK SET PARENT = old.PARENT WHERE PARENT = old.TASK;
+    END
+""",
+    )
+
+    # Orderings for sorted(), each backed by an index
+    ORDERINGS = {
+        'name': "NAME",
+        'total': "TOTAL_SECONDS DESC",
+        'count': "INTERVAL_COUNT DESC",
+        'recent': "LAST_WORKED DESC",
+    }
+
+    CREATE = _statement(
+        'tasks.create',
+        "INSERT INTO TASK(NAME, DESCRIPTION, PARENT) VALUES(?, ?, ?)")
+    IS_DESCENDANT = _statement(
+        'tasks.is_descendant',
+        "SELECT 1 FROM TASKCLOSURE WHERE ANCESTOR = ? AND DESCENDANT = ?")
+    MOVE = _statement('tasks.move',
+                      "UPDATE TASK SET PARENT = ? WHERE TASK = ?")
+    CHILD = _statement(
+        'tasks.child',
+        "SELECT {} FROM TASK WHERE PARENT IS ? AND NAME = ? ORDER BY TASK"
+        " LIMIT 1".format(Task.columns()))
+    PATH = _statement(
+        'tasks.path',
+        "SELECT T.NAME FROM TASKCLOSURE C JOIN TASK T ON T.TASK = C.ANCESTOR"
+        " WHERE C.DESCENDANT = ? ORDER BY C.DEPTH DESC")
+    DESCENDANTS = _statement(
+        'tasks.descendants',
+        "SELECT {} FROM TASKCLOSURE C JOIN TASK T ON T.TASK = C.DESCENDANT"
+        " WHERE C.ANCESTOR = ? ORDER BY C.DEPTH, T.TASK"
+        .format(Task.columns("T")))
+    SUBTREE_TOTALS = _statement(
+        'tasks.subtree_totals',
+        "SELECT COALESCE(SUM(T.TOTAL_SECONDS), 0),"
+        " COALESCE(SUM(T.INTERVAL_COUNT), 0) FROM TASKCLOSURE C JOIN TASK T"
+        " ON T.TASK = C.DESCENDANT WHERE C.ANCESTOR = ?")
+    UPDATE = _statement(
+        'tasks.update',
+        "UPDATE TASK SET NAME = ?, DESCRIPTION = ? WHERE TASK = ?")
+    BY_NAME = _statement(
+        'tasks.by_name',
+        "SELECT {} FROM TASK WHERE NAME LIKE ?".format(Task.columns()))
+    ALL = _statement('tasks.all',
+                     "SELECT {} FROM TASK".format(Task.columns()))
+    NAMES = _statement('tasks.names',
+                       "SELECT DISTINCT NAME FROM TASK ORDER BY NAME")
+    SORTED = dict(
+        (by, _statement('tasks.sorted.' + by,
+                        "SELECT {} FROM TASK ORDER BY {} LIMIT ?"
+                        .format(Task.columns(), order)))
+        for by, order in sorted(ORDERINGS.items()))
+    NAMED = _statement(
+        'tasks.named',
+        "SELECT {} FROM TASK WHERE NAME = ? ORDER BY TASK"
+        .format(Task.columns()))
+    MERGE_INTERVALS = _statement(
+        'tasks.merge.intervals',
+        "UPDATE TASKINTERVAL SET TASK = ? WHERE TASK IN ({})")
+    # Ancestors of target stay where they are, moving them below target
+    # would make a cycle.
+    MERGE_CHILDREN = _statement(
+        'tasks.merge.children',
+        "UPDATE TASK SET PARENT = ? WHERE PARENT IN ({}) AND TASK NOT IN"
+        " (SELECT ANCESTOR FROM TASKCLOSURE WHERE DESCENDANT = ?)")
+    MERGE_DELETE = _statement('tasks.merge.delete',
+                              "DELETE FROM TASK WHERE TASK IN ({})")
+    RENAME_PATTERN = _statement(
+        'tasks.rename.pattern',
+        "UPDATE TASK SET NAME = REPLACE(NAME, ?, ?) WHERE INSTR(NAME, ?) > 0")
+    RENAME = _statement('tasks.rename',
+                        "UPDATE TASK SET NAME = ? WHERE NAME = ?")
+    PAGE = _statement(
+        'tasks.page',
+        "SELECT {} FROM TASK WHERE TASK > ? ORDER BY TASK LIMIT ?"
+        .format(Task.columns()))
+    BY_ID = _statement(
+        'tasks.by_id',
+        "SELECT {} FROM TASK WHERE TASK = ?".format(Task.columns()))
+
     @dumb_constructor
     def __init__(self, conn):
         """Create a Tasks repository. This will attempt to register the schema.
@@ -86,19 +444,97 @@ class Tasks(ClosesCursor):
         - `conn`: sqlite3 database connection.
         """
         with self.cursor() as cursor:
-            _execute_with_except(cursor, Tasks.SCHEMA)
+            _migrate(cursor, Tasks.SCHEMA, Tasks.MIGRATIONS)
 
-    def create(self, name, description=None):
+    def create(self, name, description=None, parent=None):
         """Create a Task and return a valid instance stored in the db.
 
         Arguments:
         - `name`: The name of the task.
         - `description`: An optional description of the task.
+        - `parent`: An optional parent task.
+        """
+        parent_id = None if parent is None else parent.task_id
+        with self.cursor() as cursor:
+            cursor.execute(Tasks.CREATE, (name, description, parent_id))
+            return Task(cursor.lastrowid, name, description,
+                        parent=parent_id)
+
+    def move(self, task, parent):
+        """Make task a child of parent, along with all of its descendants.
+
+        Raises TaskCycle if parent is task or one of its descendants.
+
+        Arguments:
+        - `task`: the task to move.
+        - `parent`: the new parent task, None to make task a top level task.
+        """
+        parent_id = None if parent is None else parent.task_id
+        with self.cursor() as cursor:
+            cursor.execute(Tasks.IS_DESCENDANT, (task.task_id, parent_id))
+            if cursor.fetchone():
+                raise TaskCycle("Can not move {} below {}, it is one of its"
+                                " descendants".format(task.name, parent.name))
+            cursor.execute(Tasks.MOVE, (parent_id, task.task_id))
+        task.parent = parent_id
+
+    def resolve(self, path, create=False):
+        """Find the task at path, a task name or names separated by
+        Task.SEPARATOR like project/task.
+
+        Each step is a lookup on the TASK_PARENT_NAME index. Returns None
+        if there is no such task, unless create is True, in which case the
+        missing tasks along the path are created.
+
+        Arguments:
+        - `path`: the path of the task, starting at a top level task.
+        - `create`: whether to create missing tasks.
+        """
+        task = None
+        with self.cursor() as cursor:
+            for name in path.split(Task.SEPARATOR):
+                parent_id = None if task is None else task.task_id
+                cursor.execute(Tasks.CHILD, (parent_id, name))
+                row = cursor.fetchone()
+                if row is not None:
+                    task = Task.map_row(row)
+                elif create:
+                    task = self.create(name, parent=task)
+                else:
+                    return None
+        return task
+
+    def path(self, task):
+        """The path of task, the names of its ancestors and its own name
+        separated by Task.SEPARATOR.
+
+        Arguments:
+        - `task`: the task to find the path of.
+        """
+        with self.cursor() as cursor:
+            cursor.execute(Tasks.PATH, (task.task_id,))
+            return Task.SEPARATOR.join(row[0] for row in cursor.fetchall())
+
+    def descendants(self, task):
+        """Retrieve task and all tasks below it, nearest first.
+
+        Arguments:
+        - `task`: the task at the top of the subtree.
         """
         with self.cursor() as cursor:
-            cursor.execute("INSERT INTO TASK(NAME, DESCRIPTION)"
-                           "VALUES(?, ?)", (name, description))
-            return Task(cursor.lastrowid, name, description)
+            cursor.execute(Tasks.DESCENDANTS, (task.task_id,))
+            return [Task.map_row(row) for row in cursor.fetchall()]
+
+    def subtree_totals(self, task):
+        """The (total_seconds, interval_count) of task and all tasks below
+        it, summed from the running totals in one join.
+
+        Arguments:
+        - `task`: the task at the top of the subtree.
+        """
+        with self.cursor() as cursor:
+            cursor.execute(Tasks.SUBTREE_TOTALS, (task.task_id,))
+            return tuple(cursor.fetchone())
 
     def update(self, task):
         """Update a task in the database.
@@ -107,9 +543,8 @@ class Tasks(ClosesCursor):
         - `task`: The task to update.
         """
         with self.cursor() as cursor:
-            cursor.execute("UPDATE TASK SET NAME = ?, DESCRIPTION = ?"
-                           "WHERE TASK = ?",
-                           (task.name, task.description, task.task_id))
+            cursor.execute(Tasks.UPDATE, (task.name, task.description,
+                                          task.task_id))
 
     def by_name(self, name):
         """Attempt to find tasks by their name.
@@ -119,16 +554,109 @@ class Tasks(ClosesCursor):
         """
         name_like = "%{}%".format(name)
         with self.cursor() as cursor:
-            cursor.execute("SELECT TASK, NAME, DESCRIPTION FROM"
-                           " TASK WHERE NAME LIKE ?", (name_like,))
+            cursor.execute(Tasks.BY_NAME, (name_like,))
             return [Task.map_row(row) for row in cursor.fetchall()]
 
     def all(self):
         """Retrieve all tasks in the database."""
         with self.cursor() as cursor:
-            cursor.execute("SELECT TASK, NAME, DESCRIPTION FROM TASK")
+            cursor.execute(Tasks.ALL)
+            return [Task.map_row(row) for row in cursor.fetchall()]
+
+    def names(self):
+        """Retrieve the distinct names of all tasks, in sorted order."""
+        with self.cursor() as cursor:
+            cursor.execute(Tasks.NAMES)
+            return [row[0] for row in cursor.fetchall()]
+
+    def sorted(self, by='name', limit=None):
+        """Retrieve tasks in the order of one of the ORDERINGS.
+
+        Arguments:
+        - `by`: name of the ordering.
+        - `limit`: the maximum number of tasks to retrieve.
+        """
+        if by not in Tasks.ORDERINGS:
+            raise ValueError("Can not sort tasks by {}".format(by))
+        with self.cursor() as cursor:
+            cursor.execute(Tasks.SORTED[by],
+                           (-1 if limit is None else limit,))
             return [Task.map_row(row) for row in cursor.fetchall()]
 
+    def named(self, name):
+        """Find all tasks with exactly this name, oldest first.
+
+        Arguments:
+        - `name`: the name to search for.
+        """
+        with self.cursor() as cursor:
+            cursor.execute(Tasks.NAMED, (name,))
+            return [Task.map_row(row) for row in cursor.fetchall()]
+
+    def merge(self, target, sources):
+        """Merge sources into target.
+
+        All task intervals and child tasks of sources are moved to target
+        and sources are deleted. This uses one statement per few hundred
+        tasks rather than one per task, and does not commit.
+
+        Returns the number of task intervals that were moved.
+
+        Arguments:
+        - `target`: the task to keep.
+        - `sources`: the tasks to merge into target.
+        """
+        ids = set(task.task_id for task in sources) - set([target.task_id])
+        moved = 0
+        with self.cursor() as cursor:
+            for chunk in _chunks(sorted(ids)):
+                placeholders = _placeholders(chunk)
+                cursor.execute(Tasks.MERGE_INTERVALS.format(placeholders),
+                               [target.task_id] + chunk)
+                moved += cursor.rowcount
+                cursor.execute(Tasks.MERGE_CHILDREN.format(placeholders),
+                               [target.task_id] + chunk + [target.task_id])
+                cursor.execute(Tasks.MERGE_DELETE.format(placeholders), chunk)
+        return moved
+
+    def rename(self, old, new, pattern=False):
+        """Rename tasks, returning the number of renamed tasks.
+
+        Arguments:
+        - `old`: name of the tasks to rename.
+        - `new`: the new name.
+        - `pattern`: when True, replace every occurrence of old in the
+          name of every task with new instead of matching whole names.
+        """
+        with self.cursor() as cursor:
+            if pattern:
+                cursor.execute(Tasks.RENAME_PATTERN, (old, new, old))
+            else:
+                cursor.execute(Tasks.RENAME, (new, old))
+            return cursor.rowcount
+
+    def page(self, token=None, limit=50):
+        """Retrieve tasks a page at a time, ordered by id.
+
+        Returns a list of tasks and a continuation token to pass in to
+        retrieve the next page, the token is None on the last page. Every
+        page is a range read on the primary key, so deep pages are as
+        cheap as the first one.
+
+        Arguments:
+        - `token`: continuation token from the previous page, if any.
+        - `limit`: the maximum number of tasks on the page.
+        """
+        _check_limit(limit)
+        after, = _decode_token(token, 1) if token is not None else (-1,)
+        with self.cursor() as cursor:
+            cursor.execute(Tasks.PAGE, (after, limit + 1))
+            tasks = [Task.map_row(row) for row in cursor.fetchall()]
+        if len(tasks) <= limit:
+            return tasks, None
+        tasks = tasks[:limit]
+        return tasks, _encode_token([tasks[-1].task_id])
+
     def by_id(self, id_):
         """Find a task with a given id.
 
@@ -138,8 +666,7 @@ class Tasks(ClosesCursor):
         - `id_`: The id of the task to retrieve.
         """
         with self.cursor() as cursor:
-            cursor.execute("SELECT TASK, NAME, DESCRIPTION FROM TASK WHERE"
-                           " TASK = ?", (id_,))
+            cursor.execute(Tasks.BY_ID, (id_,))
             row = cursor.fetchone()
             if not row:
                 raise KeyError("No Task with id: {}".format(id_))
@@ -177,6 +704,52 @@ class TaskInterval(DefaultRepr):
     def map_row(cls, task, row):
         return cls(task, *row)
 
+# Task intervals along with the columns of their task, for
+# TaskIntervals._joined()
+JOINED = ("SELECT {}, I.TASKINTERVAL, I.START_TIME, I.STOP_TIME FROM "
+          "TASKINTERVAL I JOIN TASK T ON T.TASK = I.TASK"
+          .format(Task.columns("T")))
+
+def _stream_sql(start, end):
+    """The statement of TaskIntervals.stream() with or without a start
+    and an end."""
+    where = []
+    before_end = ""
+    if end:
+        before_end = " AND START_TIME < :end"
+        where.append("I.START_TIME < :end")
+    if start:
+        # Intervals do not overlap, so the only interval starting
+        # before start that can reach into the window is the last one.
+        where.append("""I.TASKINTERVAL IN (
+            SELECT TASKINTERVAL FROM (
+                SELECT TASKINTERVAL, STOP_TIME FROM TASKINTERVAL
+                WHERE START_TIME < :start
+                ORDER BY START_TIME DESC LIMIT 1)
+            WHERE STOP_TIME IS NULL OR STOP_TIME > :start
+            UNION ALL
+            SELECT TASKINTERVAL FROM TASKINTERVAL
+            WHERE START_TIME >= :start{})""".format(before_end))
+    return ("{} {} ORDER BY I.START_TIME, I.TASKINTERVAL"
+            .format(JOINED, "WHERE " + " AND ".join(where) if where else ""))
+
+def _page_sql(token, since, until):
+    """The statement of TaskIntervals.page() with or without a token, a
+    since and an until."""
+    where = []
+    if token:
+        where.append("(I.START_TIME, I.TASKINTERVAL) > (:start, :interval)")
+    if since:
+        where.append("I.START_TIME >= :since")
+    if until:
+        where.append("I.START_TIME < :until")
+    return ("{} {} ORDER BY I.START_TIME, I.TASKINTERVAL LIMIT :limit"
+            .format(JOINED, "WHERE " + " AND ".join(where) if where else ""))
+
+def _variant(name, flags):
+    """Name of the variant of a statement with flags set."""
+    return name + "".join(".{:d}".format(flag) for flag in flags)
+
 class TaskIntervals(ClosesCursor):
     """Repository to use for accessing, creating and updating TaskIntervals.
     """
@@ -191,9 +764,147 @@ class TaskIntervals(ClosesCursor):
         FOREIGN KEY(TASK) REFERENCES TASK(TASK)
     );
 """
+    MIGRATIONS = (
+        "CREATE INDEX IF NOT EXISTS TASKINTERVAL_TASK"
+        " ON TASKINTERVAL(TASK, START_TIME)",
+        "CREATE INDEX IF NOT EXISTS TASKINTERVAL_START"
+        " ON TASKINTERVAL(START_TIME)",
+        "ALTER TABLE TASKINTERVAL ADD COLUMN CHANGED INTEGER NOT NULL"
+        " DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS TASKINTERVAL_CHANGED"
+        " ON TASKINTERVAL(CHANGED)",
+        """
+    CREATE TRIGGER IF NOT EXISTS TASKINTERVAL_INSERTED
+    AFTER INSERT ON TASKINTERVAL BEGIN
+        UPDATE REVISION SET REVISION = REVISION + 1;
+        UPDATE TASKINTERVAL SET CHANGED = (SELECT REVISION FROM REVISION)
+        WHERE TASKINTERVAL = new.TASKINTERVAL;
+    END
+""",
+        """
+    CREATE TRIGGER IF NOT EXISTS TASKINTERVAL_UPDATED
+    AFTER UPDATE OF TASK, START_TIME, STOP_TIME ON TASKINTERVAL BEGIN
+        UPDATE REVISION SET REVISION = REVISION + 1;
+        UPDATE TASKINTERVAL SET CHANGED = (SELECT REVISION FROM REVISION)
+        WHERE TASKINTERVAL = new.TASKINTERVAL;
+    END
+""",
+        """
+    CREATE TRIGGER IF NOT EXISTS TASKINTERVAL_DELETED
+    AFTER DELETE ON TASKINTERVAL BEGIN
+        UPDATE REVISION SET REVISION = REVISION + 1;
+    END
+""",
+        """
+    CREATE TRIGGER IF NOT EXISTS TASKINTERVAL_TOTALS_INSERTED
+    AFTER INSERT ON TASKINTERVAL BEGIN
+        UPDATE TASK SET
+            TOTAL_SECONDS = TOTAL_SECONDS
+                + COALESCE(new.STOP_TIME - new.START_TIME, 0),
+            INTERVAL_COUNT = INTERVAL_COUNT + 1,
+            LAST_WORKED = MAX(COALESCE(LAST_WORKED, 0),
+                              COALESCE(new.STOP_TIME, new.START_TIME))
+        WHERE TASK = new.TASK;
+    END
+""",
+        # LAST_WORKED is only looked up again when the interval it came
+        # from was changed.
+        """
+    CREATE TRIGGER IF NOT EXISTS TASKINTERVAL_TOTALS_UPDATED
+    AFTER UPDATE OF TASK, START_TIME, STOP_TIME ON TASKINTERVAL BEGIN
+        UPDATE TASK SET
+            TOTAL_SECONDS = TOTAL_SECONDS
+                - COALESCE(old.STOP_TIME - old.START_TIME, 0),
+            INTERVAL_COUNT = INTERVAL_COUNT - 1,
+            LAST_WORKED = CASE
+                WHEN LAST_WORKED > COALESCE(old.STOP_TIME, old.START_TIME)
+                THEN LAST_WORKED
+                ELSE (SELECT MAX(COALESCE(STOP_TIME, START_TIME))
+                      FROM TASKINTERVAL WHERE TASK = old.TASK) END
+        WHERE TASK = old.TASK;
+        UPDATE TASK SET
+            TOTAL_SECONDS = TOTAL_SECONDS
+                + COALESCE(new.STOP_TIME - new.START_TIME, 0),
+            INTERVAL_COUNT = INTERVAL_COUNT + 1,
+            LAST_WORKED = MAX(COALESCE(LAST_WORKED, 0),
+                              COALESCE(new.STOP_TIME, new.START_TIME))
+        WHERE TASK = new.TASK;
+    END
+""",
+        """
+    CREATE TRIGGER IF NOT EXISTS TASKINTERVAL_TOTALS_DELETED
+    AFTER DELETE ON TASKINTERVAL BEGIN
+        UPDATE TASK SET
+            TOTAL_SECONDS = TOTAL_SECONDS
+                - COALESCE(old.STOP_TIME - old.START_TIME, 0),
+            INTERVAL_COUNT = INTERVAL_COUNT - 1,
+            LAST_WORKED = CASE
+                WHEN LAST_WORKED > COALESCE(old.STOP_TIME, old.START_TIME)
+                THEN LAST_WORKED
+                ELSE (SELECT MAX(COALESCE(STOP_TIME, START_TIME))
+                      FROM TASKINTERVAL WHERE TASK = old.TASK) END
+        WHERE TASK = old.TASK;
+    END
+""",
+        # Open intervals, so in_progress() does not scan every interval
+        "CREATE INDEX IF NOT EXISTS TASKINTERVAL_OPEN ON TASKINTERVAL(TASK)"
+        " WHERE STOP_TIME IS NULL",
+    )
+
+    START = _statement(
+        'intervals.start',
+        "INSERT INTO TASKINTERVAL(TASK, START_TIME) VALUES(?, ?)")
+    # Intervals do not overlap, so only the last interval starting before
+    # a time can contain it.
+    OVERLAP = _statement(
+        'intervals.overlap',
+        "SELECT TASK, START_TIME, STOP_TIME FROM (SELECT TASK, START_TIME,"
+        " STOP_TIME FROM TASKINTERVAL WHERE START_TIME < ? ORDER BY"
+        " START_TIME DESC LIMIT 1) WHERE STOP_TIME > ?")
+    LATER = _statement(
+        'intervals.later',
+        "SELECT TASK, START_TIME, STOP_TIME FROM TASKINTERVAL"
+        " WHERE START_TIME >= ? LIMIT 1")
+    INSIDE = _statement(
+        'intervals.inside',
+        "SELECT TASK, START_TIME, STOP_TIME FROM TASKINTERVAL"
+        " WHERE START_TIME >= ? AND START_TIME < ? LIMIT 1")
+    ADD = _statement(
+        'intervals.add',
+        "INSERT INTO TASKINTERVAL(TASK, START_TIME, STOP_TIME)"
+        " VALUES(?, ?, ?)")
+    STARTED_AT = _statement(
+        'intervals.started_at',
+        "SELECT 1 FROM TASKINTERVAL WHERE START_TIME = ?")
+    LATEST = _statement(
+        'intervals.latest',
+        "SELECT TASKINTERVAL, START_TIME FROM TASKINTERVAL WHERE TASK = ?"
+        " AND START_TIME = (SELECT MAX(START_TIME) FROM TASKINTERVAL"
+        " WHERE TASK = ?)")
+    STOP = _statement(
+        'intervals.stop',
+        "UPDATE TASKINTERVAL SET STOP_TIME = ? WHERE TASKINTERVAL = ?")
+    JOINED = JOINED
+    # By whether there is a start and an end
+    STREAM = dict(
+        (flags, _statement(_variant('intervals.stream', flags),
+                           _stream_sql(*flags)))
+        for flags in itertools.product((False, True), repeat=2))
+    FOR_TASK = _statement(
+        'intervals.for_task',
+        "SELECT TASKINTERVAL, START_TIME, STOP_TIME FROM TASKINTERVAL"
+        " WHERE TASK = ? ORDER BY TASKINTERVAL")
+    # By whether there is a token, a since and an until
+    PAGE = dict(
+        (flags, _statement(_variant('intervals.page', flags),
+                           _page_sql(*flags)))
+        for flags in itertools.product((False, True), repeat=3))
+    IN_PROGRESS = _statement(
+        'intervals.in_progress',
+        "{} WHERE I.STOP_TIME IS NULL".format(JOINED))
 
     @dumb_constructor
-    def __init__(self, conn, tasks=None):
+    def __init__(self, conn, tasks=None, stats=None):
         """Create a TaskIntervals repository.
 
         This will attempt to register the schema.
@@ -201,11 +912,13 @@ class TaskIntervals(ClosesCursor):
         Arguments:
         - `conn`: sqlite3 database connection.
         - `tasks`: Tasks repository - if None, one will be created.
+        - `stats`: optional stats.Stats repository to tell about stopped
+          task intervals.
         """
         if tasks is None:
             self.tasks = Tasks(conn)
         with self.cursor() as cursor:
-            _execute_with_except(cursor, TaskIntervals.SCHEMA)
+            _migrate(cursor, TaskIntervals.SCHEMA, TaskIntervals.MIGRATIONS)
 
     def start(self, task, when=None):
         """Start working on a task.
@@ -221,19 +934,94 @@ class TaskIntervals(ClosesCursor):
                                          " starting on new task."
                                          .format(in_progress))
         when = time.time() if when is None else when
+        self.check_overlap(when)
+        with self.cursor() as cursor:
+            cursor.execute(TaskIntervals.START, (task.task_id, when))
+            return TaskInterval(task, cursor.lastrowid, when)
+
+    def check_overlap(self, when):
+        """Raise InconsistentTaskIntervals if when is inside a stopped
+        task interval.
+
+        Arguments:
+        - `when`: unix time to check.
+        """
         with self.cursor() as cursor:
-            cursor.execute("SELECT TASK, START_TIME, STOP_TIME FROM "
-                           "TASKINTERVAL WHERE START_TIME < ? AND "
-                           "STOP_TIME > ?", (when, when))
+            cursor.execute(TaskIntervals.OVERLAP, (when, when))
             rows = cursor.fetchall()
             if rows:
                 task, start, stop = rows[0]
                 message = ("Already an interal from {} to {} working on task {}"
                            .format(start, stop, task))
                 raise InconsistentTaskIntervals(message)
-            sql = "INSERT INTO TASKINTERVAL(TASK, START_TIME) VALUES(?, ?)"
-            cursor.execute(sql, (task.task_id, when))
-            return TaskInterval(task, cursor.lastrowid, when)
+
+    def check_range(self, start, stop=None):
+        """Raise InconsistentTaskIntervals if any task interval overlaps
+        the time from start to stop.
+
+        Arguments:
+        - `start`: unix time the range starts at.
+        - `stop`: unix time the range stops at, None if it is open.
+        """
+        self.check_overlap(start)
+        with self.cursor() as cursor:
+            if stop is None:
+                cursor.execute(TaskIntervals.LATER, (start,))
+            else:
+                cursor.execute(TaskIntervals.INSIDE, (start, stop))
+            row = cursor.fetchone()
+            if row:
+                task, other_start, other_stop = row
+                message = ("Already an interal from {} to {} working on task {}"
+                           .format(other_start, other_stop, task))
+                raise InconsistentTaskIntervals(message)
+
+    def check_add(self, start, stop=None):
+        """Raise a TrackitException if add() would refuse this interval.
+
+        Arguments:
+        - `start`: unix time the task was started.
+        - `stop`: unix time the task was stopped, None if in progress.
+        """
+        current = self.in_progress()
+        if current is not None and stop is None:
+            raise TooManyTasksInProgress("Already a task in progress, can"
+                                         " not add another one.")
+        if current is not None and current.start_time < stop:
+            message = ("{} is in progress since before {}"
+                       .format(current.task, stop))
+            raise InconsistentTaskIntervals(message)
+        if stop is not None and stop <= start:
+            message = ("Start time is {} which is *after* stop time: {}"
+                       .format(start, stop))
+            raise InconsistentTaskIntervals(message)
+        self.check_range(start, stop)
+
+    def add(self, task, start, stop=None):
+        """Add a task interval that may be in the past.
+
+        This validates like start() does, and also refuses intervals that
+        overlap any later task interval.
+
+        Arguments:
+        - `task`: the task that was worked on.
+        - `start`: unix time the task was started.
+        - `stop`: unix time the task was stopped, None if in progress.
+        """
+        self.check_add(start, stop)
+        with self.cursor() as cursor:
+            cursor.execute(TaskIntervals.ADD, (task.task_id, start, stop))
+            return TaskInterval(task, cursor.lastrowid, start, stop)
+
+    def started_at(self, when):
+        """True if some task interval started at exactly this time.
+
+        Arguments:
+        - `when`: unix time to check.
+        """
+        with self.cursor() as cursor:
+            cursor.execute(TaskIntervals.STARTED_AT, (when,))
+            return cursor.fetchone() is not None
 
     def stop(self, task, when=None):
         """Stop working on a task.
@@ -242,13 +1030,9 @@ class TaskIntervals(ClosesCursor):
         - `task`: the task to stop working on.
         - `when`: unix time for when task was stopped."""
 
-        latest = ("SELECT TASKINTERVAL, START_TIME FROM TASKINTERVAL "
-                  "WHERE TASK = ? AND START_TIME = "
-                  "(SELECT MAX(START_TIME) FROM TASKINTERVAL WHERE TASK = ?)")
         when = time.time() if when is None else when
-        stop = "UPDATE TASKINTERVAL SET STOP_TIME = ? WHERE TASKINTERVAL = ?"
         with self.cursor() as cursor:
-            cursor.execute(latest, (task.task_id, task.task_id))
+            cursor.execute(TaskIntervals.LATEST, (task.task_id, task.task_id))
             row = cursor.fetchone()
             if not row:
                 raise NoTaskInProgress("No work in progress on task: {}"
@@ -258,8 +1042,49 @@ class TaskIntervals(ClosesCursor):
                 message = ("Start time is {} which is *after* stop time: {}"
                            .format(start_time, when))
                 raise InconsistentTaskIntervals(message)
-            cursor.execute(stop, (when, interval_id))
-            return TaskInterval(task, interval_id, start_time, when)
+            cursor.execute(TaskIntervals.STOP, (when, interval_id))
+        stopped = TaskInterval(task, interval_id, start_time, when)
+        if self.stats is not None:
+            self.stats.stopped(stopped)
+        return stopped
+
+    def _joined(self, sql, params):
+        """Generator of the task intervals selected by sql, which must
+        select the columns of JOINED. Intervals of the same task share one
+        Task instance."""
+        tasks = {}
+        width = len(Task.COLUMNS)
+        with self.cursor() as cursor:
+            cursor.execute(sql, params)
+            for row in cursor:
+                task = tasks.get(row[0])
+                if task is None:
+                    task = tasks[row[0]] = Task.map_row(row[:width])
+                yield TaskInterval.map_row(task, row[width:])
+
+    def stream(self, start=None, end=None):
+        """Generator of the task intervals overlapping the time from start
+        to end, ordered by start time.
+
+        Intervals and their tasks are read with one query, as they are
+        consumed. The intervals of a task share one Task instance.
+
+        Arguments:
+        - `start`: unix time the window starts at, None for the beginning.
+        - `end`: unix time the window ends at, None for no end.
+        """
+        sql = TaskIntervals.STREAM[start is not None, end is not None]
+        return self._joined(sql, {'start': start, 'end': end})
+
+    def between(self, start=None, end=None):
+        """Extract the task intervals overlapping the time from start to
+        end, ordered by start time. See stream().
+
+        Arguments:
+        - `start`: unix time the window starts at, None for the beginning.
+        - `end`: unix time the window ends at, None for no end.
+        """
+        return list(self.stream(start, end))
 
     def for_task(self, task):
         """Extract all task intervals spent working on some task.
@@ -267,34 +1092,67 @@ class TaskIntervals(ClosesCursor):
         Arguments:
         - `task`: the task to extract intervals for.
         """
-        sql = ("SELECT TASKINTERVAL, START_TIME, STOP_TIME "
-               "FROM TASKINTERVAL WHERE TASK = ? ORDER BY TASKINTERVAL")
         with self.cursor() as cursor:
-            cursor.execute(sql, (task.task_id,))
+            cursor.execute(TaskIntervals.FOR_TASK, (task.task_id,))
             return [TaskInterval.map_row(task, row)
                     for row in cursor.fetchall()]
 
+    def page(self, token=None, limit=50, since=None, until=None):
+        """Retrieve task intervals a page at a time, ordered by start time.
+
+        Returns a list of task intervals and a continuation token to pass
+        in to retrieve the next page, the token is None on the last page.
+        Pages are range reads on the (START_TIME, TASKINTERVAL) position
+        of the last interval, so deep pages are as cheap as the first one.
+
+        Arguments:
+        - `token`: continuation token from the previous page, if any.
+        - `limit`: the maximum number of intervals on the page.
+        - `since`: only include intervals starting at or after this time.
+        - `until`: only include intervals starting before this time.
+        """
+        _check_limit(limit)
+        params = {'since': since, 'until': until, 'limit': limit + 1}
+        if token is not None:
+            params['start'], params['interval'] = _decode_token(token, 2)
+        sql = TaskIntervals.PAGE[token is not None, since is not None,
+                                 until is not None]
+        intervals = list(self._joined(sql, params))
+        if len(intervals) <= limit:
+            return intervals, None
+        intervals = intervals[:limit]
+        last = intervals[-1]
+        return intervals, _encode_token([last.start_time, last.task_interval])
+
     def in_progress(self):
         """Extract the task interval currently in progress."""
 
-        interval_sql = ("SELECT TASK, TASKINTERVAL, START_TIME, STOP_TIME "
-                        "FROM TASKINTERVAL "
-                        "WHERE STOP_TIME IS NULL")
-        with self.cursor() as cursor:
-            cursor.execute(interval_sql)
-            rows = cursor.fetchall()
-            if len(rows) > 1:
-                message = ("Should only have one task in progress but found: {}"
-                           .format(rows))
-                raise TooManyTasksInProgress(message)
-            if not rows:
-                return None
-            task_id, interval = rows[0][0], rows[0][1:]
-            task = self.tasks.by_id(task_id)
-            return TaskInterval.map_row(task, interval)
+        intervals = list(self._joined(TaskIntervals.IN_PROGRESS, ()))
+        if len(intervals) > 1:
+            message = ("Should only have one task in progress but found: {}"
+                       .format(intervals))
+            raise TooManyTasksInProgress(message)
+        return intervals[0] if intervals else None
 
 class Data(object):
-    def __init__(self, conn):
-        self.tasks = Tasks(conn)
-        self.intervals = TaskIntervals(conn)
+    """The tasks and task intervals repositories of a storage backend.
+
+    A backend is a pair of repositories with the methods of Tasks and
+    TaskIntervals. By default these are the SQLite repositories on conn,
+    trackit.memory has a backend that keeps everything in memory. Code
+    running SQL of its own against conn, like the reports, needs SQLite.
+    """
+
+    def __init__(self, conn, tasks=None, intervals=None):
+        """Create Data.
+
+        Arguments:
+        - `conn`: sqlite3 database connection, None for other backends.
+        - `tasks`: Tasks repository - if None, one is created on conn.
+        - `intervals`: TaskIntervals repository - if None, one is created
+          on conn.
+        """
+        self.tasks = Tasks(conn) if tasks is None else tasks
+        self.intervals = TaskIntervals(conn) if intervals is None \
+            else intervals
         self.conn = conn
@@ -0,0 +1,134 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Integrity checks for task intervals.
+
+Task intervals are read in order of START_TIME and swept once. Only the
+interval reaching furthest into the future and the last open interval
+are remembered, so an interval overlaps an earlier one exactly when it
+starts before the furthest reach so far.
+"""
+
+from contextlib import closing
+
+from trackit.util import dumb_constructor, DefaultRepr
+
+# Kinds of problems
+OVERLAP = 'overlap'
+NEGATIVE = 'negative'
+OPEN = 'open'
+ORPHAN = 'orphan'
+
+# Stands in for the stop time of an open interval
+FOREVER = float('inf')
+
+RECOMPUTE_TOTALS = """
+    UPDATE TASK SET
+        TOTAL_SECONDS = (SELECT COALESCE(SUM(STOP_TIME - START_TIME), 0)
+                         FROM TASKINTERVAL I WHERE I.TASK = TASK.TASK),
+        INTERVAL_COUNT = (SELECT COUNT(*) FROM TASKINTERVAL I
+                          WHERE I.TASK = TASK.TASK),
+        LAST_WORKED = (SELECT MAX(COALESCE(STOP_TIME, START_TIME))
+                       FROM TASKINTERVAL I WHERE I.TASK = TASK.TASK)
+    WHERE TASK = ?
+"""
+
+
+class Problem(DefaultRepr):
+    """A problem with the task interval task_interval.
+
+    For overlaps and open intervals, other is the earlier task interval
+    that is overlapped or still open, and at is the start of
+    task_interval. For orphans, other is the missing task.
+    """
+
+    @dumb_constructor
+    def __init__(self, kind, task_interval, other=None, at=None):
+        pass
+
+    def __str__(self):
+        if self.kind == OVERLAP:
+            return ("Task interval {} starts at {}, before task interval {}"
+                    " stops".format(self.task_interval, self.at, self.other))
+        elif self.kind == OPEN:
+            return ("Task interval {} is open, and so is task interval {}"
+                    .format(self.task_interval, self.other))
+        elif self.kind == NEGATIVE:
+            return ("Task interval {} stops before it starts"
+                    .format(self.task_interval))
+        return ("Task interval {} belongs to missing task {}"
+                .format(self.task_interval, self.other))
+
+
+def check(conn):
+    """Generator yielding every Problem with the task intervals in conn.
+
+    Arguments:
+    - `conn`: sqlite3 database connection.
+    """
+    sql = ("SELECT I.TASKINTERVAL, I.TASK, I.START_TIME, I.STOP_TIME, "
+           "T.TASK IS NULL FROM TASKINTERVAL I LEFT JOIN TASK T "
+           "ON T.TASK = I.TASK ORDER BY I.START_TIME, I.TASKINTERVAL")
+    reach, reach_stop = None, None
+    last_open = None
+    with closing(conn.cursor()) as cursor:
+        cursor.execute(sql)
+        for interval, task, start, stop, orphan in cursor:
+            if orphan:
+                yield Problem(ORPHAN, interval, task)
+            if stop is not None and stop < start:
+                yield Problem(NEGATIVE, interval)
+                continue
+            if reach is not None and start < reach_stop:
+                yield Problem(OVERLAP, interval, reach, start)
+            if stop is None:
+                if last_open is not None:
+                    yield Problem(OPEN, interval, last_open, start)
+                last_open = interval
+            stop = FOREVER if stop is None else stop
+            # Overlaps are repaired by stopping the reach at start, so
+            # the reach moves on to this interval either way.
+            if reach is None or start < reach_stop or stop > reach_stop:
+                reach, reach_stop = interval, stop
+
+
+def repair(conn, problems):
+    """Repair problems found by check(). Nothing is committed.
+
+    Negative intervals are deleted, overlapped intervals are stopped when
+    the interval overlapping them starts, or deleted if they started at
+    the same time, and missing tasks are recreated with a made up name.
+    Returns the number of problems that needed a change.
+
+    Arguments:
+    - `conn`: sqlite3 database connection.
+    - `problems`: Problems returned by check(conn).
+    """
+    repaired = 0
+    with closing(conn.cursor()) as cursor:
+        for problem in problems:
+            if problem.kind == ORPHAN:
+                cursor.execute("INSERT OR IGNORE INTO TASK(TASK, NAME)"
+                               " VALUES(?, ?)", (problem.other,
+                                                 "Recovered task {}"
+                                                 .format(problem.other)))
+                cursor.execute(RECOMPUTE_TOTALS, (problem.other,))
+            elif problem.kind == NEGATIVE:
+                cursor.execute("DELETE FROM TASKINTERVAL WHERE TASKINTERVAL"
+                               " = ?", (problem.task_interval,))
+            elif problem.kind == OVERLAP:
+                cursor.execute("DELETE FROM TASKINTERVAL WHERE TASKINTERVAL"
+                               " = ? AND START_TIME >= ?",
+                               (problem.other, problem.at))
+                cursor.execute("UPDATE TASKINTERVAL SET STOP_TIME = ? WHERE"
+                               " TASKINTERVAL = ?", (problem.at, problem.other))
+            else:
+                # Open intervals are followed by an interval that overlaps
+                # them, repairing the overlap stops them.
+                continue
+            repaired += 1
+    return repaired
@@ -0,0 +1,334 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Append-only journal of start and stop events.
+
+Appending a record to a file is a lot cheaper than a commit to SQLite on
+slow file systems. Events are replayed into the database by compact(),
+in the transaction of the caller, and are only cleared from the journal
+once the caller has committed them. Clearing removes just the events that
+were replayed, under a lock that appending takes as well, so events that
+other processes append in the meantime are kept.
+"""
+
+import os
+import struct
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from trackit.data import (
+    TaskInterval, Task, TooManyTasksInProgress, NoTaskInProgress,
+    InconsistentTaskIntervals
+)
+from trackit.exceptions import TrackitException
+from trackit.util import Path
+
+START = 'S'
+STOP = 'P'
+
+# kind, unix time, length of the utf-8 encoded task path that follows
+HEADER = struct.Struct('<cdH')
+
+
+@contextmanager
+def _locked(path):
+    """Keep other processes from changing the journal file at path."""
+    if fcntl is None:
+        yield
+        return
+    with open('{}.lock'.format(path.path), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class Journal(object):
+    """A journal file of (kind, when, name) events."""
+
+    def __init__(self, path):
+        """Create a Journal. The file is created on the first append.
+
+        Arguments:
+        - `path`: Path of the journal file.
+        """
+        self.path = path
+
+    def append(self, kind, when, name=u''):
+        """Durably append an event to the journal.
+
+        Arguments:
+        - `kind`: START or STOP.
+        - `when`: unix time of the event.
+        - `name`: path of the task that was started, like project/task.
+        """
+        encoded = name.encode('utf-8')
+        record = HEADER.pack(kind, when, len(encoded)) + encoded
+        with _locked(self.path):
+            fd = os.open(self.path.path,
+                         os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            try:
+                os.write(fd, record)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _content(self):
+        try:
+            with open(self.path.path, 'rb') as inf:
+                return inf.read()
+        except IOError:
+            return ''
+
+    def events(self):
+        """All complete events in the journal, oldest first.
+
+        A partially written record at the end of the file is ignored."""
+        return self.read()[0]
+
+    def read(self):
+        """All complete events in the journal, oldest first, and the
+        number of bytes they take up at the start of the file."""
+        content = self._content()
+        events = []
+        offset = size = 0
+        while offset + HEADER.size <= len(content):
+            kind, when, length = HEADER.unpack_from(content, offset)
+            offset += HEADER.size
+            if offset + length > len(content):
+                break
+            name = content[offset:offset + length].decode('utf-8')
+            offset += length
+            events.append((kind, when, name))
+            size = offset
+        return events, size
+
+    def __len__(self):
+        return len(self.events())
+
+    def clear(self, size=None):
+        """Remove events from the start of the journal.
+
+        Arguments:
+        - `size`: bytes to remove, as returned by read(), None for all.
+        """
+        with _locked(self.path):
+            rest = '' if size is None else self._content()[size:]
+            if rest:
+                temporary = '{}.{}.tmp'.format(self.path.path, os.getpid())
+                with open(temporary, 'wb') as outf:
+                    outf.write(rest)
+                    outf.flush()
+                    os.fsync(outf.fileno())
+                os.rename(temporary, self.path.path)
+            elif self.path.exists():
+                os.unlink(self.path.path)
+
+
+class JournaledIntervals(object):
+    """TaskIntervals repository that writes start and stop to a Journal.
+
+    in_progress() and for_task() merge in the events that have not yet
+    been compacted into the database. Any other attribute is delegated to
+    the wrapped repository, compacting the journal first if there are
+    events it has not replayed, so that the repository sees every event.
+
+    Nothing is committed here. After committing, the caller clears the
+    compacted events from the journal with clear_compacted(), and after
+    rolling back it tells rolled_back().
+    """
+
+    def __init__(self, intervals, journal):
+        """Create a JournaledIntervals repository.
+
+        Arguments:
+        - `intervals`: the TaskIntervals repository to wrap.
+        - `journal`: the Journal to write events to.
+        """
+        self.intervals = intervals
+        self.journal = journal
+        self.rejected = Journal(Path(journal.path.path + '.rejected'))
+        # Bytes at the start of the journal compact() has replayed, None if
+        # there may be events it has not
+        self.compacted = None
+        self.rejections = []
+
+    def __getattr__(self, name):
+        if self.compacted is None:
+            self.compact()
+        return getattr(self.intervals, name)
+
+    def _task(self, path, create=False):
+        """The task at path, a Task without id if there is none and create
+        is False."""
+        task = self.intervals.tasks.resolve(path, create)
+        if task is None:
+            return Task(None, path, None)
+        return task
+
+    def _replay(self):
+        """Replay the journal on top of the database.
+
+        Returns the interval in progress, the intervals that only exist in
+        the journal and the database interval the journal stopped, if any.
+        """
+        current = self.intervals.in_progress()
+        pending = []
+        stopped = None
+        for kind, when, name in self.journal.events():
+            if kind == START:
+                current = TaskInterval(self._task(name), None, when)
+                pending.append(current)
+            elif current is not None:
+                if current.task_interval is None:
+                    current.stop_time = when
+                else:
+                    stopped = TaskInterval(current.task, current.task_interval,
+                                           current.start_time, when)
+                current = None
+        return current, pending, stopped
+
+    def in_progress(self):
+        """Extract the task interval currently in progress."""
+        return self._replay()[0]
+
+    def for_task(self, task):
+        """Extract all task intervals spent working on some task, including
+        the ones that are only in the journal.
+
+        Arguments:
+        - `task`: the task to extract intervals for.
+        """
+        _, pending, stopped = self._replay()
+        intervals = [stopped if stopped is not None and
+                     interval.task_interval == stopped.task_interval
+                     else interval
+                     for interval in self.intervals.for_task(task)]
+        return intervals + [interval for interval in pending
+                            if interval.task.task_id == task.task_id]
+
+    def start(self, task, when=None):
+        """Start working on a task by appending to the journal.
+
+        This validates the start like TaskIntervals.start() does.
+
+        Arguments:
+        - `task`: the task to start working on.
+        - `when`: unix-time for when task was started."""
+        assert task is not None, "may not start task None"
+        current, pending, stopped = self._replay()
+        if current is not None:
+            raise TooManyTasksInProgress("Must stop working on {} before"
+                                         " starting on new task."
+                                         .format(current))
+        when = time.time() if when is None else when
+        for interval in [stopped] + pending:
+            if (interval is not None and
+                    interval.start_time < when < interval.stop_time):
+                message = ("Already an interal from {} to {} working on task"
+                           " {}".format(interval.start_time,
+                                        interval.stop_time, interval.task))
+                raise InconsistentTaskIntervals(message)
+        self.intervals.check_overlap(when)
+        self.journal.append(START, when, self.intervals.tasks.path(task))
+        self.compacted = None
+        return TaskInterval(task, None, when)
+
+    def stop(self, task, when=None):
+        """Stop working on a task by appending to the journal.
+
+        Arguments:
+        - `task`: the task to stop working on.
+        - `when`: unix time for when task was stopped."""
+        current = self.in_progress()
+        if current is None or current.task.task_id != task.task_id:
+            raise NoTaskInProgress("No work in progress on task: {}"
+                                   .format(task))
+        when = time.time() if when is None else when
+        if current.start_time >= when:
+            message = ("Start time is {} which is *after* stop time: {}"
+                       .format(current.start_time, when))
+            raise InconsistentTaskIntervals(message)
+        self.journal.append(STOP, when)
+        self.compacted = None
+        return TaskInterval(current.task, current.task_interval,
+                            current.start_time, when)
+
+    def _check_start(self, when):
+        """Raise a TrackitException if the database refuses a start at
+        when, before anything is written for it."""
+        current = self.intervals.in_progress()
+        if current is not None:
+            raise TooManyTasksInProgress("{} is in progress".format(current))
+        self.intervals.check_overlap(when)
+
+    def compact(self):
+        """Replay the journal into the database, without committing.
+
+        Events that are already in the database are skipped, so replaying
+        the journal again before it is cleared is harmless. A start the
+        database refuses, along with the stop that follows it, is left out
+        and reported in rejections, rather than failing every compaction
+        after it. clear_compacted() moves those to the rejected journal.
+
+        Returns the number of events that were replayed.
+        """
+        events, size = self.journal.read()
+        intervals = self.intervals
+        self.rejections = []
+        skipping = False
+        for event in events:
+            kind, when, name = event
+            if kind == START:
+                skipping = False
+                if intervals.started_at(when):
+                    continue
+                try:
+                    self._check_start(when)
+                except TrackitException, e:
+                    self.rejections.append((event, unicode(e)))
+                    skipping = True
+                    continue
+                intervals.start(self._task(name, create=True), when)
+            elif skipping:
+                self.rejections.append((event, u"its start was rejected"))
+                skipping = False
+            else:
+                current = intervals.in_progress()
+                if current is not None and current.start_time < when:
+                    intervals.stop(current.task, when)
+        self.compacted = size
+        return len(events)
+
+    def clear_compacted(self):
+        """Clear the journal of the events compact() replayed, once they
+        are committed, moving rejected events to the rejected journal.
+
+        Returns a message for every rejected event.
+        """
+        if self.compacted is None:
+            return []
+        messages = []
+        for (kind, when, name), reason in self.rejections:
+            self.rejected.append(kind, when, name)
+            event = u"start of '{}'".format(name) if kind == START else u"stop"
+            messages.append(u"Moved the journaled {} at {} to {}: {}"
+                            .format(event, when, self.rejected.path.path,
+                                    reason))
+        self.journal.clear(self.compacted)
+        self.compacted, self.rejections = None, []
+        return messages
+
+    def rolled_back(self):
+        """Forget what compact() replayed, it was rolled back."""
+        self.compacted, self.rejections = None, []
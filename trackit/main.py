@@ -10,11 +10,101 @@ Application interfaces to trackit.
 """
 
 import sys
+import time
+import shlex
+import sqlite3
 import argparse
 from functools import wraps
 
-from trackit import configuration, util, data
-from trackit.exceptions import ArgumentParsingException
+from trackit import (
+    configuration, util, data, watch, journal, sync, server, report, calendars,
+    shell as shell_, fsck as fsck_, columnar, cache, metrics,
+    parallel, maintenance, stats as stats_, tags as tags_
+)
+from trackit.data import Task
+from trackit.exceptions import ArgumentParsingException, TrackitException
+
+def journaled(command):
+    """Mark command as able to work with uncompacted journal events.
+
+    When the journal is enabled, the journal is compacted before running
+    any command that is not marked."""
+    command.journaled = True
+    return command
+
+def tracking(command):
+    """Mark command as one that tracks time, like start and stop.
+
+    Opportunistic maintenance never runs after a marked command, so that
+    tracking time stays as fast as the database allows."""
+    command.tracking = True
+    return command
+
+def untransacted(command):
+    """Mark command as one that commits on its own, which can not be run
+    in the transaction of a batch or between the commits of the shell."""
+    command.untransacted = True
+    return command
+
+def _use_journal(config, command, data_):
+    """Make data_ write start and stop to the journal, compacting the
+    journal first if command can not see uncompacted events."""
+    if not config.get('journal', False):
+        return None
+    intervals = journal.JournaledIntervals(
+        data_.intervals, journal.Journal(configuration.journal_path(config)))
+    data_.intervals = intervals
+    if not getattr(command, 'journaled', False):
+        intervals.compact()
+    return intervals
+
+def _clear_journal(intervals):
+    """Clear the journal of the events that were compacted and committed,
+    telling about the events that were rejected on stderr."""
+    if intervals is None:
+        return
+    for message in intervals.clear_compacted():
+        sys.stderr.write(u'{}\n'.format(message).encode('utf-8'))
+
+def _run(command, config, options, db):
+    """Run command against db, returning what it returns and the seconds
+    spent committing."""
+    conn = db
+    stats = stats_.Stats(db, zone=config.get('timezone'))
+    data_ = data.Data(db, intervals=data.TaskIntervals(db, stats=stats))
+    intervals = _use_journal(config, command, data_)
+    if getattr(options, 'snapshot', False):
+        db.commit()
+        _clear_journal(intervals)
+        db, source, intervals = data.snapshot(db), db, None
+        source.close()
+        conn = None
+        report.prepare(db)
+        data_ = data.Data(db)
+    out = command(config, options, data_)
+    started = time.time()
+    db.commit()
+    commit_seconds = time.time() - started
+    if (intervals is not None and len(intervals.journal) >=
+            config.get('journal_compact_after', 100)):
+        intervals.compact()
+        db.commit()
+    _clear_journal(intervals)
+    if conn is not None and not getattr(command, 'tracking', False):
+        _maintain(config, conn)
+    return out, commit_seconds
+
+def _maintain(config, db):
+    """Run the maintenance jobs that are due within the configured budget.
+
+    Maintenance is opportunistic, so a locked database only postpones it."""
+    budget = config.get('maintenance_budget', 0.05)
+    if not budget:
+        return
+    try:
+        maintenance.Maintenance(db).run(budget)
+    except sqlite3.OperationalError:
+        db.rollback()
 
 def configured(command):
     """Wrap command in a function that passes in the trackit configuration
@@ -22,45 +112,379 @@ def configured(command):
     @wraps(command)
     def wrapper(options):
         config = configuration.load_configuration(options.home)
-        db = configuration.get_db(config)
-        out = command(config, options, data.Data(db))
-        db.commit()
-        return out
+        path = configuration.metrics_path(config)
+        if path is None:
+            return _run(command, config, options,
+                        configuration.get_db(config))[0]
+        db = configuration.get_db(config, factory=metrics.CountingConnection)
+        started = time.time()
+        out, raised, commit_seconds = 1, True, None
+        try:
+            out, commit_seconds = _run(command, config, options, db)
+            raised = False
+            return out
+        finally:
+            # Snapshots close the database before the command runs
+            gauges = not raised and not getattr(options, 'snapshot', False)
+            try:
+                metrics.record(path, command.__name__.rstrip('_'), bool(out),
+                               time.time() - started, commit_seconds, db,
+                               configuration.db_path(config), gauges)
+            except EnvironmentError, e:
+                sys.stderr.write('Could not write metrics: {}\n'.format(e))
+    wrapper.command = command
     return wrapper
 
 @configured
+@tracking
+@journaled
 def stop(configuration, options, data):
     in_progress = data.intervals.in_progress()
     if in_progress is None:
         print 'Nothing to stop.'
     else:
-        stopped = data.intervals.stop(in_progress.task)
+        stopped = data.intervals.stop(in_progress.task, options.at)
         print "Stopped '{}' after {} seconds".format(stopped.task.name, stopped.duration)
     return 0
 
-@configured
-def status(configuration, options, data):
-    in_progress = data.intervals.in_progress()
+def _print_status(in_progress):
     if in_progress is None:
         print 'Not tracking.'
     else:
         print "Tracking '{}' for {} seconds so far.".format(in_progress.task.name, in_progress.duration)
+
+def _watch_status(config, options, data, sleep=time.sleep):
+    """Print status every options.interval seconds, only querying the
+    database when a watch.Watcher detects a change."""
+    watchers = [watch.Watcher(data.conn, configuration.db_path(config))]
+    if isinstance(data.intervals, journal.JournaledIntervals):
+        watchers.append(watch.Watcher(data.conn, data.intervals.journal.path))
+    in_progress = None
+    count = 0
+    try:
+        while True:
+            if any([watcher.changed() for watcher in watchers]):
+                in_progress = data.intervals.in_progress()
+            _print_status(in_progress)
+            sys.stdout.flush()
+            count += 1
+            if options.count is not None and count >= options.count:
+                break
+            sleep(options.interval)
+    except KeyboardInterrupt:
+        pass
     return 0
 
 @configured
+@journaled
+def status(configuration, options, data):
+    if options.watch:
+        return _watch_status(configuration, options, data)
+    _print_status(data.intervals.in_progress())
+    return 0
+
+@configured
+@tracking
+@journaled
 def start(configuration, options, data):
-    tasks = data.tasks.by_name(options.task[0])
-    if len(tasks) > 1:
-        print '{} is ambigous, multiple entries:'
+    name = options.task[0]
+    tasks = data.tasks.named(name)
+    if not tasks and Task.SEPARATOR in name:
+        tasks = [data.tasks.resolve(name, create=True)]
+    tasks = tasks or data.tasks.by_name(name)
+    if len(tasks) > 1 and tasks[0].name != name:
+        print '{} is ambigous, multiple entries:'.format(name)
         print ' '.join([task.name for task in tasks])
+        return 1
     elif not tasks:
-        task = data.tasks.create(options.task[0])
+        task = data.tasks.create(name)
     else:
         task = tasks[0]
-    data.intervals.start(task)
+    try:
+        for tag in options.tag or ():
+            tags_.check_tag(tag)
+    except tags_.InvalidTag, e:
+        print e
+        return 1
+    interval = data.intervals.start(task, options.at)
+    if options.tag:
+        # Tags are on database rows, so journaled starts are written now
+        if isinstance(data.intervals, journal.JournaledIntervals):
+            data.intervals.compact()
+            interval = data.intervals.intervals.in_progress()
+        tags_.Tags(data.conn).tag(interval, options.tag)
     print "Tracking '{}'.".format(task.name)
     return 0
 
+@configured
+def merge(configuration, options, data):
+    found = [data.tasks.named(name) for name in options.tasks]
+    missing = [name for name, tasks in zip(options.tasks, found) if not tasks]
+    if missing:
+        print 'No such task: {}'.format(', '.join(missing))
+        return 1
+    target = found[0][0]
+    sources = [task for tasks in found for task in tasks]
+    moved = data.tasks.merge(target, sources)
+    print "Merged {} tasks into '{}', moving {} intervals.".format(
+        len(sources) - 1, target.name, moved)
+    return 0
+
+@configured
+def rename(configuration, options, data):
+    renamed = data.tasks.rename(options.old, options.new, options.pattern)
+    print 'Renamed {} tasks.'.format(renamed)
+    return 0
+
+@configured
+@journaled
+def compact(configuration, options, data):
+    if not isinstance(data.intervals, journal.JournaledIntervals):
+        print 'The journal is not enabled.'
+        return 0
+    print 'Compacted {} journal events.'.format(data.intervals.compact())
+    return 0
+
+@configured
+def tasks(configuration, options, data):
+    for task in data.tasks.sorted(options.sort, options.limit):
+        print "{}\t{} seconds\t{} intervals".format(
+            task.name, task.total_seconds, task.interval_count)
+    return 0
+
+# ReportCache of each trackit home, shared by the commands of a shell
+_report_caches = {}
+
+def _report_cache(config):
+    home = config['_home'].path
+    if home not in _report_caches:
+        path = None
+        if config.get('report_cache_persist', False):
+            path = configuration.report_cache_path(config)
+        _report_caches[home] = cache.ReportCache(
+            config.get('report_cache_size', 128), path)
+    return _report_caches[home]
+
+@configured
+def report_(configuration, options, data):
+    zone = configuration.get('timezone')
+    calendar = calendars.Calendar(data.conn, zone)
+    since = calendar.day(options.since)[0] if options.since else None
+    until = calendar.day(options.until)[1] if options.until else None
+    results = _report_cache(configuration)
+    arguments = {'since': since, 'until': until}
+    if options.tags is not None:
+        if options.rollup or options.by or options.jobs:
+            print 'Tag filters only apply to plain reports.'
+            return 1
+        try:
+            tags_.parse(options.tags)
+        except tags_.InvalidTagFilter, e:
+            print e
+            return 1
+        for task, seconds in results.get(data, tags_.totals,
+                                         expression=options.tags,
+                                         **arguments):
+            print "{}\t{} seconds".format(task.name, seconds)
+        results.save()
+        return 0
+    totals, rollup = report.totals, report.rollup
+    if options.jobs:
+        totals, rollup = parallel.totals, parallel.rollup
+        arguments['processes'] = options.jobs
+    if options.rollup:
+        for task, seconds in results.get(data, rollup, **arguments):
+            print "{}\t{} seconds".format(data.tasks.path(task), seconds)
+    elif options.by is None:
+        for task, seconds in results.get(data, totals, **arguments):
+            print "{}\t{} seconds".format(task.name, seconds)
+    else:
+        report.fill_calendar(data, since, until, zone)
+        for label, task, seconds in results.get(
+                data, report.periods, period=options.by, since=since,
+                until=until, zone=zone):
+            print "{}\t{}\t{} seconds".format(label, task.name, seconds)
+    results.save()
+    return 0
+
+@configured
+def stats(configuration, options, data_):
+    tasks = None
+    if options.task is not None:
+        task = data_.tasks.resolve(options.task)
+        if task is None:
+            print 'No such task: {}'.format(options.task)
+            return 1
+        tasks = [task]
+    repository = stats_.Stats(data_.conn, zone=configuration.get('timezone'))
+    found = repository.all(tasks)
+    for task_stats in found:
+        sketch = task_stats.sketch
+        print ("{}\t{} sessions\tmean {:.0f}\tstddev {:.0f}\tp50 {:.0f}"
+               "\tp90 {:.0f}\tp99 {:.0f}\tstreak {} days\tlongest {} days"
+               .format(task_stats.task.name, sketch.count, sketch.mean,
+                       sketch.stddev, sketch.quantile(0.5),
+                       sketch.quantile(0.9), sketch.quantile(0.99),
+                       task_stats.streak, task_stats.longest_streak))
+    if not found:
+        print 'No stopped task intervals.'
+    return 0
+
+@configured
+def series(configuration, options, data):
+    zone = configuration.get('timezone')
+    calendar = calendars.Calendar(data.conn, zone)
+    since = calendar.day(options.since)[0] if options.since else None
+    until = calendar.day(options.until)[1] if options.until else None
+    task = None
+    if options.task is not None:
+        task = data.tasks.resolve(options.task)
+        if task is None:
+            print 'No such task: {}'.format(options.task)
+            return 1
+    _, points = report.series(data, since, until, options.points, task,
+                              zone)
+    for start, seconds in points:
+        print "{}\t{} seconds".format(
+            calendar.local.localtime(start).strftime('%Y-%m-%d %H:%M'),
+            seconds)
+    return 0
+
+def _batch(configuration, data_, lines):
+    """Run the commands in lines against data_, returning 1 at the first
+    one that fails and 0 if none does."""
+    for number, line in enumerate(lines, 1):
+        args = shlex.split(line, comments=True)
+        if not args:
+            continue
+        try:
+            line_options = parser.parse_args(args)
+            command = getattr(line_options.func, 'command', None)
+            if command is None or getattr(command, 'untransacted', False):
+                raise TrackitException("{} can not be batched"
+                                       .format(args[0]))
+            if command(configuration, line_options, data_):
+                raise TrackitException("{} failed".format(args[0]))
+        except TrackitException, e:
+            print 'Line {}: {}, rolled back.'.format(number, e)
+            return 1
+    return 0
+
+@configured
+@untransacted
+def batch(configuration, options, data_):
+    """Run the commands in options.file, one per line, in one transaction."""
+    if isinstance(data_.intervals, journal.JournaledIntervals):
+        # Rolling back the batch must not take the compacted journal along
+        data_.conn.commit()
+        _clear_journal(data_.intervals)
+        data_.intervals = data_.intervals.intervals
+    # The sqlite3 module commits before schema changes and pragmas, which
+    # commands run to migrate their tables, so the transaction is begun and
+    # ended here with the module's transaction handling turned off.
+    conn = data_.conn
+    conn.commit()
+    conn.isolation_level = None
+    lines = sys.stdin if options.file == '-' else open(options.file)
+    try:
+        conn.execute("BEGIN")
+        try:
+            out = _batch(configuration, data_, lines)
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("ROLLBACK" if out else "COMMIT")
+        return out
+    finally:
+        conn.isolation_level = ''
+        if lines is not sys.stdin:
+            lines.close()
+
+@configured
+@untransacted
+def shell(configuration, options, data_):
+    """Run commands interactively against one open connection."""
+    try:
+        shell_.Shell(configuration, data_, parser, subparsers.choices).cmdloop()
+    except KeyboardInterrupt:
+        print
+    return 0
+
+@configured
+def fsck(configuration, options, data_):
+    problems = list(fsck_.check(data_.conn))
+    for problem in problems:
+        print problem
+    if not problems:
+        print 'No problems found.'
+    elif options.repair:
+        print 'Repaired {} problems.'.format(
+            fsck_.repair(data_.conn, problems))
+    else:
+        return 1
+    return 0
+
+@configured
+def export(configuration, options, data_):
+    written = columnar.write(data_, util.Path(options.file))
+    print 'Exported {} intervals.'.format(written)
+    return 0
+
+@configured
+@untransacted
+def maintain(configuration, options, data_):
+    if options.vacuum:
+        maintenance.vacuum(data_.conn)
+        print 'Vacuumed the database.'
+    jobs = maintenance.Maintenance(data_.conn).run(force=options.force)
+    for name in jobs:
+        print 'Ran {}.'.format(name)
+    if not jobs:
+        print 'No maintenance was due.'
+    return 0
+
+def _is_database(path):
+    """True if path is an SQLite database file."""
+    if not path.exists():
+        return False
+    with open(path.path, 'rb') as inf:
+        return inf.read(16) == 'SQLite format 3\x00'
+
+def _print_sync_result(direction, result):
+    print '{} {} intervals.'.format(direction, result.intervals)
+    for conflict in result.conflicts:
+        print 'Conflict: {}'.format(conflict)
+
+@configured
+def synchronize(configuration, options, data_):
+    other = util.Path(options.other)
+    if _is_database(other):
+        conn = sqlite3.connect(other.path)
+        received, sent = sync.sync(data_, data.Data(conn))
+        conn.commit()
+        _print_sync_result('Sent', sent)
+    else:
+        received = sync.sync_file(data_, other)
+    _print_sync_result('Received', received)
+    return 0
+
+def serve(options):
+    config = configuration.load_configuration(options.home)
+    connect = lambda: configuration.get_db(config, check_same_thread=False)
+    journal_ = None
+    if config.get('journal', False):
+        journal_ = journal.Journal(configuration.journal_path(config))
+    trackit = server.Trackit(connect, options.readers,
+                             config.get('timezone'), journal_)
+    httpd = server.Server((options.host, options.port), trackit)
+    print 'Serving on http://{}:{}/'.format(*httpd.server_address)
+    sys.stdout.flush()
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
 class TrackitArgparser(argparse.ArgumentParser):
     """Using this to prevent argparse from sending SystemExit.
 
@@ -80,16 +504,143 @@ parser.add_argument("-H", "--home", action='store')
 subparsers = parser.add_subparsers(title="Commands")
 
 stop_parser = subparsers.add_parser('stop', help='Stop tracking')
+stop_parser.add_argument("--at", action='store', type=float,
+                         help='Unix time tracking stopped, defaults to now')
 stop_parser.set_defaults(func=stop)
 
 status_parser = subparsers.add_parser('status', help='Show status')
+status_parser.add_argument("-w", "--watch", action='store_true',
+                           help='Keep printing status until interrupted')
+status_parser.add_argument("-i", "--interval", action='store', type=float,
+                           default=1.0,
+                           help='Seconds between updates when watching')
+status_parser.add_argument("-n", "--count", action='store', type=int,
+                           help='Stop watching after this many updates')
 status_parser.set_defaults(func=status)
 
 start_parser = subparsers.add_parser('start', help='Start tracking something')
 start_parser.add_argument("task", nargs=1, action='store',
-                          help='Name of the task you wish to track')
+                          help='Name of the task you wish to track, or its '
+                          'path like project/task')
+start_parser.add_argument("--at", action='store', type=float,
+                          help='Unix time tracking started, defaults to now')
+start_parser.add_argument("-t", "--tag", action='append',
+                          help='Tag the interval, may be given many times')
 start_parser.set_defaults(func=start)
 
+merge_parser = subparsers.add_parser('merge', help='Merge tasks into one')
+merge_parser.add_argument("tasks", nargs='+', action='store',
+                          help='Names of the tasks to merge, all tasks are '
+                          'merged into the oldest task with the first name')
+merge_parser.set_defaults(func=merge)
+
+rename_parser = subparsers.add_parser('rename', help='Rename tasks')
+rename_parser.add_argument("-p", "--pattern", action='store_true',
+                           help='Replace old wherever it occurs in task names')
+rename_parser.add_argument("old", action='store', help='Name to replace')
+rename_parser.add_argument("new", action='store', help='Replacement')
+rename_parser.set_defaults(func=rename)
+
+tasks_parser = subparsers.add_parser('tasks', help='List tasks')
+tasks_parser.add_argument("-s", "--sort", action='store', default='name',
+                          choices=sorted(data.Tasks.ORDERINGS),
+                          help='How to order the tasks')
+tasks_parser.add_argument("-n", "--limit", action='store', type=int,
+                          help='The maximum number of tasks to list')
+tasks_parser.add_argument("--snapshot", action='store_true',
+                          help='Read from an in-memory copy of the database')
+tasks_parser.set_defaults(func=tasks)
+
+report_parser = subparsers.add_parser('report', help='Report time spent')
+report_parser.add_argument("-b", "--by", action='store',
+                           choices=sorted(calendars.PERIODS),
+                           help='Split the report by local day, week or month')
+report_parser.add_argument("--since", action='store',
+                           help='First day of the report, as YYYY-MM-DD')
+report_parser.add_argument("--until", action='store',
+                           help='Last day of the report, as YYYY-MM-DD')
+report_parser.add_argument("-r", "--rollup", action='store_true',
+                           help='Include the time of subtasks in every task')
+report_parser.add_argument("--snapshot", action='store_true',
+                           help='Read from an in-memory copy of the database')
+report_parser.add_argument("-T", "--tags", action='store',
+                           help='Only intervals matching a tag filter, like'
+                           ' "billable and not meeting"')
+report_parser.add_argument("-j", "--jobs", action='store', type=int,
+                           help='Sum time in this many parallel processes')
+report_parser.set_defaults(func=report_)
+
+stats_parser = subparsers.add_parser(
+    'stats', help='Session length statistics and streaks of tasks')
+stats_parser.add_argument("-t", "--task", action='store',
+                          help='Only this task, by name or path')
+stats_parser.set_defaults(func=stats)
+
+series_parser = subparsers.add_parser(
+    'series', help='Time tracked per minute, hour or day')
+series_parser.add_argument("--since", action='store',
+                           help='First day of the series, as YYYY-MM-DD')
+series_parser.add_argument("--until", action='store',
+                           help='Last day of the series, as YYYY-MM-DD')
+series_parser.add_argument("-n", "--points", action='store', type=int,
+                           default=100,
+                           help='The maximum number of points, the width '
+                           'of the buckets is chosen to fit')
+series_parser.add_argument("-t", "--task", action='store',
+                           help='Only count this task, or path like '
+                           'project/task, and its subtasks')
+series_parser.set_defaults(func=series)
+
+batch_parser = subparsers.add_parser(
+    'batch', help='Run many commands in one transaction')
+batch_parser.add_argument("file", nargs='?', action='store', default='-',
+                          help='File with one command per line, defaults '
+                          'to stdin')
+batch_parser.set_defaults(func=batch)
+
+shell_parser = subparsers.add_parser(
+    'shell', help='Run commands interactively')
+shell_parser.set_defaults(func=shell)
+
+fsck_parser = subparsers.add_parser(
+    'fsck', help='Check task intervals for problems')
+fsck_parser.add_argument("-r", "--repair", action='store_true',
+                         help='Repair the problems that are found')
+fsck_parser.set_defaults(func=fsck)
+
+export_parser = subparsers.add_parser(
+    'export', help='Export task intervals to a binary columnar file')
+export_parser.add_argument("file", action='store', help='File to write')
+export_parser.set_defaults(func=export)
+
+maintain_parser = subparsers.add_parser(
+    'maintain', help='Run database maintenance that is due')
+maintain_parser.add_argument("-f", "--force", action='store_true',
+                             help='Run all maintenance, due or not')
+maintain_parser.add_argument("--vacuum", action='store_true',
+                             help='Rebuild the database, enabling'
+                             ' incremental vacuum')
+maintain_parser.set_defaults(func=maintain)
+
+compact_parser = subparsers.add_parser(
+    'compact', help='Write journaled events to the database')
+compact_parser.set_defaults(func=compact)
+
+sync_parser = subparsers.add_parser(
+    'sync', help='Exchange changes with another database')
+sync_parser.add_argument("other", action='store',
+                         help='Database or exchange file to sync with')
+sync_parser.set_defaults(func=synchronize)
+
+serve_parser = subparsers.add_parser('serve', help='Serve a HTTP/JSON API')
+serve_parser.add_argument("--host", action='store', default='127.0.0.1',
+                          help='Address to listen on')
+serve_parser.add_argument("-p", "--port", action='store', type=int,
+                          default=8756, help='Port to listen on')
+serve_parser.add_argument("-r", "--readers", action='store', type=int,
+                          default=4, help='Number of read connections')
+serve_parser.set_defaults(func=serve)
+
 
 def main(args):
     """Entry point for trackit."""
@@ -0,0 +1,185 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Scheduled maintenance of the database.
+
+Every job runs when its interval has passed since it last ran, which is
+recorded in the MAINTENANCE table of the database itself. Commands run
+the jobs that are due when they are done, under a time budget that is
+enforced with a progress handler, so a job that would take too long is
+interrupted and left to `trackit maintain`.
+"""
+
+import sqlite3
+import time
+
+from trackit.data import ClosesCursor, _migrate
+from trackit.util import DefaultRepr, dumb_constructor
+
+# Pages the incremental vacuum job frees at most in one run
+VACUUM_PAGES = 256
+
+# Virtual machine instructions between checks of the time budget
+PROGRESS_STEPS = 1000
+
+
+class Job(DefaultRepr):
+    """A maintenance job: sql is run when interval seconds have passed
+    since it last ran."""
+
+    @dumb_constructor
+    def __init__(self, name, interval, sql):
+        pass
+
+    def run(self, conn):
+        """Run the job on conn, reading any rows it returns."""
+        cursor = conn.execute(self.sql)
+        try:
+            cursor.fetchall()
+        finally:
+            cursor.close()
+
+
+DAY = 24 * 60 * 60
+
+# Jobs in the order they run in when several are due
+JOBS = (
+    # Only does something in WAL mode
+    Job('checkpoint', 60 * 60, "PRAGMA wal_checkpoint(TRUNCATE)"),
+    Job('optimize', DAY, "PRAGMA optimize"),
+    # Only does something in databases with auto_vacuum = INCREMENTAL
+    Job('incremental_vacuum', DAY,
+        "PRAGMA incremental_vacuum({})".format(VACUUM_PAGES)),
+    Job('analyze', 7 * DAY, "ANALYZE"),
+)
+
+
+class Interrupted(Exception):
+    """A job did not finish within the time budget."""
+    pass
+
+
+class Maintenance(ClosesCursor):
+    """Repository for when maintenance jobs last ran."""
+
+    SCHEMA = """
+    CREATE TABLE MAINTENANCE(
+        NAME TEXT,
+        LAST_RUN REAL,
+        DURATION REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY(NAME)
+    );
+"""
+    MIGRATIONS = ()
+
+    @dumb_constructor
+    def __init__(self, conn, jobs=JOBS):
+        """Create Maintenance. This will attempt to register the schema.
+
+        Arguments:
+        - `conn`: sqlite3 database connection.
+        - `jobs`: the Jobs to schedule.
+        """
+        with self.cursor() as cursor:
+            _migrate(cursor, Maintenance.SCHEMA, Maintenance.MIGRATIONS)
+
+    def runs(self):
+        """Dictionary of job name to (last run, duration) of every job that
+        has been run or tried."""
+        with self.cursor() as cursor:
+            cursor.execute("SELECT NAME, LAST_RUN, DURATION FROM MAINTENANCE")
+            return dict((name, (last_run, duration))
+                        for name, last_run, duration in cursor.fetchall())
+
+    def due(self, now=None):
+        """The jobs whose interval has passed, in order.
+
+        Arguments:
+        - `now`: unix time to check against, None for now.
+        """
+        now = time.time() if now is None else now
+        runs = self.runs()
+        return [job for job in self.jobs
+                if runs.get(job.name, (None, 0))[0] is None
+                or runs[job.name][0] + job.interval <= now]
+
+    def _record(self, job, last_run, duration):
+        with self.cursor() as cursor:
+            cursor.execute("INSERT OR IGNORE INTO MAINTENANCE(NAME)"
+                           " VALUES(?)", (job.name,))
+            if last_run is None:
+                cursor.execute("UPDATE MAINTENANCE SET DURATION = ?"
+                               " WHERE NAME = ?", (duration, job.name))
+            else:
+                cursor.execute("UPDATE MAINTENANCE SET LAST_RUN = ?,"
+                               " DURATION = ? WHERE NAME = ?",
+                               (last_run, duration, job.name))
+        self.conn.commit()
+
+    def _run_until(self, job, deadline):
+        """Run job, interrupting it at deadline if that is not None."""
+        def expired():
+            return time.time() > deadline
+        if deadline is not None:
+            self.conn.set_progress_handler(expired, PROGRESS_STEPS)
+        try:
+            job.run(self.conn)
+        except sqlite3.OperationalError, e:
+            if deadline is None or 'interrupted' not in str(e):
+                raise
+            raise Interrupted(job.name)
+        finally:
+            if deadline is not None:
+                self.conn.set_progress_handler(None, PROGRESS_STEPS)
+
+    def run(self, budget=None, force=False):
+        """Run the jobs that are due, or every job if force is True.
+
+        Pending changes on the connection are committed first, since some
+        jobs can not run in a transaction. With a budget, jobs that took
+        longer than what is left of it last time are skipped, and a job
+        still running when the budget is spent is interrupted. Returns
+        the names of the jobs that ran.
+
+        Arguments:
+        - `budget`: seconds to spend at most, None for no limit.
+        - `force`: run every job, not just the ones that are due.
+        """
+        started = time.time()
+        deadline = None if budget is None else started + budget
+        self.conn.commit()
+        runs = self.runs()
+        done = []
+        for job in (self.jobs if force else self.due(started)):
+            job_started = time.time()
+            if deadline is not None:
+                if job_started + runs.get(job.name, (None, 0))[1] > deadline:
+                    continue
+            try:
+                self._run_until(job, deadline)
+            except Interrupted:
+                # Remember that it needs more than the budget, so it is not
+                # started again until someone runs `trackit maintain`.
+                self._record(job, None, time.time() - job_started)
+                break
+            self._record(job, job_started, time.time() - job_started)
+            done.append(job.name)
+        return done
+
+
+def vacuum(conn):
+    """Rebuild the database with VACUUM, enabling incremental vacuum.
+
+    Databases created before incremental vacuum was enabled by default
+    only get it by being rebuilt like this.
+
+    Arguments:
+    - `conn`: sqlite3 database connection.
+    """
+    conn.commit()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
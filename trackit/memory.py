@@ -0,0 +1,462 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Storage backend keeping tasks and task intervals in memory.
+
+Task intervals are kept in a list of (start time, id) sorted with the
+bisect module, so overlap checks, range reads and pages are binary
+searches, and open intervals are kept in a set. Nothing is persisted,
+which makes it a fit for short-lived processes and tests that do not need
+SQL. See data.Data for the interface it shares with the SQLite backend.
+"""
+
+import bisect
+import time
+
+from trackit.data import (Data, Task, TaskInterval, Tasks, TaskCycle,
+                          TooManyTasksInProgress, NoTaskInProgress,
+                          InconsistentTaskIntervals, _check_limit,
+                          _encode_token, _decode_token)
+
+
+def _copy(task):
+    return Task(task.task_id, task.name, task.description,
+                task.total_seconds, task.interval_count, task.last_worked,
+                task.parent)
+
+
+def _reach(start, stop):
+    return start if stop is None else stop
+
+
+class Store(object):
+    """The tasks and task intervals shared by the repositories of one
+    memory backend. Running totals of tasks are kept here, like the
+    triggers of the SQLite backend keep them."""
+
+    def __init__(self):
+        # id: Task, the repositories hand out copies
+        self.tasks = {}
+        # id: [task id, start time, stop time]
+        self.intervals = {}
+        # sorted (start time, id) of all intervals
+        self.keys = []
+        # task id: sorted (start time, id) of the intervals of the task
+        self.by_task = {}
+        # ids of the intervals in progress
+        self.open = set()
+        self.last_task = self.last_interval = 0
+
+    def add_task(self, name, description, parent):
+        self.last_task += 1
+        self.tasks[self.last_task] = Task(self.last_task, name, description,
+                                          parent=parent)
+        return self.last_task
+
+    def _count(self, task_id, start, stop):
+        task = self.tasks.get(task_id)
+        if task is None:
+            return
+        task.total_seconds += 0 if stop is None else stop - start
+        task.interval_count += 1
+        task.last_worked = max(task.last_worked or 0, _reach(start, stop))
+
+    def _uncount(self, task_id, start, stop):
+        task = self.tasks.get(task_id)
+        if task is None:
+            return
+        task.total_seconds -= 0 if stop is None else stop - start
+        task.interval_count -= 1
+        if task.last_worked <= _reach(start, stop):
+            task.last_worked = self._last_worked(task_id)
+
+    def _last_worked(self, task_id):
+        reaches = [_reach(*self.intervals[id_][1:])
+                   for _, id_ in self.by_task.get(task_id, ())]
+        return max(reaches) if reaches else None
+
+    def add_interval(self, task_id, start, stop):
+        self.last_interval += 1
+        id_ = self.last_interval
+        self.intervals[id_] = [task_id, start, stop]
+        bisect.insort(self.keys, (start, id_))
+        bisect.insort(self.by_task.setdefault(task_id, []), (start, id_))
+        if stop is None:
+            self.open.add(id_)
+        self._count(task_id, start, stop)
+        return id_
+
+    def stop_interval(self, id_, stop):
+        task_id, start, old = self.intervals[id_]
+        self.intervals[id_][2] = stop
+        self.open.discard(id_)
+        task = self.tasks.get(task_id)
+        if task is None:
+            return
+        task.total_seconds += stop - _reach(start, old)
+        # Stopping usually moves the reach of the interval forward, then
+        # the other intervals of the task need not be looked at.
+        if stop >= _reach(start, old):
+            task.last_worked = max(task.last_worked or 0, stop)
+        else:
+            task.last_worked = self._last_worked(task_id)
+
+    def move_interval(self, id_, task_id):
+        old, start, stop = self.intervals[id_]
+        self.intervals[id_][0] = task_id
+        self.by_task[old].remove((start, id_))
+        bisect.insort(self.by_task.setdefault(task_id, []), (start, id_))
+        self._uncount(old, start, stop)
+        self._count(task_id, start, stop)
+
+    def ancestors(self, task_id):
+        """Ids of task_id and its ancestors, nearest first."""
+        ids = []
+        while task_id is not None:
+            ids.append(task_id)
+            task_id = self.tasks[task_id].parent
+        return ids
+
+
+class MemoryTasks(object):
+    """Tasks repository of the memory backend."""
+
+    def __init__(self, store):
+        """Create a MemoryTasks repository.
+
+        Arguments:
+        - `store`: the Store to keep tasks in.
+        """
+        self.store = store
+
+    def _select(self, predicate):
+        return [_copy(task) for _, task in sorted(self.store.tasks.items())
+                if predicate(task)]
+
+    def create(self, name, description=None, parent=None):
+        """See Tasks.create()."""
+        parent_id = None if parent is None else parent.task_id
+        return _copy(self.store.tasks[
+            self.store.add_task(name, description, parent_id)])
+
+    def move(self, task, parent):
+        """See Tasks.move()."""
+        parent_id = None if parent is None else parent.task_id
+        if parent_id is not None and \
+                task.task_id in self.store.ancestors(parent_id):
+            raise TaskCycle("Can not move {} below {}, it is one of its"
+                            " descendants".format(task.name, parent.name))
+        self.store.tasks[task.task_id].parent = parent_id
+        task.parent = parent_id
+
+    def resolve(self, path, create=False):
+        """See Tasks.resolve()."""
+        task = None
+        for name in path.split(Task.SEPARATOR):
+            parent_id = None if task is None else task.task_id
+            found = self._select(lambda other: other.parent == parent_id
+                                 and other.name == name)
+            if found:
+                task = found[0]
+            elif create:
+                task = self.create(name, parent=task)
+            else:
+                return None
+        return task
+
+    def path(self, task):
+        """See Tasks.path()."""
+        return Task.SEPARATOR.join(
+            self.store.tasks[id_].name
+            for id_ in reversed(self.store.ancestors(task.task_id)))
+
+    def descendants(self, task):
+        """See Tasks.descendants()."""
+        found, level = [], [task.task_id]
+        while level:
+            found.extend(level)
+            parents = set(level)
+            level = sorted(id_ for id_, other in self.store.tasks.items()
+                           if other.parent in parents)
+        return [_copy(self.store.tasks[id_]) for id_ in found]
+
+    def subtree_totals(self, task):
+        """See Tasks.subtree_totals()."""
+        subtree = self.descendants(task)
+        return (sum(other.total_seconds for other in subtree),
+                sum(other.interval_count for other in subtree))
+
+    def update(self, task):
+        """See Tasks.update()."""
+        stored = self.store.tasks[task.task_id]
+        stored.name, stored.description = task.name, task.description
+
+    def by_name(self, name):
+        """See Tasks.by_name()."""
+        name = name.lower()
+        return self._select(lambda task: name in task.name.lower())
+
+    def all(self):
+        """See Tasks.all()."""
+        return self._select(lambda task: True)
+
+    def names(self):
+        """See Tasks.names()."""
+        return sorted(set(task.name for task in self.store.tasks.values()))
+
+    # Sort keys of Tasks.ORDERINGS, missing values sort last like NULL
+    # does in descending order
+    ORDERINGS = {
+        'name': lambda task: (task.name,),
+        'total': lambda task: (-task.total_seconds,),
+        'count': lambda task: (-task.interval_count,),
+        'recent': lambda task: (task.last_worked is None,
+                                -(task.last_worked or 0)),
+    }
+
+    def sorted(self, by='name', limit=None):
+        """See Tasks.sorted()."""
+        if by not in Tasks.ORDERINGS:
+            raise ValueError("Can not sort tasks by {}".format(by))
+        key = MemoryTasks.ORDERINGS[by]
+        tasks = sorted(self.all(), key=lambda task: key(task) +
+                       (task.task_id,))
+        return tasks if limit is None else tasks[:limit]
+
+    def named(self, name):
+        """See Tasks.named()."""
+        return self._select(lambda task: task.name == name)
+
+    def merge(self, target, sources):
+        """See Tasks.merge()."""
+        store = self.store
+        ids = set(task.task_id for task in sources) - set([target.task_id])
+        keep = set(store.ancestors(target.task_id))
+        moved = 0
+        for id_ in sorted(ids):
+            for _, interval in list(store.by_task.get(id_, ())):
+                store.move_interval(interval, target.task_id)
+                moved += 1
+            for child in store.tasks.values():
+                if child.parent == id_ and child.task_id not in keep:
+                    child.parent = target.task_id
+        for id_ in sorted(ids):
+            removed = store.tasks.pop(id_, None)
+            if removed is None:
+                continue
+            # Like the TASKCLOSURE_DELETED trigger, the ancestors of target
+            # that were kept as children move up to the removed parent
+            for child in store.tasks.values():
+                if child.parent == id_:
+                    child.parent = removed.parent
+        return moved
+
+    def rename(self, old, new, pattern=False):
+        """See Tasks.rename()."""
+        renamed = 0
+        for task in self.store.tasks.values():
+            if pattern and old in task.name:
+                task.name = task.name.replace(old, new)
+            elif not pattern and task.name == old:
+                task.name = new
+            else:
+                continue
+            renamed += 1
+        return renamed
+
+    def page(self, token=None, limit=50):
+        """See Tasks.page()."""
+        _check_limit(limit)
+        after, = _decode_token(token, 1) if token is not None else (-1,)
+        ids = sorted(self.store.tasks)
+        first = bisect.bisect_right(ids, after)
+        tasks = [_copy(self.store.tasks[id_])
+                 for id_ in ids[first:first + limit + 1]]
+        if len(tasks) <= limit:
+            return tasks, None
+        tasks = tasks[:limit]
+        return tasks, _encode_token([tasks[-1].task_id])
+
+    def by_id(self, id_):
+        """See Tasks.by_id()."""
+        if id_ not in self.store.tasks:
+            raise KeyError("No Task with id: {}".format(id_))
+        return _copy(self.store.tasks[id_])
+
+
+class MemoryTaskIntervals(object):
+    """TaskIntervals repository of the memory backend."""
+
+    def __init__(self, store, tasks=None):
+        """Create a MemoryTaskIntervals repository.
+
+        Arguments:
+        - `store`: the Store to keep task intervals in.
+        - `tasks`: MemoryTasks repository - if None, one will be created.
+        """
+        self.store = store
+        self.tasks = MemoryTasks(store) if tasks is None else tasks
+
+    def _interval(self, id_, tasks=None):
+        """The TaskInterval with id_, sharing Task instances in tasks."""
+        task_id, start, stop = self.store.intervals[id_]
+        tasks = {} if tasks is None else tasks
+        task = tasks.get(task_id)
+        if task is None:
+            task = tasks[task_id] = _copy(self.store.tasks[task_id])
+        return TaskInterval(task, id_, start, stop)
+
+    def _overlapping(self, id_):
+        task_id, start, stop = self.store.intervals[id_]
+        return InconsistentTaskIntervals(
+            "Already an interal from {} to {} working on task {}"
+            .format(start, stop, task_id))
+
+    def start(self, task, when=None):
+        """See TaskIntervals.start()."""
+        assert task is not None, "may not start task None"
+        in_progress = self.in_progress()
+        if in_progress is not None:
+            raise TooManyTasksInProgress("Must stop working on {} before"
+                                         " starting on new task."
+                                         .format(in_progress))
+        when = time.time() if when is None else when
+        self.check_overlap(when)
+        return TaskInterval(task, self.store.add_interval(task.task_id, when,
+                                                          None), when)
+
+    def check_overlap(self, when):
+        """See TaskIntervals.check_overlap().
+
+        Intervals do not overlap, so only the last interval starting before
+        when can contain it."""
+        keys = self.store.keys
+        before = bisect.bisect_left(keys, (when,)) - 1
+        if before >= 0:
+            id_ = keys[before][1]
+            stop = self.store.intervals[id_][2]
+            if stop is not None and stop > when:
+                raise self._overlapping(id_)
+
+    def check_range(self, start, stop=None):
+        """See TaskIntervals.check_range()."""
+        self.check_overlap(start)
+        keys = self.store.keys
+        first = bisect.bisect_left(keys, (start,))
+        if first < len(keys) and (stop is None or keys[first][0] < stop):
+            raise self._overlapping(keys[first][1])
+
+    def check_add(self, start, stop=None):
+        """See TaskIntervals.check_add()."""
+        current = self.in_progress()
+        if current is not None and stop is None:
+            raise TooManyTasksInProgress("Already a task in progress, can"
+                                         " not add another one.")
+        if current is not None and current.start_time < stop:
+            message = ("{} is in progress since before {}"
+                       .format(current.task, stop))
+            raise InconsistentTaskIntervals(message)
+        if stop is not None and stop <= start:
+            message = ("Start time is {} which is *after* stop time: {}"
+                       .format(start, stop))
+            raise InconsistentTaskIntervals(message)
+        self.check_range(start, stop)
+
+    def add(self, task, start, stop=None):
+        """See TaskIntervals.add()."""
+        self.check_add(start, stop)
+        return TaskInterval(task, self.store.add_interval(task.task_id, start,
+                                                          stop), start, stop)
+
+    def started_at(self, when):
+        """See TaskIntervals.started_at()."""
+        keys = self.store.keys
+        first = bisect.bisect_left(keys, (when,))
+        return first < len(keys) and keys[first][0] == when
+
+    def stop(self, task, when=None):
+        """See TaskIntervals.stop()."""
+        when = time.time() if when is None else when
+        intervals = self.store.by_task.get(task.task_id)
+        if not intervals:
+            raise NoTaskInProgress("No work in progress on task: {}"
+                                   .format(task))
+        start_time, interval_id = intervals[-1]
+        if start_time >= when:
+            message = ("Start time is {} which is *after* stop time: {}"
+                       .format(start_time, when))
+            raise InconsistentTaskIntervals(message)
+        self.store.stop_interval(interval_id, when)
+        return TaskInterval(task, interval_id, start_time, when)
+
+    def stream(self, start=None, end=None):
+        """See TaskIntervals.stream()."""
+        keys = self.store.keys
+        first = 0 if start is None else bisect.bisect_left(keys, (start,))
+        last = len(keys) if end is None else bisect.bisect_left(keys, (end,))
+        ids = [id_ for _, id_ in keys[first:last]]
+        # Intervals do not overlap, so the only interval starting before
+        # start that can reach into the window is the last one.
+        if first > 0 and (end is None or keys[first - 1][0] < end):
+            stop = self.store.intervals[keys[first - 1][1]][2]
+            if stop is None or stop > start:
+                ids.insert(0, keys[first - 1][1])
+        tasks = {}
+        for id_ in ids:
+            yield self._interval(id_, tasks)
+
+    def between(self, start=None, end=None):
+        """See TaskIntervals.between()."""
+        return list(self.stream(start, end))
+
+    def for_task(self, task):
+        """See TaskIntervals.for_task()."""
+        ids = sorted(id_ for _, id_ in self.store.by_task.get(task.task_id,
+                                                               ()))
+        return [TaskInterval(task, id_, *self.store.intervals[id_][1:])
+                for id_ in ids]
+
+    def page(self, token=None, limit=50, since=None, until=None):
+        """See TaskIntervals.page()."""
+        _check_limit(limit)
+        keys = self.store.keys
+        first = 0
+        if token is not None:
+            first = bisect.bisect_right(keys, tuple(_decode_token(token, 2)))
+        if since is not None:
+            first = max(first, bisect.bisect_left(keys, (since,)))
+        last = len(keys) if until is None else \
+            bisect.bisect_left(keys, (until,))
+        tasks = {}
+        intervals = [self._interval(id_, tasks) for _, id_ in
+                     keys[first:min(last, first + limit + 1)]]
+        if len(intervals) <= limit:
+            return intervals, None
+        intervals = intervals[:limit]
+        last = intervals[-1]
+        return intervals, _encode_token([last.start_time, last.task_interval])
+
+    def in_progress(self):
+        """See TaskIntervals.in_progress()."""
+        tasks = {}
+        intervals = [self._interval(id_, tasks)
+                     for id_ in sorted(self.store.open)]
+        if len(intervals) > 1:
+            message = ("Should only have one task in progress but found: {}"
+                       .format(intervals))
+            raise TooManyTasksInProgress(message)
+        return intervals[0] if intervals else None
+
+
+class MemoryData(Data):
+    """Data on the memory backend. conn is None, so functions that run
+    SQL against data.conn, like the reports, need the SQLite backend."""
+
+    def __init__(self):
+        store = Store()
+        tasks = MemoryTasks(store)
+        Data.__init__(self, None, tasks, MemoryTaskIntervals(store, tasks))
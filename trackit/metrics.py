@@ -0,0 +1,234 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Metrics in the Prometheus textfile format.
+
+Every command updates the metrics file when it has run: the previous
+file is parsed, counters and histograms are added to and the file is
+replaced atomically, so that a textfile collector never sees a partial
+file and scraping does not involve trackit at all.
+"""
+
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Upper bounds of the buckets of the duration histograms, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name: (type, help) of every metric family that is written
+FAMILIES = {
+    'trackit_commands_total': (
+        'counter', 'Commands run, by command and outcome.'),
+    'trackit_command_duration_seconds': (
+        'histogram', 'Time spent running commands.'),
+    'trackit_commit_duration_seconds': (
+        'histogram', 'Time spent committing after commands.'),
+    'trackit_sqlite_statements_total': (
+        'counter', 'SQL statements executed by commands.'),
+    'trackit_sqlite_busy_total': (
+        'counter', 'Statements that failed because the database was locked.'),
+    'trackit_database_size_bytes': (
+        'gauge', 'Size of the database file.'),
+    'trackit_wal_size_bytes': (
+        'gauge', 'Size of the write-ahead log of the database.'),
+    'trackit_tasks': ('gauge', 'Number of tasks.'),
+    'trackit_intervals': ('gauge', 'Number of task intervals.'),
+}
+
+SUFFIXES = ('_bucket', '_sum', '_count')
+
+
+class CountingCursor(sqlite3.Cursor):
+    """Cursor counting statements on its CountingConnection."""
+
+    def _run(self, method, *args):
+        self.connection.statements += 1
+        try:
+            return method(self, *args)
+        except sqlite3.OperationalError, e:
+            if 'locked' in str(e) or 'busy' in str(e):
+                self.connection.busy += 1
+            raise
+
+    def execute(self, *args):
+        return self._run(sqlite3.Cursor.execute, *args)
+
+    def executemany(self, *args):
+        return self._run(sqlite3.Cursor.executemany, *args)
+
+    def executescript(self, *args):
+        return self._run(sqlite3.Cursor.executescript, *args)
+
+
+class CountingConnection(sqlite3.Connection):
+    """Connection counting the statements executed through it, and the
+    ones that failed because the database was locked.
+
+    Pass it as the factory to sqlite3.connect()."""
+
+    def __init__(self, *args, **kwargs):
+        sqlite3.Connection.__init__(self, *args, **kwargs)
+        self.statements = 0
+        self.busy = 0
+
+    def cursor(self, factory=CountingCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+
+def _family(name):
+    if name in FAMILIES:
+        return name
+    for suffix in SUFFIXES:
+        if name.endswith(suffix) and name[:-len(suffix)] in FAMILIES:
+            return name[:-len(suffix)]
+    return None
+
+
+class Metrics(object):
+    """The samples of a metrics file, by sample name with labels."""
+
+    def __init__(self, path):
+        """Create Metrics, starting from the samples in path if it exists.
+
+        Arguments:
+        - `path`: Path of the metrics file.
+        """
+        self.path = path
+        self.samples = {}
+        try:
+            with open(path.path) as inf:
+                lines = inf.readlines()
+        except IOError:
+            lines = []
+        for line in lines:
+            if line.startswith('#') or not line.strip():
+                continue
+            key, _, value = line.strip().rpartition(' ')
+            if _family(key.partition('{')[0]) is None:
+                continue
+            try:
+                self.samples[key] = float(value)
+            except ValueError:
+                pass
+
+    @staticmethod
+    def key(name, **labels):
+        """The sample name of name with labels, as written to the file."""
+        if not labels:
+            return name
+        return '{}{{{}}}'.format(name, ','.join(
+            '{}="{}"'.format(label, value)
+            for label, value in sorted(labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter."""
+        key = Metrics.key(name, **labels)
+        self.samples[key] = self.samples.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge to value."""
+        self.samples[Metrics.key(name, **labels)] = value
+
+    def observe(self, name, value, **labels):
+        """Add value to a histogram."""
+        for bucket in BUCKETS:
+            if value <= bucket:
+                self.inc(name + '_bucket', le=repr(bucket), **labels)
+        self.inc(name + '_bucket', le='+Inf', **labels)
+        self.inc(name + '_sum', value, **labels)
+        self.inc(name + '_count', **labels)
+
+    def write(self):
+        """Write the samples to the metrics file, replacing it atomically."""
+        families = {}
+        for key, value in self.samples.items():
+            family = _family(key.partition('{')[0])
+            families.setdefault(family, []).append((key, value))
+        lines = []
+        for family in sorted(families):
+            kind, description = FAMILIES[family]
+            lines.append('# HELP {} {}\n'.format(family, description))
+            lines.append('# TYPE {} {}\n'.format(family, kind))
+            lines.extend('{} {}\n'.format(key, repr(float(value)))
+                         for key, value in sorted(families[family]))
+        temporary = '{}.{}.tmp'.format(self.path.path, os.getpid())
+        with open(temporary, 'w') as outf:
+            outf.writelines(lines)
+        os.rename(temporary, self.path.path)
+
+
+@contextmanager
+def _locked(path):
+    """Keep other processes from updating the metrics file at path."""
+    if fcntl is None:
+        yield
+        return
+    with open('{}.lock'.format(path.path), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def record(path, command, failed, seconds, commit_seconds, conn, db_path,
+           gauges=True):
+    """Add a command run to the metrics file at path.
+
+    The number of task intervals is summed from the running interval
+    counts of the tasks, so that recording stays cheap as the history
+    grows.
+
+    Arguments:
+    - `path`: Path of the metrics file.
+    - `command`: name of the command.
+    - `failed`: True if the command raised an exception or returned a
+      non-zero exit code.
+    - `seconds`: time spent running the command.
+    - `commit_seconds`: time spent committing, None if nothing was.
+    - `conn`: the CountingConnection the command used.
+    - `db_path`: Path of the database file.
+    - `gauges`: whether to update the task and interval gauges from conn,
+      which must then be open.
+    """
+    statements, busy = conn.statements, conn.busy
+    counts = {}
+    if gauges:
+        with closing(conn.cursor()) as cursor:
+            cursor.execute("SELECT COUNT(*), COALESCE(SUM(INTERVAL_COUNT), 0)"
+                           " FROM TASK")
+            counts['trackit_tasks'], counts['trackit_intervals'] = \
+                cursor.fetchone()
+    with _locked(path):
+        metrics = Metrics(path)
+        metrics.inc('trackit_commands_total', command=command,
+                    outcome='error' if failed else 'ok')
+        metrics.observe('trackit_command_duration_seconds', seconds,
+                        command=command)
+        if commit_seconds is not None:
+            metrics.observe('trackit_commit_duration_seconds', commit_seconds)
+        metrics.inc('trackit_sqlite_statements_total', statements)
+        metrics.inc('trackit_sqlite_busy_total', busy)
+        metrics.set('trackit_database_size_bytes', _size(db_path.path))
+        metrics.set('trackit_wal_size_bytes', _size(db_path.path + '-wal'))
+        for gauge, count in counts.items():
+            metrics.set(gauge, count)
+        metrics.write()
+
@@ -0,0 +1,208 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Aggregation over time partitions in a pool of processes.
+
+The report window is split into consecutive partitions and every worker
+process sums the time of each task in one partition on a read-only
+connection of its own. Intervals are clipped to the partition they are
+summed in, so an interval crossing a boundary is counted in every
+partition it reaches into, for exactly the time it spends there, and the
+partial sums simply add up.
+
+SQLite connections can not share a snapshot, so while the workers read,
+a connection of this process holds the write lock of the database: every
+worker then sees the same committed state, and other writers wait for
+the report. When the lock is taken, by another process or by changes
+still pending on the reporting connection, the report is summed in this
+process instead, on that connection.
+"""
+
+import multiprocessing
+import sqlite3
+import time
+from contextlib import closing
+
+from trackit import report
+from trackit.data import Task, database_path, _chunks, _placeholders
+
+# Partitions per process, so that a slow partition does not leave the
+# other processes idle
+PARTITIONS_PER_PROCESS = 4
+
+# As in report.periods(), the last interval starting before a partition
+# is the only one starting outside it that can reach into it. This is a
+# plain SELECT rather than a WITH query, which the sqlite3 module of
+# Python 2 would commit pending changes before.
+PARTITION_TOTALS = """
+    SELECT TASK, SUM(MIN(COALESCE(STOP_TIME, :now), :until)
+                     - MAX(START_TIME, :since))
+    FROM (
+        SELECT TASK, START_TIME, STOP_TIME FROM TASKINTERVAL
+        WHERE TASKINTERVAL = (SELECT TASKINTERVAL FROM TASKINTERVAL
+                              WHERE START_TIME < :since
+                              ORDER BY START_TIME DESC LIMIT 1)
+        UNION ALL
+        SELECT TASK, START_TIME, STOP_TIME FROM TASKINTERVAL
+        WHERE START_TIME >= :since AND START_TIME < :until
+    )
+    WHERE MIN(COALESCE(STOP_TIME, :now), :until) > MAX(START_TIME, :since)
+    GROUP BY TASK
+"""
+
+
+def _totals(conn, since, until, now):
+    """Seconds per task id between since and until on conn."""
+    with closing(conn.cursor()) as cursor:
+        cursor.execute(PARTITION_TOTALS,
+                       {'since': since, 'until': until, 'now': now})
+        return dict(cursor.fetchall())
+
+
+def _partition_totals(arguments):
+    """Seconds per task id in one partition, run in a worker process."""
+    path, since, until, now = arguments
+    with closing(sqlite3.connect(path)) as conn:
+        conn.execute("PRAGMA query_only = 1")
+        return _totals(conn, since, until, now)
+
+
+def _write_lock(path):
+    """A connection to the database at path holding its write lock, or
+    None if another connection holds it."""
+    conn = sqlite3.connect(path, timeout=0, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+    except sqlite3.OperationalError:
+        conn.close()
+        return None
+    return conn
+
+
+def partitions(since, until, count):
+    """Split the time from since to until into count consecutive
+    (since, until) partitions of about equal length.
+
+    Bounds are whole seconds when since and until are, so that summing
+    the partitions adds no rounding errors.
+
+    Arguments:
+    - `since`: unix time the first partition starts at.
+    - `until`: unix time the last partition ends at.
+    - `count`: the number of partitions.
+    """
+    bounds = [since + (until - since) * i // count for i in range(count)]
+    bounds.append(until)
+    return zip(bounds, bounds[1:])
+
+
+def task_seconds(data, since=None, until=None, processes=None):
+    """Seconds spent on each task id between since and until, summed in
+    parallel. See report.totals().
+
+    Nothing is committed: while changes are pending on data, the seconds
+    are summed on data in this process, see the module documentation.
+
+    Arguments:
+    - `data`: the Data to report on, it must be stored in a file.
+    - `since`: unix time the report starts at, None for the beginning.
+    - `until`: unix time the report ends at, None for now.
+    - `processes`: the number of processes, None for one per cpu.
+    """
+    now = time.time()
+    until = now if until is None else until
+    if since is None:
+        with closing(data.conn.cursor()) as cursor:
+            cursor.execute("SELECT MIN(START_TIME) FROM TASKINTERVAL")
+            since = cursor.fetchone()[0]
+    if since is None or since >= until:
+        return {}
+    path = database_path(data.conn)
+    lock = _write_lock(path)
+    if lock is None:
+        return _totals(data.conn, since, until, now)
+    processes = processes or multiprocessing.cpu_count()
+    work = [(path, first, last, now) for first, last in
+            partitions(since, until, processes * PARTITIONS_PER_PROCESS)]
+    try:
+        pool = multiprocessing.Pool(processes)
+        try:
+            partial = pool.map(_partition_totals, work)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        lock.execute("ROLLBACK")
+        lock.close()
+    seconds = {}
+    for totals in partial:
+        for task, value in totals.items():
+            seconds[task] = seconds.get(task, 0) + value
+    return seconds
+
+
+def _tasks(data, ids):
+    tasks = {}
+    with closing(data.conn.cursor()) as cursor:
+        for chunk in _chunks(sorted(ids)):
+            cursor.execute("SELECT {} FROM TASK WHERE TASK IN ({})"
+                           .format(Task.columns(), _placeholders(chunk)),
+                           chunk)
+            for row in cursor.fetchall():
+                tasks[row[0]] = Task.map_row(row)
+    return tasks
+
+
+def _ranked(tasks, seconds):
+    return sorted(((tasks[task], value) for task, value in seconds.items()
+                   if task in tasks),
+                  key=lambda pair: (-pair[1], pair[0].task_id))
+
+
+def totals(data, since=None, until=None, processes=None):
+    """Like report.totals(), summed in parallel over time partitions.
+
+    Databases that are not stored in a file are reported on in this
+    process.
+
+    Arguments:
+    - `data`: the Data to report on.
+    - `since`: unix time the report starts at, None for the beginning.
+    - `until`: unix time the report ends at, None for now.
+    - `processes`: the number of processes, None for one per cpu.
+    """
+    if not database_path(data.conn):
+        return report.totals(data, since, until)
+    seconds = task_seconds(data, since, until, processes)
+    return _ranked(_tasks(data, seconds), seconds)
+
+
+def rollup(data, since=None, until=None, processes=None):
+    """Like report.rollup(), summed in parallel over time partitions.
+
+    The seconds of every task are added to its ancestors afterwards, with
+    one lookup in TASKCLOSURE per few hundred tasks.
+
+    Arguments:
+    - `data`: the Data to report on.
+    - `since`: unix time the report starts at, None for the beginning.
+    - `until`: unix time the report ends at, None for now.
+    - `processes`: the number of processes, None for one per cpu.
+    """
+    if not database_path(data.conn):
+        return report.rollup(data, since, until)
+    seconds = task_seconds(data, since, until, processes)
+    rolled = {}
+    with closing(data.conn.cursor()) as cursor:
+        for chunk in _chunks(sorted(seconds)):
+            cursor.execute("SELECT ANCESTOR, DESCENDANT FROM TASKCLOSURE"
+                           " WHERE DESCENDANT IN ({})"
+                           .format(_placeholders(chunk)), chunk)
+            for ancestor, descendant in cursor.fetchall():
+                rolled[ancestor] = rolled.get(ancestor, 0) + \
+                    seconds[descendant]
+    return _ranked(_tasks(data, rolled), rolled)
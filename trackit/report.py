@@ -0,0 +1,317 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Aggregated reports over task intervals.
+"""
+
+import bisect
+import datetime
+import json
+import math
+import time
+from contextlib import closing
+
+from trackit import calendars
+from trackit.data import Task
+
+# Used in place of a missing since
+BEGINNING = 0
+
+# Widths of series() buckets in seconds, the smallest that fits is used
+WIDTHS = (60, 60 * 60, 24 * 60 * 60)
+
+# Covering indexes for the report queries. They are only built on
+# snapshots, the live database would have to maintain them on every write.
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS TASKINTERVAL_REPORT ON"
+    " TASKINTERVAL(START_TIME, STOP_TIME, TASK)",
+)
+
+
+def prepare(conn):
+    """Build the reporting INDEXES that are missing in conn.
+
+    Arguments:
+    - `conn`: sqlite3 connection, usually to a snapshot.
+    """
+    with closing(conn.cursor()) as cursor:
+        for sql in INDEXES:
+            cursor.execute(sql)
+
+
+def totals(data, since=None, until=None):
+    """Seconds spent on each task between since and until.
+
+    Intervals are clipped to the window, intervals still in progress count
+    up to now. Returns a list of (Task, seconds) with the most worked on
+    task first.
+
+    Arguments:
+    - `data`: the Data to report on.
+    - `since`: unix time the report starts at, None for the beginning.
+    - `until`: unix time the report ends at, None for now.
+    """
+    now = time.time()
+    since = BEGINNING if since is None else since
+    until = now if until is None else until
+    sql = ("SELECT {}, "
+           "SUM(MIN(COALESCE(I.STOP_TIME, :now), :until) "
+           "- MAX(I.START_TIME, :since)) AS SECONDS "
+           "FROM TASKINTERVAL I JOIN TASK T ON T.TASK = I.TASK "
+           "WHERE I.START_TIME < :until "
+           "AND COALESCE(I.STOP_TIME, :now) > :since "
+           "GROUP BY T.TASK ORDER BY SECONDS DESC, T.TASK"
+           .format(Task.columns("T")))
+    width = len(Task.COLUMNS)
+    with closing(data.conn.cursor()) as cursor:
+        cursor.execute(sql, {'now': now, 'since': since, 'until': until})
+        return [(Task.map_row(row[:width]), row[width])
+                for row in cursor.fetchall()]
+
+
+def rollup(data, since=None, until=None):
+    """Seconds spent on each task and all tasks below it between since and
+    until.
+
+    Every interval is counted once for each ancestor of its task through
+    a join with TASKCLOSURE. Returns a list of (Task, seconds) with the
+    most worked on subtree first.
+
+    Arguments:
+    - `data`: the Data to report on.
+    - `since`: unix time the report starts at, None for the beginning.
+    - `until`: unix time the report ends at, None for now.
+    """
+    now = time.time()
+    since = BEGINNING if since is None else since
+    until = now if until is None else until
+    sql = ("SELECT {}, "
+           "SUM(MIN(COALESCE(I.STOP_TIME, :now), :until) "
+           "- MAX(I.START_TIME, :since)) AS SECONDS "
+           "FROM TASKINTERVAL I "
+           "JOIN TASKCLOSURE C ON C.DESCENDANT = I.TASK "
+           "JOIN TASK T ON T.TASK = C.ANCESTOR "
+           "WHERE I.START_TIME < :until "
+           "AND COALESCE(I.STOP_TIME, :now) > :since "
+           "GROUP BY T.TASK ORDER BY SECONDS DESC, T.TASK"
+           .format(Task.columns("T")))
+    width = len(Task.COLUMNS)
+    with closing(data.conn.cursor()) as cursor:
+        cursor.execute(sql, {'now': now, 'since': since, 'until': until})
+        return [(Task.map_row(row[:width]), row[width])
+                for row in cursor.fetchall()]
+
+
+def _first_start(data):
+    """Unix time the first task interval starts at, None if there are no
+    task intervals."""
+    with closing(data.conn.cursor()) as cursor:
+        cursor.execute("SELECT MIN(START_TIME) FROM TASKINTERVAL")
+        return cursor.fetchone()[0]
+
+
+def fill_calendar(data, since=None, until=None, zone=None):
+    """Fill the CALENDAR table for the window of a report, so periods()
+    joins against it instead of passing in the days. This writes to data.
+
+    Arguments:
+    - `data`: the Data to report on.
+    - `since`: unix time the report starts at, None for the beginning.
+    - `until`: unix time the report ends at, None for now.
+    - `zone`: name of the timezone, None for the local timezone.
+    """
+    until = time.time() if until is None else until
+    since = _first_start(data) if since is None else since
+    if since is not None:
+        calendars.Calendar(data.conn, zone).cover(since, until)
+
+
+def periods(data, period='day', since=None, until=None, zone=None):
+    """Seconds spent on each task per local day, week or month.
+
+    Intervals are split at local midnight using the CALENDAR table, so
+    the aggregation happens in SQLite. Days the table does not have, like
+    on read-only connections, are computed and passed in as json instead.
+    Returns a list of (label, Task, seconds), ordered by label and then by
+    the most worked on task.
+
+    Arguments:
+    - `data`: the Data to report on.
+    - `period`: one of calendars.PERIODS.
+    - `since`: unix time the report starts at, None for the beginning.
+    - `until`: unix time the report ends at, None for now.
+    - `zone`: name of the timezone, None for the local timezone.
+    """
+    now = time.time()
+    until = now if until is None else until
+    if since is None:
+        since = _first_start(data)
+        if since is None:
+            return []
+    calendar = calendars.Calendar(data.conn, zone)
+    label = calendars.PERIODS[period]
+    params = {'now': now, 'since': since, 'until': until}
+    if calendar.covers(since, until):
+        days = ("SELECT {} AS LABEL, START_TIME, STOP_TIME FROM CALENDAR"
+                " WHERE STOP_TIME > :since AND START_TIME < :until"
+                .format(label))
+    else:
+        column = ('DAY', 'START_TIME', 'STOP_TIME', 'WEEK', 'MONTH').index
+        days = ("SELECT json_extract(value, '$[{}]') AS LABEL,"
+                " json_extract(value, '$[1]') AS START_TIME,"
+                " json_extract(value, '$[2]') AS STOP_TIME"
+                " FROM json_each(:days)".format(column(label)))
+        params['days'] = json.dumps(calendar.rows(since, until))
+    # Intervals do not overlap, so the only interval that can cover the
+    # start of a day is the last one starting before it.
+    sql = """
+    WITH DAYS AS ({days}), SPANS AS (
+        SELECT D.LABEL, D.START_TIME AS DAY_START, D.STOP_TIME AS DAY_STOP,
+               I.TASK, I.START_TIME, I.STOP_TIME
+        FROM DAYS D JOIN TASKINTERVAL I
+        ON I.START_TIME >= D.START_TIME AND I.START_TIME < D.STOP_TIME
+        UNION ALL
+        SELECT D.LABEL, D.START_TIME, D.STOP_TIME,
+               I.TASK, I.START_TIME, I.STOP_TIME
+        FROM DAYS D JOIN TASKINTERVAL I ON I.TASKINTERVAL = (
+            SELECT TASKINTERVAL FROM TASKINTERVAL
+            WHERE START_TIME < D.START_TIME
+            ORDER BY START_TIME DESC LIMIT 1)
+    )
+    SELECT S.LABEL, {columns},
+           SUM(MIN(COALESCE(S.STOP_TIME, :now), S.DAY_STOP, :until)
+               - MAX(S.START_TIME, S.DAY_START, :since)) AS SECONDS
+    FROM SPANS S JOIN TASK T ON T.TASK = S.TASK
+    WHERE MIN(COALESCE(S.STOP_TIME, :now), S.DAY_STOP, :until)
+          > MAX(S.START_TIME, S.DAY_START, :since)
+    GROUP BY S.LABEL, T.TASK ORDER BY S.LABEL, SECONDS DESC, T.TASK
+""".format(days=days, columns=Task.columns("T"))
+    width = len(Task.COLUMNS)
+    with closing(data.conn.cursor()) as cursor:
+        cursor.execute(sql, params)
+        return [(row[0], Task.map_row(row[1:width + 1]), row[width + 1])
+                for row in cursor.fetchall()]
+
+
+def _buckets(since, until, width):
+    first = math.floor(since / float(width)) * width
+    return first, int(math.ceil((until - first) / float(width))) or 1
+
+
+def bucket_width(since, until, max_points, calendar=None):
+    """The width in seconds of the buckets series() uses for a window.
+
+    This is the smallest of WIDTHS giving at most max_points buckets, or
+    a whole number of days for windows too long for day buckets. Buckets
+    of days are counted in the local days of the calendars.Calendar
+    calendar when it is given, see _edges().
+
+    Arguments:
+    - `since`: unix time the window starts at.
+    - `until`: unix time the window ends at.
+    - `max_points`: the maximum number of buckets.
+    - `calendar`: the Calendar of day buckets, None to count them in
+      days since the epoch.
+    """
+    if max_points < 1:
+        raise ValueError("Need room for at least one point")
+    day = WIDTHS[-1]
+    def count(width):
+        if calendar is None or width < day:
+            return _buckets(since, until, width)[1]
+        return len(_edges(calendar, since, until, width)) - 1
+    for width in WIDTHS:
+        if count(width) <= max_points:
+            return width
+    days = int(math.ceil((until - since) / float(day) / max_points))
+    while count(days * day) > max_points:
+        days += 1
+    return days * day
+
+
+def _edges(calendar, since, until, width):
+    """Start of every bucket of width from since to until, followed by the
+    end of the last one.
+
+    Buckets shorter than a day are aligned to multiples of their width
+    since the epoch. Longer ones are whole local days of the
+    calendars.Calendar calendar, starting on days that are multiples of
+    their length since the epoch, so they keep their place as the window
+    moves."""
+    day = WIDTHS[-1]
+    if width < day:
+        first, count = _buckets(since, until, width)
+        return [first + i * width for i in range(count + 1)]
+    days = int(width // day)
+    first = calendar.local.date(since)
+    first -= datetime.timedelta((first.toordinal() - calendars.EPOCH) % days)
+    rows = calendar.rows(calendar.local.midnight(first), until + width)
+    edges = [row[1] for row in rows[::days]]
+    end = bisect.bisect_left(edges, until, 1)
+    return edges[:end + 1]
+
+
+def series(data, since=None, until=None, max_points=1000, task=None,
+           zone=None):
+    """Seconds tracked per bucket between since and until.
+
+    The width of the buckets is chosen with bucket_width(), buckets of a
+    day or more are local days, see _edges(). Task intervals are
+    read in one pass over the START_TIME index and split over the buckets
+    they cover, so the work does not depend on the size of the history
+    outside the window. Returns the width and a list of (bucket start,
+    seconds) with every bucket in the window, including empty ones.
+
+    Arguments:
+    - `data`: the Data to report on.
+    - `since`: unix time the series starts at, None for the first interval.
+    - `until`: unix time the series ends at, None for now.
+    - `max_points`: the maximum number of buckets.
+    - `task`: only count this task and the tasks below it, None for all.
+    - `zone`: name of the timezone of day buckets, None for the local
+      timezone.
+    """
+    now = time.time()
+    until = now if until is None else until
+    if since is None:
+        since = _first_start(data)
+        if since is None:
+            since = until
+    calendar = calendars.Calendar(data.conn, zone)
+    width = bucket_width(since, until, max_points, calendar)
+    edges = _edges(calendar, since, until, width)
+    seconds = [0] * (len(edges) - 1)
+    # As in periods(), the last interval starting before since is the only
+    # one starting outside the window that can reach into it.
+    sql = """
+    WITH SPANS AS (
+        SELECT TASK, START_TIME, STOP_TIME FROM TASKINTERVAL
+        WHERE TASKINTERVAL = (SELECT TASKINTERVAL FROM TASKINTERVAL
+                              WHERE START_TIME < :since
+                              ORDER BY START_TIME DESC LIMIT 1)
+        UNION ALL
+        SELECT TASK, START_TIME, STOP_TIME FROM TASKINTERVAL
+        WHERE START_TIME >= :since AND START_TIME < :until
+    )
+    SELECT MAX(START_TIME, :since),
+           MIN(COALESCE(STOP_TIME, :now), :until) FROM SPANS
+    WHERE MIN(COALESCE(STOP_TIME, :now), :until) > MAX(START_TIME, :since)
+"""
+    params = {'now': now, 'since': since, 'until': until}
+    if task is not None:
+        sql += (" AND TASK IN (SELECT DESCENDANT FROM TASKCLOSURE"
+                " WHERE ANCESTOR = :task)")
+        params['task'] = task.task_id
+    with closing(data.conn.cursor()) as cursor:
+        cursor.execute(sql, params)
+        for start, stop in cursor:
+            bucket = bisect.bisect_right(edges, start) - 1
+            while start < stop:
+                end = min(edges[bucket + 1], stop)
+                seconds[bucket] += end - start
+                start, bucket = end, bucket + 1
+    return width, zip(edges, seconds)
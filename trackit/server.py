@@ -0,0 +1,300 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Local HTTP/JSON interface to trackit.
+
+Writes go through one connection guarded by a lock. Reads are served by a
+small pool of read-only connections. Every GET response carries an ETag
+derived from the change counters of the writer connection, so a client
+that sends If-None-Match gets 304 Not Modified without any query being
+run against the tables.
+
+When the command line journals starts and stops, the journal is
+compacted into the database before every request, so that reads see
+those events and writes are checked against them.
+"""
+
+import json
+import sqlite3
+import sys
+import threading
+import time
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from Queue import Queue
+from SocketServer import ThreadingMixIn
+from contextlib import contextmanager
+
+from trackit import report
+from trackit.cache import ReportCache
+from trackit.data import Data, InvalidPageToken, TaskIntervals, data_version
+from trackit.exceptions import TrackitException
+from trackit.journal import JournaledIntervals
+from trackit.stats import Stats
+
+
+class ConnectionPool(object):
+    """A fixed number of read-only Data instances shared between threads."""
+
+    def __init__(self, connect, size=4):
+        """Create a ConnectionPool.
+
+        Arguments:
+        - `connect`: function returning a new sqlite3 connection, which
+          must be usable from any thread.
+        - `size`: the number of connections in the pool.
+        """
+        self.pool = Queue()
+        for _ in range(size):
+            conn = connect()
+            data = Data(conn)
+            conn.commit()
+            conn.execute("PRAGMA query_only = 1")
+            self.pool.put(data)
+
+    @contextmanager
+    def data(self):
+        """Context-managed Data from the pool, blocks while all are busy."""
+        data = self.pool.get()
+        try:
+            yield data
+        finally:
+            self.pool.put(data)
+
+
+class BadRequest(TrackitException):
+    """The request is missing or has malformed parameters."""
+    pass
+
+
+def _task_json(task):
+    return {'id': task.task_id, 'name': task.name,
+            'description': task.description}
+
+def _interval_json(interval):
+    return {'id': interval.task_interval, 'task': _task_json(interval.task),
+            'start_time': interval.start_time,
+            'stop_time': interval.stop_time}
+
+def _number(query, name, default=None, kind=float):
+    if name not in query:
+        return default
+    try:
+        return kind(query[name][-1])
+    except ValueError:
+        raise BadRequest("{} must be a number".format(name))
+
+def _limit(query):
+    limit = _number(query, 'limit', 50, int)
+    if limit < 1:
+        raise BadRequest("limit must be positive")
+    return limit
+
+
+class Trackit(object):
+    """The trackit operations exposed by the server."""
+
+    def __init__(self, connect, readers=4, zone=None, journal=None):
+        """Create the trackit operations.
+
+        Arguments:
+        - `connect`: function returning a new sqlite3 connection, which
+          must be usable from any thread.
+        - `readers`: the number of read-only connections.
+        - `zone`: name of the timezone of day buckets in series and of
+          streaks in stats, None for the local timezone.
+        - `journal`: the Journal the command line writes starts and stops
+          to, None if it writes them to the database.
+        """
+        self.zone = zone
+        self.journal = journal
+        conn = connect()
+        stats = Stats(conn, zone=zone)
+        self.writer = Data(conn, intervals=TaskIntervals(conn, stats=stats))
+        self.writer.conn.commit()
+        self.lock = threading.Lock()
+        self.readers = ConnectionPool(connect, readers)
+        self.reports = ReportCache()
+
+    def compact(self):
+        """Replay the events in the journal into the database."""
+        if self.journal is None or not self.journal.path.exists():
+            return
+        with self.lock:
+            intervals = JournaledIntervals(self.writer.intervals, self.journal)
+            try:
+                intervals.compact()
+                self.writer.conn.commit()
+            except:
+                self.writer.conn.rollback()
+                raise
+            for message in intervals.clear_compacted():
+                sys.stderr.write(u'{}\n'.format(message).encode('utf-8'))
+
+    def version(self):
+        """Value that changes whenever the database changes."""
+        with self.lock:
+            conn = self.writer.conn
+            return '{}-{}'.format(data_version(conn), conn.total_changes)
+
+    def status(self, query):
+        with self.readers.data() as data:
+            in_progress = data.intervals.in_progress()
+        if in_progress is None:
+            return {'tracking': None}
+        return {'tracking': _interval_json(in_progress)}
+
+    def tasks(self, query):
+        limit = _limit(query)
+        with self.readers.data() as data:
+            tasks, token = data.tasks.page(query.get('token', [None])[-1],
+                                           limit)
+        return {'tasks': [_task_json(task) for task in tasks],
+                'token': token}
+
+    def intervals(self, query):
+        limit = _limit(query)
+        with self.readers.data() as data:
+            intervals, token = data.intervals.page(
+                query.get('token', [None])[-1], limit,
+                _number(query, 'since'), _number(query, 'until'))
+        return {'intervals': [_interval_json(interval)
+                              for interval in intervals],
+                'token': token}
+
+    def report(self, query):
+        with self.readers.data() as data:
+            totals = self.reports.get(data, report.totals,
+                                      since=_number(query, 'since'),
+                                      until=_number(query, 'until'))
+        return {'totals': [{'task': _task_json(task), 'seconds': seconds}
+                           for task, seconds in totals]}
+
+    def series(self, query):
+        task = _number(query, 'task', None, int)
+        points = _number(query, 'points', 1000, int)
+        if points < 1:
+            raise BadRequest("points must be positive")
+        with self.readers.data() as data:
+            if task is not None:
+                try:
+                    task = data.tasks.by_id(task)
+                except KeyError:
+                    raise BadRequest("No task with id {}".format(task))
+            width, points = self.reports.get(
+                data, report.series, since=_number(query, 'since'),
+                until=_number(query, 'until'), max_points=points, task=task,
+                zone=self.zone)
+        return {'width': width,
+                'points': [[start, seconds] for start, seconds in points]}
+
+    def _write(self, operation):
+        with self.lock:
+            try:
+                out = operation(self.writer)
+                self.writer.conn.commit()
+                return out
+            except:
+                self.writer.conn.rollback()
+                raise
+
+    def start(self, body):
+        name = body.get('task')
+        if not name:
+            raise BadRequest("task is required")
+        def start(data):
+            tasks = data.tasks.named(name)
+            task = tasks[0] if tasks else data.tasks.resolve(name,
+                                                             create=True)
+            return _interval_json(data.intervals.start(task))
+        return self._write(start)
+
+    def stop(self, body):
+        def stop(data):
+            in_progress = data.intervals.in_progress()
+            if in_progress is None:
+                raise TrackitException("Nothing to stop.")
+            return _interval_json(data.intervals.stop(in_progress.task))
+        return self._write(stop)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Dispatches requests to the Trackit instance of the server."""
+
+    GET = {'/status': 'status', '/tasks': 'tasks',
+           '/intervals': 'intervals', '/report': 'report',
+           '/series': 'series'}
+    POST = {'/start': 'start', '/stop': 'stop'}
+
+    def _respond(self, code, content=None, etag=None):
+        body = json.dumps(content) if content is not None else ''
+        self.send_response(code)
+        if etag is not None:
+            self.send_header('ETag', etag)
+        if content is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, routes, argument, etag=None):
+        path = urlparse.urlparse(self.path).path
+        if path not in routes:
+            return self._respond(404, {'error': 'No such resource.'})
+        try:
+            content = getattr(self.server.trackit, routes[path])(argument)
+        except (BadRequest, InvalidPageToken), e:
+            return self._respond(400, {'error': unicode(e)})
+        except TrackitException, e:
+            return self._respond(409, {'error': unicode(e)})
+        except sqlite3.OperationalError, e:
+            return self._respond(500, {'error': 'Database error: {}'
+                                       .format(e)})
+        self._respond(200, content, etag)
+
+    def do_GET(self):
+        self.server.trackit.compact()
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        etag = self.server.trackit.version()
+        if url.path in ('/report', '/series'):
+            # Reports without an end get one at the next whole minute. The
+            # task in progress still counts up to now, the end only bounds
+            # the ETag, so that clients may reuse a report for up to a
+            # minute. The report cache does not keep it while a task is in
+            # progress.
+            minute = int(time.time()) // 60 + 1
+            until = query.setdefault('until', [minute * 60])
+            etag = '{}-{}'.format(etag, until[-1])
+        etag = '"{}"'.format(etag)
+        if self.headers.get('If-None-Match') == etag:
+            return self._respond(304, etag=etag)
+        self._dispatch(self.GET, query, etag)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length)) if length else {}
+        except ValueError:
+            return self._respond(400, {'error': 'Body must be json.'})
+        if not isinstance(body, dict):
+            return self._respond(400, {'error': 'Body must be a json object.'})
+        self.server.trackit.compact()
+        self._dispatch(self.POST, body)
+
+    def log_message(self, format_, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server for a Trackit instance."""
+
+    daemon_threads = True
+
+    def __init__(self, address, trackit):
+        HTTPServer.__init__(self, address, Handler)
+        self.trackit = trackit
@@ -0,0 +1,125 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Interactive trackit shell.
+
+The shell runs the regular trackit commands against one connection that
+stays open between commands, committing after each of them. Task names
+are completed from a sorted in-memory index that is only reloaded when a
+Watcher notices that the database has changed.
+"""
+
+import bisect
+import cmd
+import shlex
+import sqlite3
+
+from trackit.exceptions import ArgumentParsingException, TrackitException
+from trackit.journal import JournaledIntervals
+from trackit.watch import Watcher
+
+
+class Shell(cmd.Cmd):
+    """Read-eval-print loop over the trackit commands."""
+
+    prompt = 'trackit> '
+    intro = 'Type a trackit command, help for a list of commands or quit.'
+
+    def __init__(self, configuration, data, parser, commands,
+                 stdin=None, stdout=None):
+        """Create a Shell.
+
+        Arguments:
+        - `configuration`: the loaded trackit configuration.
+        - `data`: the Data to run commands against.
+        - `parser`: the argument parser of the trackit command line.
+        - `commands`: the names of the commands of parser.
+        - `stdin`: file to read commands from, defaults to sys.stdin.
+        - `stdout`: file to write to, defaults to sys.stdout.
+        """
+        cmd.Cmd.__init__(self, stdin=stdin, stdout=stdout)
+        if stdin is not None:
+            self.use_rawinput = False
+        self.configuration = configuration
+        self.data = data
+        self.parser = parser
+        self.commands = sorted(commands)
+        self.watcher = Watcher(data.conn)
+        self._names = []
+
+    def task_names(self, prefix=''):
+        """Names of the tasks starting with prefix, in sorted order.
+
+        Arguments:
+        - `prefix`: the start of the names.
+        """
+        if self.watcher.changed():
+            self._names = self.data.tasks.names()
+        first = bisect.bisect_left(self._names, prefix)
+        last = first
+        while (last < len(self._names) and
+               self._names[last].startswith(prefix)):
+            last += 1
+        return self._names[first:last]
+
+    def _run(self, args):
+        options = self.parser.parse_args(args)
+        command = getattr(options.func, 'command', None)
+        if command is None or getattr(command, 'untransacted', False):
+            raise TrackitException("{} can not be used in the shell"
+                                   .format(args[0]))
+        intervals = self.data.intervals
+        journaled = isinstance(intervals, JournaledIntervals)
+        if journaled and not getattr(command, 'journaled', False):
+            intervals.compact()
+        out = command(self.configuration, options, self.data)
+        self.data.conn.commit()
+        if journaled:
+            if len(intervals.journal) >= self.configuration.get(
+                    'journal_compact_after', 100):
+                intervals.compact()
+                self.data.conn.commit()
+            for message in intervals.clear_compacted():
+                self.stdout.write(u'{}\n'.format(message).encode('utf-8'))
+        return out
+
+    def default(self, line):
+        try:
+            args = shlex.split(line, comments=True)
+            if args:
+                self._run(args)
+        except ArgumentParsingException:
+            # argparse has already explained what is wrong
+            pass
+        except (TrackitException, sqlite3.Error, KeyError, ValueError), e:
+            # A command that fails, or finds the database locked by
+            # another process, must not end the shell
+            self.data.conn.rollback()
+            if isinstance(self.data.intervals, JournaledIntervals):
+                self.data.intervals.rolled_back()
+            self.stdout.write('{}\n'.format(e))
+
+    def emptyline(self):
+        # Repeating the last command, like cmd.Cmd does, would start or
+        # stop tasks by accident.
+        pass
+
+    def do_help(self, line):
+        self.default('{} --help'.format(line) if line else '--help')
+
+    def do_quit(self, line):
+        """Leave the shell."""
+        return True
+
+    do_EOF = do_quit
+
+    def completenames(self, text, *ignored):
+        return [name for name in self.commands + ['help', 'quit']
+                if name.startswith(text)]
+
+    def completedefault(self, text, line, begidx, endidx):
+        return self.task_names(text)
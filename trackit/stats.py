@@ -0,0 +1,375 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Session length statistics of tasks.
+
+The lengths of the stopped task intervals of a task are summarized in a
+Sketch: count, mean and variance, and quantiles from logarithmically
+sized buckets, which answer within a relative accuracy in bounded memory
+and merge by adding buckets. Sketches are stored in TASKSTATS along with
+streaks of consecutive days worked, and are updated as intervals are
+stopped. Stats that no longer add up to the running totals of their task
+are rebuilt from its intervals in one pass.
+"""
+
+import json
+import math
+from contextlib import closing
+
+from trackit import calendars
+from trackit.data import ClosesCursor, Task, _migrate, _chunks, _placeholders
+from trackit.util import DefaultRepr, dumb_constructor
+
+# Relative accuracy of the quantiles of new sketches
+ACCURACY = 0.01
+
+# Buckets a sketch keeps at most, the smallest buckets are merged beyond
+# this. With an accuracy of 1% that covers lengths from a second to
+# longer than a year before any merging happens.
+MAX_BUCKETS = 2048
+
+# Lengths counted as zero, the logarithm of these has no bucket
+EPSILON = 1e-9
+
+
+class Sketch(DefaultRepr):
+    """Mergeable summary of a stream of values."""
+
+    def __init__(self, accuracy=ACCURACY, max_buckets=MAX_BUCKETS):
+        """Create an empty Sketch.
+
+        Arguments:
+        - `accuracy`: relative accuracy of the quantiles, like 0.01.
+        - `max_buckets`: the number of buckets to keep at most.
+        """
+        self.accuracy = accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = self.maximum = None
+
+    def add(self, value):
+        """Add value to the sketch."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = value if self.minimum is None else \
+            min(self.minimum, value)
+        self.maximum = value if self.maximum is None else \
+            max(self.maximum, value)
+        if value <= EPSILON:
+            self.zeros += 1
+            return
+        index = int(math.ceil(math.log(value) / self._log_gamma))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self._collapse()
+
+    def _collapse(self):
+        while len(self.buckets) > self.max_buckets:
+            lowest = sorted(self.buckets)[:2]
+            self.buckets[lowest[1]] += self.buckets.pop(lowest[0])
+
+    def merge(self, other):
+        """Add the values summarized by other to this sketch.
+
+        Arguments:
+        - `other`: a Sketch with the same accuracy.
+        """
+        if other.accuracy != self.accuracy:
+            raise ValueError("Can not merge sketches of different accuracy")
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.zeros += other.zeros
+        for index, bucket in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + bucket
+        self._collapse()
+        self.minimum = other.minimum if self.minimum is None else \
+            min(self.minimum, other.minimum)
+        self.maximum = other.maximum if self.maximum is None else \
+            max(self.maximum, other.maximum)
+
+    @property
+    def variance(self):
+        """Population variance of the values, None if there are none."""
+        return self.m2 / self.count if self.count else None
+
+    @property
+    def stddev(self):
+        """Population standard deviation of the values."""
+        return None if not self.count else math.sqrt(self.variance)
+
+    def quantile(self, q):
+        """The value at quantile q, None if there are no values.
+
+        Arguments:
+        - `q`: the quantile, from 0 to 1.
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(value, self.minimum), self.maximum)
+        return self.maximum
+
+    def dumps(self):
+        """The sketch as a JSON string, see loads()."""
+        return json.dumps({
+            'accuracy': self.accuracy, 'max_buckets': self.max_buckets,
+            'buckets': sorted(self.buckets.items()), 'zeros': self.zeros,
+            'count': self.count, 'mean': self.mean, 'm2': self.m2,
+            'minimum': self.minimum, 'maximum': self.maximum})
+
+    @classmethod
+    def loads(cls, text):
+        """The Sketch stored as text by dumps()."""
+        state = json.loads(text)
+        sketch = cls(state['accuracy'], state['max_buckets'])
+        sketch.buckets = dict(state['buckets'])
+        for name in ('zeros', 'count', 'mean', 'm2', 'minimum', 'maximum'):
+            setattr(sketch, name, state[name])
+        return sketch
+
+
+def _day(when, local=None):
+    """Ordinal of the day of when in the calendars.Zone local, None for
+    the process timezone."""
+    return (local or calendars.lookup(None)).date(when).toordinal()
+
+
+class TaskStats(DefaultRepr):
+    """Model for the session statistics of a task.
+
+    sketch summarizes the lengths of its stopped task intervals, seconds
+    is their sum. streak is the number of consecutive days up to last_day
+    the task was started on, longest_streak the most there has been. Days
+    are counted in timezone, '' for the local timezone."""
+
+    @dumb_constructor
+    def __init__(self, task, sketch, seconds=0, last_day=None, streak=0,
+                 longest_streak=0, timezone=''):
+        pass
+
+    def add(self, start, stop, local=None):
+        """Add the task interval from start to stop, counting days in the
+        calendars.Zone local.
+
+        Intervals are expected roughly in order of start, a day before
+        last_day does not change streaks."""
+        self.sketch.add(stop - start)
+        self.seconds += stop - start
+        day = _day(start, local)
+        if self.last_day is None or day > self.last_day:
+            if self.last_day is not None and day == self.last_day + 1:
+                self.streak += 1
+            else:
+                self.streak = 1
+            self.last_day = day
+            self.longest_streak = max(self.longest_streak, self.streak)
+
+    def matches(self, in_progress, timezone):
+        """True if these stats add up to the running totals of their task,
+        and count days in timezone.
+
+        Arguments:
+        - `in_progress`: True if the task has an interval in progress.
+        - `timezone`: name of the timezone, '' for the local timezone.
+        """
+        task = self.task
+        stopped = task.interval_count - (1 if in_progress else 0)
+        return (self.timezone == timezone and
+                self.sketch.count == stopped and
+                abs(self.seconds - task.total_seconds) <=
+                EPSILON * max(1, abs(task.total_seconds)))
+
+
+class Stats(ClosesCursor):
+    """Repository for the session statistics of tasks.
+
+    Pass it to TaskIntervals to update statistics as intervals stop.
+    """
+
+    SCHEMA = """
+    CREATE TABLE TASKSTATS(
+        TASK INTEGER,
+        SECONDS REAL NOT NULL,
+        SKETCH TEXT NOT NULL,
+        LAST_DAY INTEGER,
+        STREAK INTEGER NOT NULL DEFAULT 0,
+        LONGEST_STREAK INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(TASK)
+    );
+"""
+    MIGRATIONS = (
+        """
+    CREATE TRIGGER IF NOT EXISTS TASKSTATS_TASK_DELETED
+    AFTER DELETE ON TASK BEGIN
+        DELETE FROM TASKSTATS WHERE TASK = old.TASK;
+    END
+""",
+        # Stats from before this do not match any timezone, so they are
+        # rebuilt
+        "ALTER TABLE TASKSTATS ADD COLUMN TIMEZONE TEXT",
+    )
+
+    COLUMNS = "SECONDS, SKETCH, LAST_DAY, STREAK, LONGEST_STREAK, TIMEZONE"
+
+    @dumb_constructor
+    def __init__(self, conn, accuracy=ACCURACY, zone=None):
+        """Create a Stats repository. This will attempt to register the
+        schema.
+
+        Arguments:
+        - `conn`: sqlite3 database connection.
+        - `accuracy`: relative accuracy of the quantiles of new sketches.
+        - `zone`: name of the timezone streaks are counted in, None for
+          the local timezone.
+        """
+        self.local = calendars.lookup(zone)
+        self.timezone = zone or ''
+        with self.cursor() as cursor:
+            _migrate(cursor, Stats.SCHEMA, Stats.MIGRATIONS)
+
+    def _map_row(self, task, row):
+        seconds, sketch, last_day, streak, longest_streak, timezone = row
+        return TaskStats(task, Sketch.loads(sketch), seconds, last_day,
+                         streak, longest_streak, timezone)
+
+    def _new(self, task):
+        return TaskStats(task, Sketch(self.accuracy), timezone=self.timezone)
+
+    def _save(self, cursor, stats):
+        cursor.execute("INSERT OR REPLACE INTO TASKSTATS(TASK, {}) VALUES"
+                       "(?, ?, ?, ?, ?, ?, ?)".format(Stats.COLUMNS),
+                       (stats.task.task_id, stats.seconds,
+                        stats.sketch.dumps(), stats.last_day, stats.streak,
+                        stats.longest_streak, stats.timezone))
+
+    def stopped(self, interval):
+        """Add a task interval that was just stopped to the stats of its
+        task.
+
+        Stats that count days in another timezone are rebuilt instead, so
+        that streaks are not counted in two timezones.
+
+        Arguments:
+        - `interval`: the stopped TaskInterval.
+        """
+        task = interval.task
+        with self.cursor() as cursor:
+            cursor.execute("SELECT {} FROM TASKSTATS WHERE TASK = ?"
+                           .format(Stats.COLUMNS), (task.task_id,))
+            row = cursor.fetchone()
+            stats = self._new(task) if row is None \
+                else self._map_row(task, row)
+            if stats.timezone != self.timezone:
+                self.rebuild([task])
+                return
+            stats.add(interval.start_time, interval.stop_time, self.local)
+            self._save(cursor, stats)
+
+    def rebuild(self, tasks):
+        """Recompute the stats of tasks from their stopped intervals, in
+        one pass over them ordered by task and start time.
+
+        Arguments:
+        - `tasks`: the Tasks to recompute the stats of.
+        """
+        by_id = dict((task.task_id, task) for task in tasks)
+        with self.cursor() as cursor, closing(self.conn.cursor()) as save:
+            for chunk in _chunks(sorted(by_id)):
+                cursor.execute("DELETE FROM TASKSTATS WHERE TASK IN ({})"
+                               .format(_placeholders(chunk)), chunk)
+                cursor.execute("SELECT TASK, START_TIME, STOP_TIME FROM"
+                               " TASKINTERVAL WHERE STOP_TIME IS NOT NULL"
+                               " AND TASK IN ({}) ORDER BY TASK, START_TIME"
+                               .format(_placeholders(chunk)), chunk)
+                stats = None
+                for task_id, start, stop in cursor:
+                    if stats is None or stats.task.task_id != task_id:
+                        if stats is not None:
+                            self._save(save, stats)
+                        stats = self._new(by_id[task_id])
+                    stats.add(start, stop, self.local)
+                if stats is not None:
+                    self._save(save, stats)
+
+    def _load(self, ids):
+        """(TaskStats, True if stored) of the tasks with ids, all tasks if
+        ids is None, most worked on first."""
+        columns = ", ".join("S." + column
+                            for column in Stats.COLUMNS.split(", "))
+        sql = ("SELECT {}, S.TASK IS NOT NULL, {} FROM TASK T LEFT JOIN"
+               " TASKSTATS S ON S.TASK = T.TASK"
+               .format(Task.columns("T"), columns))
+        chunks = [None] if ids is None else _chunks(ids)
+        width = len(Task.COLUMNS)
+        found = []
+        with self.cursor() as cursor:
+            for chunk in chunks:
+                if chunk is None:
+                    cursor.execute(sql)
+                else:
+                    cursor.execute(sql + " WHERE T.TASK IN ({})"
+                                   .format(_placeholders(chunk)), chunk)
+                for row in cursor.fetchall():
+                    task = Task.map_row(row[:width])
+                    if row[width]:
+                        found.append(self._map_row(task, row[width + 1:]))
+                    else:
+                        found.append(self._new(task))
+        found.sort(key=lambda stats: (-stats.task.total_seconds,
+                                      stats.task.task_id))
+        return found
+
+    def all(self, tasks=None):
+        """The TaskStats of tasks that have stopped intervals, most worked
+        on first. Stats that do not add up are rebuilt first.
+
+        Arguments:
+        - `tasks`: the Tasks to get stats for, None for all tasks.
+        """
+        found = self._load(None if tasks is None else
+                           [task.task_id for task in tasks])
+        with self.cursor() as cursor:
+            cursor.execute("SELECT DISTINCT TASK FROM TASKINTERVAL"
+                           " WHERE STOP_TIME IS NULL")
+            in_progress = set(row[0] for row in cursor.fetchall())
+        stale = [stats.task for stats in found
+                 if not stats.matches(stats.task.task_id in in_progress,
+                                      self.timezone)]
+        if stale:
+            self.rebuild(stale)
+            fresh = dict((stats.task.task_id, stats) for stats in
+                         self._load([task.task_id for task in stale]))
+            found = [fresh.get(stats.task.task_id, stats) for stats in found]
+        return [stats for stats in found if stats.sketch.count]
+
+    def for_task(self, task):
+        """The TaskStats of task, rebuilt if they do not add up.
+
+        Arguments:
+        - `task`: the Task to get stats for.
+        """
+        found = self.all([task])
+        return found[0] if found else self._new(task)
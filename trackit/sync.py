@@ -0,0 +1,264 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Incremental synchronization between trackit databases.
+
+Every row in TASK and TASKINTERVAL records the database revision it was
+last changed in. For every peer, a database remembers the revision the
+peer has acknowledged receiving (sent) and the revision of the peer it has
+received changes up to (received), so only rows changed since then are
+exchanged.
+
+Tasks are identified by their path, like project/task, and task intervals
+by their start time, since only one task can be tracked at a time.
+Deletions are not synchronized.
+"""
+
+import json
+import uuid
+from contextlib import closing
+
+from trackit.data import ClosesCursor, revision, _migrate
+from trackit.exceptions import TrackitException
+from trackit.util import dumb_constructor
+
+
+class Peers(ClosesCursor):
+    """Repository for the identity of a database and its sync peers."""
+
+    SCHEMA = """
+    CREATE TABLE SYNCPEER(
+        PEER TEXT,
+        SENT INTEGER NOT NULL,
+        RECEIVED INTEGER NOT NULL,
+        PRIMARY KEY(PEER)
+    );
+"""
+    MIGRATIONS = (
+        "CREATE TABLE IF NOT EXISTS SYNCIDENTITY(IDENTITY TEXT NOT NULL)",
+    )
+
+    @dumb_constructor
+    def __init__(self, conn):
+        """Create a Peers repository. This will attempt to register the schema.
+
+        Arguments:
+        - `conn`: sqlite3 database connection.
+        """
+        with self.cursor() as cursor:
+            _migrate(cursor, Peers.SCHEMA, Peers.MIGRATIONS)
+
+    def identity(self):
+        """The identity of this database, created on first use."""
+        with self.cursor() as cursor:
+            cursor.execute("SELECT IDENTITY FROM SYNCIDENTITY")
+            row = cursor.fetchone()
+            if row:
+                return row[0]
+            identity = uuid.uuid4().hex
+            cursor.execute("INSERT INTO SYNCIDENTITY(IDENTITY) VALUES(?)",
+                           (identity,))
+            return identity
+
+    def marks(self, peer):
+        """The (sent, received) revisions for peer.
+
+        Both are -1 for a peer that has never been synchronized with.
+
+        Arguments:
+        - `peer`: identity of the peer.
+        """
+        with self.cursor() as cursor:
+            cursor.execute("SELECT SENT, RECEIVED FROM SYNCPEER WHERE"
+                           " PEER = ?", (peer,))
+            row = cursor.fetchone()
+            return tuple(row) if row else (-1, -1)
+
+    def update(self, peer, sent, received):
+        """Store the (sent, received) revisions for peer.
+
+        Arguments:
+        - `peer`: identity of the peer.
+        - `sent`: our revision the peer has received all changes up to.
+        - `received`: the peer revision we have received all changes up to.
+        """
+        with self.cursor() as cursor:
+            cursor.execute("INSERT OR REPLACE INTO SYNCPEER(PEER, SENT,"
+                           " RECEIVED) VALUES(?, ?, ?)",
+                           (peer, sent, received))
+
+
+class SyncResult(object):
+    """Outcome of importing changes into a database."""
+
+    @dumb_constructor
+    def __init__(self, intervals=0, conflicts=None):
+        if conflicts is None:
+            self.conflicts = []
+
+
+def _path(data, task_id, paths):
+    """The path of the task with task_id, looked up once per task."""
+    if task_id not in paths:
+        paths[task_id] = data.tasks.path(data.tasks.by_id(task_id))
+    return paths[task_id]
+
+
+def export_changes(data, since):
+    """Changes to data after revision since, as a json serializable dict.
+
+    Tasks are exported by path.
+
+    Arguments:
+    - `data`: the Data to export from.
+    - `since`: only rows changed in later revisions are exported.
+    """
+    paths = {}
+    with closing(data.conn.cursor()) as cursor:
+        cursor.execute("SELECT TASK, DESCRIPTION FROM TASK WHERE CHANGED > ?"
+                       " ORDER BY CHANGED", (since,))
+        tasks = [[_path(data, task_id, paths), description]
+                 for task_id, description in cursor.fetchall()]
+        cursor.execute("SELECT TASK, START_TIME, STOP_TIME FROM TASKINTERVAL"
+                       " WHERE CHANGED > ? ORDER BY START_TIME", (since,))
+        intervals = [[_path(data, task_id, paths), start, stop]
+                     for task_id, start, stop in cursor.fetchall()]
+    return {'revision': revision(data.conn), 'tasks': tasks,
+            'intervals': intervals}
+
+
+def _task(data, path, cache, create=True):
+    if cache.get(path) is None:
+        cache[path] = data.tasks.resolve(path, create=create)
+    return cache[path]
+
+
+def _interval_at(data, start):
+    with closing(data.conn.cursor()) as cursor:
+        cursor.execute("SELECT TASKINTERVAL, TASK, STOP_TIME FROM"
+                       " TASKINTERVAL WHERE START_TIME = ?", (start,))
+        return cursor.fetchone()
+
+
+def _import_interval(data, path, start, stop, cache, paths):
+    """Import a single interval, returning True if anything changed."""
+    existing = _interval_at(data, start)
+    if existing is None:
+        task = _task(data, path, cache, create=False)
+        if task is None:
+            # Tasks are only created for intervals that can be added
+            data.intervals.check_add(start, stop)
+            task = _task(data, path, cache)
+        data.intervals.add(task, start, stop)
+        return True
+    interval_id, task_id, existing_stop = existing
+    existing_path = _path(data, task_id, paths)
+    if existing_path == path and (existing_stop == stop or stop is None):
+        return False
+    if existing_path != path or existing_stop is not None:
+        raise TrackitException("Conflicting intervals starting at {}: '{}'"
+                               " until {} and '{}' until {}"
+                               .format(start, existing_path, existing_stop,
+                                       path, stop))
+    with closing(data.conn.cursor()) as cursor:
+        cursor.execute("SELECT 1 FROM TASKINTERVAL WHERE START_TIME > ?"
+                       " AND START_TIME < ? LIMIT 1", (start, stop))
+        if cursor.fetchone():
+            raise TrackitException("Stopping interval starting at {} at {}"
+                                   " overlaps later intervals"
+                                   .format(start, stop))
+        cursor.execute("UPDATE TASKINTERVAL SET STOP_TIME = ? WHERE"
+                       " TASKINTERVAL = ?", (stop, interval_id))
+    return True
+
+
+def import_changes(data, changes):
+    """Import changes produced by export_changes() into data.
+
+    Intervals that conflict with intervals in data are not imported, but
+    reported in the conflicts of the returned SyncResult. Nothing is
+    committed.
+
+    Arguments:
+    - `data`: the Data to import into.
+    - `changes`: dict from export_changes().
+    """
+    result = SyncResult()
+    cache, paths = {}, {}
+    for path, description in changes['tasks']:
+        task = _task(data, path, cache)
+        if description is not None and task.description != description:
+            task.description = description
+            data.tasks.update(task)
+    for path, start, stop in changes['intervals']:
+        try:
+            if _import_interval(data, path, start, stop, cache, paths):
+                result.intervals += 1
+        except TrackitException, e:
+            result.conflicts.append(unicode(e))
+    return result
+
+
+def sync(local, remote):
+    """Exchange changes between two Data instances, in both directions.
+
+    Returns the SyncResult of importing into local and into remote.
+    Nothing is committed.
+
+    Arguments:
+    - `local`: Data to synchronize.
+    - `remote`: Data to synchronize with.
+    """
+    local_peers, remote_peers = Peers(local.conn), Peers(remote.conn)
+    local_id, remote_id = local_peers.identity(), remote_peers.identity()
+    outgoing = export_changes(local, local_peers.marks(remote_id)[0])
+    incoming = export_changes(remote, remote_peers.marks(local_id)[0])
+    into_remote = import_changes(remote, outgoing)
+    into_local = import_changes(local, incoming)
+    local_revision = revision(local.conn)
+    remote_revision = revision(remote.conn)
+    local_peers.update(remote_id, local_revision, remote_revision)
+    remote_peers.update(local_id, remote_revision, local_revision)
+    return into_local, into_remote
+
+
+def sync_file(data, path):
+    """Exchange changes with another database through an exchange file.
+
+    The file holds the changes of the database that wrote it last, along
+    with the revision it has received from the other database up to. When
+    the file was written by another database, its changes are imported.
+    The file is then rewritten with every change the other database has
+    not acknowledged receiving. Nothing is committed.
+
+    Returns the SyncResult of importing from the file.
+
+    Arguments:
+    - `data`: Data to synchronize.
+    - `path`: Path of the exchange file.
+    """
+    peers = Peers(data.conn)
+    identity = peers.identity()
+    result = SyncResult()
+    peer = None
+    if path.exists():
+        with path.open() as inf:
+            exchange = json.load(inf)
+        if exchange['identity'] != identity:
+            peer = exchange['identity']
+            result = import_changes(data, exchange)
+            sent, received = peers.marks(peer)
+            peers.update(peer, max(sent, exchange['acknowledged']),
+                         exchange['revision'])
+        else:
+            peer = exchange['peer']
+    sent, received = peers.marks(peer) if peer else (-1, -1)
+    exchange = export_changes(data, sent)
+    exchange.update(identity=identity, peer=peer, acknowledged=received)
+    with path.open('w') as outf:
+        json.dump(exchange, outf)
+    return result
@@ -0,0 +1,375 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Tags on task intervals, with a bitmap index per tag.
+
+INTERVALTAG holds the tags of every task interval. TAGBITMAP holds, for
+every tag, bitmaps of the ids of the task intervals it is on, in chunks
+of CHUNK_BITS ids stored as blobs. Triggers mark the chunks that changed
+as dirty and those are rebuilt from INTERVALTAG when they are read, so
+the bitmaps are always in sync without being rewritten on every change.
+
+Tag filters like "billable and not meeting" are evaluated with bitwise
+operations on whole chunks, so only the matching task intervals are
+read when reporting on them.
+"""
+
+import binascii
+import re
+import time
+from contextlib import closing
+
+from trackit.data import ClosesCursor, Task, _migrate, _chunks, _placeholders
+from trackit.exceptions import TrackitException
+from trackit.report import BEGINNING
+from trackit.util import dumb_constructor
+
+# Task interval ids per bitmap chunk
+CHUNK_BITS = 4096
+
+FULL = (1 << CHUNK_BITS) - 1
+
+# Words of tag filters, anything else is a tag
+OPERATORS = {'and': 'and', '&': 'and', 'or': 'or', '|': 'or',
+             'not': 'not', '!': 'not', '(': '(', ')': ')'}
+
+TOKENS = re.compile(r"\s*([()&|!]|[^\s()&|!]+)")
+
+
+class InvalidTag(TrackitException):
+    """The name can not be used as a tag."""
+    pass
+
+
+class InvalidTagFilter(TrackitException):
+    """The tag filter can not be parsed."""
+    pass
+
+
+def check_tag(name):
+    """Raise InvalidTag unless name can be used as a tag.
+
+    Arguments:
+    - `name`: the name of the tag.
+    """
+    if not name or TOKENS.match(name).group(1) != name or \
+            name.lower() in OPERATORS:
+        raise InvalidTag("Tags are single words that are not and, or or not:"
+                         " {!r}".format(name))
+
+
+def _to_blob(bits):
+    digits = '{:x}'.format(bits)
+    return buffer(binascii.unhexlify('0' * (len(digits) % 2) + digits))
+
+
+def _from_blob(blob):
+    return int(binascii.hexlify(str(blob)), 16) if len(blob) else 0
+
+
+class Bitmap(object):
+    """Set of task interval ids as chunks of bits, by chunk number."""
+
+    def __init__(self, chunks=None):
+        self.chunks = {} if chunks is None else chunks
+
+    def __and__(self, other):
+        chunks = {}
+        for chunk, bits in self.chunks.items():
+            both = bits & other.chunks.get(chunk, 0)
+            if both:
+                chunks[chunk] = both
+        return Bitmap(chunks)
+
+    def __or__(self, other):
+        chunks = dict(self.chunks)
+        for chunk, bits in other.chunks.items():
+            chunks[chunk] = chunks.get(chunk, 0) | bits
+        return Bitmap(chunks)
+
+    def invert(self, last):
+        """The ids from 1 to last that are not in this bitmap."""
+        chunks = {}
+        for chunk in range(last // CHUNK_BITS + 1):
+            bits = ~self.chunks.get(chunk, 0) & FULL
+            if chunk == 0:
+                bits &= ~1
+            if chunk == last // CHUNK_BITS:
+                bits &= (1 << (last % CHUNK_BITS + 1)) - 1
+            if bits:
+                chunks[chunk] = bits
+        return Bitmap(chunks)
+
+    def __iter__(self):
+        """The ids in the bitmap, in ascending order."""
+        for chunk in sorted(self.chunks):
+            bits, offset = self.chunks[chunk], chunk * CHUNK_BITS
+            while bits:
+                lowest = bits & -bits
+                yield offset + lowest.bit_length() - 1
+                bits ^= lowest
+
+    def __len__(self):
+        return sum(bin(bits).count('1') for bits in self.chunks.values())
+
+
+def parse(expression):
+    """Parse a tag filter into a tree of ('tag', name), ('not', tree),
+    ('and', tree, tree) and ('or', tree, tree).
+
+    not binds tighter than and, which binds tighter than or, and
+    parentheses group. Operators may also be written &, | and !.
+
+    Arguments:
+    - `expression`: the tag filter, like "billable and not meeting".
+    """
+    tokens = TOKENS.findall(expression)
+    position = [0]
+
+    def peek():
+        if position[0] < len(tokens):
+            return OPERATORS.get(tokens[position[0]].lower(), 'tag')
+        return None
+
+    def take():
+        position[0] += 1
+        return tokens[position[0] - 1]
+
+    def either():
+        tree = both()
+        while peek() == 'or':
+            take()
+            tree = ('or', tree, both())
+        return tree
+
+    def both():
+        tree = negated()
+        while peek() == 'and':
+            take()
+            tree = ('and', tree, negated())
+        return tree
+
+    def negated():
+        kind = peek()
+        if kind == 'not':
+            take()
+            return ('not', negated())
+        if kind == '(':
+            take()
+            tree = either()
+            if peek() != ')':
+                raise InvalidTagFilter("Missing ) in {!r}".format(expression))
+            take()
+            return tree
+        if kind == 'tag':
+            return ('tag', take())
+        raise InvalidTagFilter("Expected a tag in {!r}".format(expression))
+
+    tree = either()
+    if peek() is not None:
+        raise InvalidTagFilter("Unexpected {!r} in {!r}"
+                               .format(tokens[position[0]], expression))
+    return tree
+
+
+class Tags(ClosesCursor):
+    """Repository for the tags of task intervals."""
+
+    SCHEMA = """
+    CREATE TABLE INTERVALTAG(
+        TAG TEXT NOT NULL,
+        TASKINTERVAL INTEGER NOT NULL,
+        PRIMARY KEY(TAG, TASKINTERVAL)
+    );
+"""
+    MIGRATIONS = (
+        "CREATE INDEX IF NOT EXISTS INTERVALTAG_TASKINTERVAL"
+        " ON INTERVALTAG(TASKINTERVAL)",
+        """
+    CREATE TABLE IF NOT EXISTS TAGBITMAP(
+        TAG TEXT NOT NULL,
+        CHUNK INTEGER NOT NULL,
+        BITS BLOB NOT NULL,
+        DIRTY INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(TAG, CHUNK)
+    )
+""",
+        """
+    CREATE TRIGGER IF NOT EXISTS INTERVALTAG_INSERTED
+    AFTER INSERT ON INTERVALTAG BEGIN
+        UPDATE REVISION SET REVISION = REVISION + 1;
+        INSERT OR IGNORE INTO TAGBITMAP(TAG, CHUNK, BITS)
+        VALUES(new.TAG, new.TASKINTERVAL / {0}, X'');
+        UPDATE TAGBITMAP SET DIRTY = 1
+        WHERE TAG = new.TAG AND CHUNK = new.TASKINTERVAL / {0};
+    END
+""".format(CHUNK_BITS),
+        """
+    CREATE TRIGGER IF NOT EXISTS INTERVALTAG_DELETED
+    AFTER DELETE ON INTERVALTAG BEGIN
+        UPDATE REVISION SET REVISION = REVISION + 1;
+        UPDATE TAGBITMAP SET DIRTY = 1
+        WHERE TAG = old.TAG AND CHUNK = old.TASKINTERVAL / {0};
+    END
+""".format(CHUNK_BITS),
+        """
+    CREATE TRIGGER IF NOT EXISTS INTERVALTAG_TASKINTERVAL_DELETED
+    AFTER DELETE ON TASKINTERVAL BEGIN
+        DELETE FROM INTERVALTAG WHERE TASKINTERVAL = old.TASKINTERVAL;
+    END
+""",
+    )
+
+    @dumb_constructor
+    def __init__(self, conn):
+        """Create a Tags repository. This will attempt to register the
+        schema.
+
+        Arguments:
+        - `conn`: sqlite3 database connection.
+        """
+        with self.cursor() as cursor:
+            _migrate(cursor, Tags.SCHEMA, Tags.MIGRATIONS)
+
+    def tag(self, interval, names):
+        """Add the tags in names to a task interval.
+
+        Arguments:
+        - `interval`: the TaskInterval to tag.
+        - `names`: the names of the tags.
+        """
+        for name in names:
+            check_tag(name)
+        with self.cursor() as cursor:
+            cursor.executemany("INSERT OR IGNORE INTO INTERVALTAG(TAG,"
+                               " TASKINTERVAL) VALUES(?, ?)",
+                               [(name, interval.task_interval)
+                                for name in names])
+
+    def untag(self, interval, names):
+        """Remove the tags in names from a task interval.
+
+        Arguments:
+        - `interval`: the TaskInterval to untag.
+        - `names`: the names of the tags.
+        """
+        with self.cursor() as cursor:
+            cursor.executemany("DELETE FROM INTERVALTAG WHERE TAG = ? AND"
+                               " TASKINTERVAL = ?",
+                               [(name, interval.task_interval)
+                                for name in names])
+
+    def of(self, interval):
+        """The sorted tags of a task interval.
+
+        Arguments:
+        - `interval`: the TaskInterval to find the tags of.
+        """
+        with self.cursor() as cursor:
+            cursor.execute("SELECT TAG FROM INTERVALTAG WHERE TASKINTERVAL"
+                           " = ? ORDER BY TAG", (interval.task_interval,))
+            return [row[0] for row in cursor.fetchall()]
+
+    def names(self):
+        """The sorted names of all tags in use."""
+        with self.cursor() as cursor:
+            cursor.execute("SELECT DISTINCT TAG FROM INTERVALTAG ORDER BY TAG")
+            return [row[0] for row in cursor.fetchall()]
+
+    def bitmap(self, name):
+        """The Bitmap of the task intervals tagged name, rebuilding the
+        chunks that changed since they were last read.
+
+        Arguments:
+        - `name`: the name of the tag.
+        """
+        with self.cursor() as cursor:
+            cursor.execute("SELECT CHUNK FROM TAGBITMAP WHERE TAG = ? AND"
+                           " DIRTY = 1", (name,))
+            for chunk, in cursor.fetchall():
+                cursor.execute("SELECT TASKINTERVAL FROM INTERVALTAG WHERE"
+                               " TAG = ? AND TASKINTERVAL >= ? AND"
+                               " TASKINTERVAL < ?", (name, chunk * CHUNK_BITS,
+                                                     (chunk + 1) * CHUNK_BITS))
+                bits = 0
+                for interval, in cursor.fetchall():
+                    bits |= 1 << (interval % CHUNK_BITS)
+                if bits:
+                    cursor.execute("UPDATE TAGBITMAP SET BITS = ?, DIRTY = 0"
+                                   " WHERE TAG = ? AND CHUNK = ?",
+                                   (_to_blob(bits), name, chunk))
+                else:
+                    cursor.execute("DELETE FROM TAGBITMAP WHERE TAG = ? AND"
+                                   " CHUNK = ?", (name, chunk))
+            cursor.execute("SELECT CHUNK, BITS FROM TAGBITMAP WHERE TAG = ?",
+                           (name,))
+            return Bitmap(dict((chunk, _from_blob(bits))
+                               for chunk, bits in cursor.fetchall()))
+
+    def select(self, expression):
+        """The Bitmap of the task intervals matching a tag filter.
+
+        Arguments:
+        - `expression`: the tag filter, see parse().
+        """
+        tree = parse(expression)
+        bitmaps = {}
+
+        def evaluate(tree):
+            if tree[0] == 'tag':
+                if tree[1] not in bitmaps:
+                    bitmaps[tree[1]] = self.bitmap(tree[1])
+                return bitmaps[tree[1]]
+            elif tree[0] == 'not':
+                with self.cursor() as cursor:
+                    cursor.execute("SELECT COALESCE(MAX(TASKINTERVAL), 0)"
+                                   " FROM TASKINTERVAL")
+                    last = cursor.fetchone()[0]
+                return evaluate(tree[1]).invert(last)
+            elif tree[0] == 'and':
+                return evaluate(tree[1]) & evaluate(tree[2])
+            return evaluate(tree[1]) | evaluate(tree[2])
+        return evaluate(tree)
+
+
+def totals(data, expression, since=None, until=None):
+    """Seconds spent on each task between since and until, in the task
+    intervals matching a tag filter. See report.totals().
+
+    The filter is evaluated on the bitmaps first, then the matching task
+    intervals are read by id a few hundred at a time.
+
+    Arguments:
+    - `data`: the Data to report on.
+    - `expression`: the tag filter, see parse().
+    - `since`: unix time the report starts at, None for the beginning.
+    - `until`: unix time the report ends at, None for now.
+    """
+    now = time.time()
+    since = BEGINNING if since is None else since
+    until = now if until is None else until
+    seconds = {}
+    with closing(data.conn.cursor()) as cursor:
+        for chunk in _chunks(Tags(data.conn).select(expression)):
+            cursor.execute("SELECT TASK, SUM(MIN(COALESCE(STOP_TIME, ?), ?)"
+                           " - MAX(START_TIME, ?)) FROM TASKINTERVAL"
+                           " WHERE TASKINTERVAL IN ({}) AND START_TIME < ?"
+                           " AND COALESCE(STOP_TIME, ?) > ? GROUP BY TASK"
+                           .format(_placeholders(chunk)),
+                           [now, until, since] + chunk + [until, now, since])
+            for task, value in cursor.fetchall():
+                seconds[task] = seconds.get(task, 0) + value
+        tasks = {}
+        for chunk in _chunks(sorted(seconds)):
+            cursor.execute("SELECT {} FROM TASK WHERE TASK IN ({})"
+                           .format(Task.columns(), _placeholders(chunk)),
+                           chunk)
+            for row in cursor.fetchall():
+                tasks[row[0]] = Task.map_row(row)
+    return sorted(((tasks[task], value) for task, value in seconds.items()
+                   if task in tasks),
+                  key=lambda pair: (-pair[1], pair[0].task_id))
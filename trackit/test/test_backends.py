@@ -0,0 +1,182 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import sqlite3
+
+import pytest
+
+from trackit import benchmark
+from trackit.data import (Data, TaskCycle, TooManyTasksInProgress,
+                          NoTaskInProgress, InconsistentTaskIntervals,
+                          InvalidPageLimit)
+from trackit.memory import MemoryData
+
+
+class Conformance(object):
+    """Tests every storage backend has to pass, subclasses create the Data
+    of their backend in data()."""
+
+    def setup_method(self, meth):
+        self.data = self.make_data()
+        self.tasks, self.intervals = self.data.tasks, self.data.intervals
+
+    def spans(self, intervals):
+        return [(interval.task.name, interval.start_time, interval.stop_time)
+                for interval in intervals]
+
+    def test_tasks_should_be_found_by_id_and_name(self):
+        created = self.tasks.create("Writing", "docs")
+        self.tasks.create("Reading")
+        assert self.tasks.by_id(created.task_id).description == "docs"
+        assert [task.name for task in self.tasks.by_name("rit")] == \
+            ["Writing"]
+        assert [task.name for task in self.tasks.named("Reading")] == \
+            ["Reading"]
+        assert self.tasks.names() == ["Reading", "Writing"]
+        with pytest.raises(KeyError):
+            self.tasks.by_id(created.task_id + 100)
+
+    def test_tasks_should_be_updated_and_renamed(self):
+        task = self.tasks.create("old")
+        task.description = "changed"
+        self.tasks.update(task)
+        assert self.tasks.by_id(task.task_id).description == "changed"
+        self.tasks.create("older")
+        assert self.tasks.rename("old", "new", pattern=True) == 2
+        assert self.tasks.names() == ["new", "newer"]
+
+    def test_intervals_should_keep_task_totals(self):
+        task = self.tasks.create("counted")
+        self.intervals.start(task, 100)
+        self.intervals.stop(task, 150)
+        self.intervals.add(task, 200, 230)
+        counted = self.tasks.by_id(task.task_id)
+        assert (counted.total_seconds, counted.interval_count,
+                counted.last_worked) == (80, 2, 230)
+        assert [task.name for task in self.tasks.sorted('total')][0] == \
+            "counted"
+
+    def test_only_one_interval_should_be_in_progress(self):
+        task = self.tasks.create("busy")
+        assert self.intervals.in_progress() is None
+        self.intervals.start(task, 100)
+        assert self.intervals.in_progress().start_time == 100
+        with pytest.raises(TooManyTasksInProgress):
+            self.intervals.start(task, 200)
+        self.intervals.stop(task, 200)
+        assert self.intervals.in_progress() is None
+
+    def test_stop_should_refuse_bad_stops(self):
+        task = self.tasks.create("stopped")
+        with pytest.raises(NoTaskInProgress):
+            self.intervals.stop(task, 100)
+        self.intervals.start(task, 100)
+        with pytest.raises(InconsistentTaskIntervals):
+            self.intervals.stop(task, 50)
+
+    def test_overlapping_intervals_should_be_refused(self):
+        task = self.tasks.create("overlapped")
+        self.intervals.add(task, 100, 200)
+        self.intervals.add(task, 300, 400)
+        with pytest.raises(InconsistentTaskIntervals):
+            self.intervals.start(task, 150)
+        with pytest.raises(InconsistentTaskIntervals):
+            self.intervals.add(task, 250, 350)
+        with pytest.raises(InconsistentTaskIntervals):
+            self.intervals.add(task, 50, 120)
+        self.intervals.add(task, 200, 300)
+        assert self.intervals.started_at(200)
+        assert not self.intervals.started_at(250)
+
+    def test_ranges_should_include_intervals_reaching_in(self):
+        first, second = self.tasks.create("first"), self.tasks.create("second")
+        self.intervals.add(first, 100, 200)
+        self.intervals.add(second, 200, 300)
+        self.intervals.start(first, 400)
+        assert self.spans(self.intervals.between(150, 250)) == \
+            [("first", 100, 200), ("second", 200, 300)]
+        assert self.spans(self.intervals.between(300, 350)) == []
+        assert self.spans(self.intervals.between(500)) == \
+            [("first", 400, None)]
+        assert len(self.intervals.between()) == 3
+        assert [interval.task_interval for interval in
+                self.intervals.for_task(first)] == [1, 3]
+
+    def test_pages_should_cover_every_interval_once(self):
+        task = self.tasks.create("paged")
+        for start in range(0, 1000, 100):
+            self.intervals.add(task, start, start + 50)
+        seen, token = [], None
+        while True:
+            page, token = self.intervals.page(token, limit=3, since=200)
+            seen.extend(interval.start_time for interval in page)
+            if token is None:
+                break
+        assert seen == range(200, 1000, 100)
+        tasks, token = self.tasks.page(limit=1)
+        assert [task.name for task in tasks] == ["paged"] and token is None
+
+    def test_pages_should_hold_at_least_one_item(self):
+        self.intervals.add(self.tasks.create("paged"), 0, 10)
+        for limit in (0, -5):
+            with pytest.raises(InvalidPageLimit):
+                self.tasks.page(limit=limit)
+            with pytest.raises(InvalidPageLimit):
+                self.intervals.page(limit=limit)
+
+    def test_hierarchies_should_resolve_and_refuse_cycles(self):
+        task = self.tasks.resolve("project/module/task", create=True)
+        project = self.tasks.resolve("project")
+        assert self.tasks.path(task) == "project/module/task"
+        assert [other.name for other in self.tasks.descendants(project)] == \
+            ["project", "module", "task"]
+        with pytest.raises(TaskCycle):
+            self.tasks.move(project, task)
+        self.intervals.add(task, 0, 10)
+        assert self.tasks.subtree_totals(project) == (10, 1)
+        assert self.tasks.resolve("project/other") is None
+
+    def test_merge_should_move_intervals_and_children(self):
+        target, source = self.tasks.create("target"), self.tasks.create("source")
+        child = self.tasks.create("child", parent=source)
+        self.intervals.add(source, 0, 10)
+        assert self.tasks.merge(target, [source]) == 1
+        assert self.tasks.by_id(target.task_id).total_seconds == 10
+        assert self.tasks.path(self.tasks.by_id(child.task_id)) == \
+            "target/child"
+        assert [task.name for task in self.tasks.all()] == ["target", "child"]
+
+
+    def test_merge_into_a_descendant_should_reparent_it(self):
+        project = self.tasks.create("project")
+        module = self.tasks.create("module", parent=project)
+        task = self.tasks.create("task", parent=module)
+        self.intervals.add(project, 0, 10)
+        assert self.tasks.merge(task, [project]) == 1
+        assert self.tasks.path(self.tasks.by_id(module.task_id)) == "module"
+        assert self.tasks.path(self.tasks.by_id(task.task_id)) == \
+            "module/task"
+        self.tasks.merge(task, [self.tasks.by_id(module.task_id)])
+        assert self.tasks.path(self.tasks.by_id(task.task_id)) == "task"
+
+class TestSqliteBackend(Conformance):
+
+    def make_data(self):
+        return Data(sqlite3.connect(":memory:"))
+
+
+class TestMemoryBackend(Conformance):
+
+    def make_data(self):
+        return MemoryData()
+
+
+def test_benchmark_should_time_every_backend():
+    timings = benchmark.run(50)
+    assert [(backend, operation) for backend, operation, _ in timings] == \
+        [(backend, operation) for backend, _ in benchmark.BACKENDS
+         for operation in ('start/stop', 'lookups')]
@@ -0,0 +1,79 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import sqlite3
+import time
+
+from trackit import report
+from trackit.cache import ReportCache
+from trackit.data import Data
+from trackit.util import Path
+
+target = Path('trackit_test_cache')
+
+class TestReportCache(object):
+
+    def setup(self):
+        self.data = Data(sqlite3.connect(":memory:"))
+        self.task = self.data.tasks.create("cached")
+        self.data.intervals.start(self.task, 100)
+        self.data.intervals.stop(self.task, 200)
+        self.calls = []
+
+    def teardown(self):
+        if target.exists():
+            target.rmdir()
+
+    def counted(self, data, since=None, until=None):
+        self.calls.append((since, until))
+        return report.totals(data, since, until)
+
+    def test_repeated_reports_should_be_cached_until_data_changes(self):
+        cache = ReportCache()
+        first = cache.get(self.data, self.counted, since=0, until=1000)
+        assert cache.get(self.data, self.counted, until=1000, since=0) is first
+        assert len(self.calls) == 1 and cache.hits == 1
+        self.data.intervals.start(self.task, 300)
+        self.data.intervals.stop(self.task, 400)
+        assert cache.get(self.data, self.counted, since=0, until=1000)[0][1] == 200
+        assert len(self.calls) == 2
+
+    def test_reports_counting_up_to_now_should_not_be_cached(self):
+        cache = ReportCache()
+        cache.get(self.data, self.counted)
+        cache.get(self.data, self.counted)
+        assert len(self.calls) == 1
+        self.data.intervals.start(self.task, 300)
+        cache.get(self.data, self.counted)
+        cache.get(self.data, self.counted)
+        assert len(self.calls) == 3
+
+    def test_reports_ending_in_the_future_should_not_be_cached(self):
+        cache = ReportCache()
+        future = time.time() + 3600
+        cache.get(self.data, self.counted, until=future)
+        cache.get(self.data, self.counted, until=future)
+        assert len(self.calls) == 1
+        self.data.intervals.start(self.task, 300)
+        cache.get(self.data, self.counted, until=future)
+        cache.get(self.data, self.counted, until=future)
+        assert len(self.calls) == 3
+
+    def test_least_recently_used_results_should_be_evicted(self):
+        cache = ReportCache(size=2)
+        for until in (1000, 2000, 1000, 3000, 1000, 2000):
+            cache.get(self.data, self.counted, until=until)
+        assert [until for _, until in self.calls] == [1000, 2000, 3000, 2000]
+
+    def test_cache_should_persist(self):
+        target.makedir()
+        path = target.join('reportcache')
+        cache = ReportCache(path=path)
+        cache.get(self.data, self.counted, until=1000)
+        cache.save()
+        assert ReportCache(path=path).get(self.data, self.counted, until=1000)[0][1] == 100
+        assert len(self.calls) == 1
@@ -0,0 +1,77 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import datetime
+import os
+import sqlite3
+import time
+
+from trackit.calendars import Calendar, UnknownTimezone, Zone, days, lookup
+
+def test_days_should_know_about_dst():
+    rows = list(days(datetime.date(2013, 3, 30), datetime.date(2013, 4, 1),
+                     lookup('Europe/Oslo')))
+    assert [row[0] for row in rows] == ['2013-03-30', '2013-03-31', '2013-04-01']
+    assert [row[2] - row[1] for row in rows] == [86400, 82800, 86400]
+    assert rows[0][1] == 1364598000
+    assert rows[0][3:] == ('2013-W13', '2013-03')
+
+def test_zone_should_not_touch_the_process_timezone():
+    before = os.environ.get('TZ'), time.timezone
+    utc = list(days(datetime.date(2013, 1, 1), datetime.date(2013, 1, 1),
+                    lookup('UTC')))
+    lookup('Asia/Tokyo').midnight(datetime.date(2013, 1, 1))
+    assert utc[0][1] == 1356998400
+    assert (os.environ.get('TZ'), time.timezone) == before
+
+def test_zone_should_follow_rules_after_the_last_transition():
+    oslo = lookup('Europe/Oslo')
+    # Summer and winter time in 2100, beyond the transitions in the file
+    assert oslo.utcoffset(4118083200) == 7200
+    assert oslo.utcoffset(4102444800) == 3600
+    assert oslo.localtime(4102444800) == datetime.datetime(2100, 1, 1, 1)
+
+def test_zone_should_start_days_skipping_midnight_at_the_change():
+    # Clocks went from 00:00 to 01:00 in Sao Paulo on 2013-10-20
+    sao_paulo = lookup('America/Sao_Paulo')
+    start = sao_paulo.midnight(datetime.date(2013, 10, 20))
+    assert sao_paulo.localtime(start) == datetime.datetime(2013, 10, 20, 1)
+    assert sao_paulo.date(start - 1) == datetime.date(2013, 10, 19)
+
+def test_unknown_zone_should_be_refused():
+    for name in ('Nowhere/Special', '../../etc/passwd'):
+        try:
+            Zone(name)
+        except UnknownTimezone:
+            continue
+        assert False, name
+
+def test_calendar_should_extend_itself_to_cover_requested_days():
+    calendar = Calendar(sqlite3.connect(":memory:"), 'UTC')
+    assert calendar.day('2013-01-02') == (1357084800, 1357171200)
+    assert not calendar.covers(1356998400, 1357430400)
+    calendar.cover(1356998400, 1357430400)
+    count = calendar.conn.execute("SELECT COUNT(*) FROM CALENDAR").fetchone()[0]
+    assert count == 6
+    assert calendar.covers(1356998400, 1357430400)
+    assert calendar.day_of(1357084800 + 3600) == '2013-01-02'
+
+def test_calendar_should_be_rebuilt_for_another_timezone():
+    conn = sqlite3.connect(":memory:")
+    Calendar(conn, 'UTC').cover(1356998400, 1356998400)
+    oslo = Calendar(conn, 'Europe/Oslo')
+    assert not oslo.covers(1356998400, 1356998400)
+    oslo.cover(1356998400, 1356998400)
+    assert oslo.rows(1356998400, 1356998400)[0][1] == 1356994800
+
+def test_calendar_should_not_write_until_covering():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("PRAGMA query_only = 1")
+    calendar = Calendar(conn, 'Europe/Oslo')
+    assert calendar.day('2013-01-01')[0] == 1356994800
+    assert [row[0] for row in calendar.rows(1356994800, 1357084800)] == [
+        '2013-01-01', '2013-01-02']
@@ -0,0 +1,67 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import sqlite3
+import struct
+
+import pytest
+
+from trackit import columnar
+from trackit.data import Data
+from trackit.util import Path
+
+target = Path('trackit_test_columnar')
+
+def setup_function(func):
+    target.makedir()
+
+def teardown_function(func):
+    if target.exists():
+        target.rmdir()
+
+def _data():
+    data = Data(sqlite3.connect(":memory:"))
+    first, second = data.tasks.create(u"første"), data.tasks.create("second")
+    for task, start, stop in [(first, 100, 200), (second, 200, 250),
+                              (first, 300, 400)]:
+        data.intervals.start(task, start)
+        data.intervals.stop(task, stop)
+    data.intervals.start(second, 500)
+    return data
+
+def test_export_should_round_trip():
+    path = target.join('export')
+    assert columnar.write(_data(), path) == 4
+    with columnar.Export(path) as export:
+        assert len(export) == 4
+        assert list(export.starts) == [100, 200, 300, 500]
+        assert export[0] == (u"første", 100, 200)
+        assert export[-1] == ("second", 500, None)
+        assert list(export.task_ids.array()) == [1, 2, 1, 2]
+        stops = export.stops.view()
+        assert len(stops) == 32
+        assert stops[:8] == struct.pack('<d', 200)
+
+def test_between_should_search_start_column():
+    path = target.join('export')
+    columnar.write(_data(), path)
+    with columnar.Export(path) as export:
+        assert list(export.between(150, 300)) == [1]
+        assert list(export.between(0, 1000)) == [0, 1, 2, 3]
+
+def test_should_refuse_other_files():
+    path = target.join('export')
+    with path.open('w') as outf:
+        outf.write("not an export at all, but long enough")
+    with pytest.raises(columnar.InvalidExport):
+        columnar.Export(path)
+
+def test_should_refuse_empty_files():
+    path = target.join('export')
+    path.open('w').close()
+    with pytest.raises(columnar.InvalidExport):
+        columnar.Export(path)
@@ -5,11 +5,12 @@
 # of the modified BSD license. The full license is available in
 # LICENSE, distributed as part of this software.
 
+import os
 import pytest
 import sqlite3
 import time
 
-from ..data import Task, Tasks, TaskInterval, TaskIntervals, ClosesCursor, TooManyTasksInProgress, InconsistentTaskIntervals
+from ..data import Task, Tasks, TaskInterval, TaskIntervals, ClosesCursor, TooManyTasksInProgress, InconsistentTaskIntervals, InvalidPageToken, TaskCycle, Data, snapshot, revision
 
 def test_auto_closing_cursor_closes_cursor():
     class ClosableMock(object):
@@ -75,6 +76,69 @@ class TestTasks(object):
         in_db = self.tasks.by_id(1)
         assert in_db.name == "Not test" and in_db.description == "descr"
 
+    def test_paging_through_tasks_should_visit_every_task_once(self):
+        for i in range(9):
+            self.tasks.create("Task {}".format(i))
+        page, token = self.tasks.page(limit=5)
+        assert [task.task_id for task in page] == [1, 2, 3, 4, 5]
+        page, token = self.tasks.page(token, limit=5)
+        assert [task.task_id for task in page] == [6, 7, 8, 9, 10]
+        page, token = self.tasks.page(token, limit=5)
+        assert [task.task_id for task in page] == [11] and token is None
+
+    def test_paging_should_reject_tokens_it_did_not_produce(self):
+        with pytest.raises(InvalidPageToken):
+            self.tasks.page("not a token")
+
+    def test_named_should_only_find_exact_matches(self):
+        self.tasks.create("Test")
+        self.tasks.create("Testing")
+        assert [task.task_id for task in self.tasks.named("Test")] == [1, 3]
+
+    def test_rename_should_only_rename_exact_matches(self):
+        self.tasks.create("Testing")
+        assert self.tasks.rename("Test", "Check") == 1
+        assert [task.name for task in self.tasks.all()] == ["Check", "Wat", "Testing"]
+
+    def test_rename_pattern_should_replace_all_occurrences(self):
+        self.tasks.create("Testing Test")
+        assert self.tasks.rename("Test", "Check", pattern=True) == 2
+        assert [task.name for task in self.tasks.all()] == ["Check", "Wat", "Checking Check"]
+
+    def test_resolving_paths_should_create_missing_tasks(self):
+        task = self.tasks.resolve("Test/sub/leaf", create=True)
+        assert self.tasks.path(task) == "Test/sub/leaf"
+        assert self.tasks.resolve("Test/sub/leaf").task_id == task.task_id
+        assert self.tasks.resolve("Test/missing") is None
+        assert [t.name for t in self.tasks.descendants(self.tasks.by_id(1))] == ["Test", "sub", "leaf"]
+
+    def test_moving_tasks_should_move_subtrees(self):
+        leaf = self.tasks.resolve("Test/sub/leaf", create=True)
+        sub = self.tasks.by_id(leaf.parent)
+        self.tasks.move(sub, self.tasks.by_id(2))
+        assert self.tasks.path(leaf) == "Wat/sub/leaf"
+        assert [t.name for t in self.tasks.descendants(self.tasks.by_id(1))] == ["Test"]
+        with pytest.raises(TaskCycle):
+            self.tasks.move(self.tasks.by_id(2), leaf)
+
+    def test_subtree_totals_should_sum_descendants(self):
+        intervals = TaskIntervals(self.conn, self.tasks)
+        for when, path in [(10, "Test/a"), (30, "Test/a/b"), (50, "Test")]:
+            task = self.tasks.resolve(path, create=True)
+            intervals.start(task, when)
+            intervals.stop(task, when + 10)
+        assert self.tasks.subtree_totals(self.tasks.by_id(1)) == (30, 3)
+        assert self.tasks.subtree_totals(self.tasks.resolve("Test/a")) == (20, 2)
+
+    def test_deleting_and_merging_tasks_should_keep_children(self):
+        TaskIntervals(self.conn, self.tasks)
+        leaf = self.tasks.resolve("Test/sub/leaf", create=True)
+        self.tasks.merge(self.tasks.by_id(2), [self.tasks.by_id(1)])
+        assert self.tasks.path(leaf) == "Wat/sub/leaf"
+        sub = self.tasks.by_id(leaf.parent)
+        self.tasks.merge(leaf, [sub])
+        assert self.tasks.path(leaf) == "Wat/leaf"
+
 class TestTaskIntervals(object):
 
     def setup(self):
@@ -149,6 +213,97 @@ class TestTaskIntervals(object):
         with pytest.raises(InconsistentTaskIntervals):
             self.task_intervals.start(task, half_an_hour_ago)
 
+    def test_paging_through_intervals_in_start_time_order(self):
+        for start in (300, 100, 200):
+            self.tt.conn.execute("INSERT INTO TASKINTERVAL(TASK, START_TIME, STOP_TIME)"
+                                 " VALUES(?, ?, ?)", (2, start, start + 50))
+        page, token = self.task_intervals.page(limit=2)
+        assert [interval.start_time for interval in page] == [100, 200]
+        assert page[0].task is page[1].task
+        page, token = self.task_intervals.page(token, limit=2)
+        assert [interval.start_time for interval in page] == [300, page[1].start_time]
+        assert token is None
+
+    def test_between_should_include_interval_reaching_into_window(self):
+        first, second = self.tasks.by_id(2), self.tasks.create("third")
+        for task, start in ((first, 100), (second, 200), (first, 300)):
+            self.task_intervals.start(task, start)
+            self.task_intervals.stop(task, start + 50)
+        intervals = self.task_intervals.between(120, 300)
+        assert [interval.start_time for interval in intervals] == [100, 200]
+        assert [i.start_time for i in self.task_intervals.between(160, 310)] == [200, 300]
+        streamed = list(self.task_intervals.stream(0, 1000))
+        assert streamed[0].task is streamed[2].task
+
+    def test_paging_through_intervals_in_time_window(self):
+        task = self.tasks.by_id(2)
+        for start in (100, 200, 300):
+            self.task_intervals.start(task, start)
+            self.task_intervals.stop(task, start + 50)
+        page, token = self.task_intervals.page(limit=1, since=150, until=350)
+        assert [interval.start_time for interval in page] == [200]
+        page, token = self.task_intervals.page(token, since=150, until=350)
+        assert [interval.start_time for interval in page] == [300]
+        assert token is None
+
+    def test_totals_should_follow_starting_and_stopping(self):
+        task = self.tasks.by_id(2)
+        self.task_intervals.start(task, 100)
+        task = self.tasks.by_id(2)
+        assert (task.total_seconds, task.interval_count, task.last_worked) == (0, 1, 100)
+        self.task_intervals.stop(task, 160)
+        task = self.tasks.by_id(2)
+        assert (task.total_seconds, task.interval_count, task.last_worked) == (60, 1, 160)
+
+    def test_totals_should_follow_merged_and_deleted_intervals(self):
+        first, second = self.tasks.by_id(1), self.tasks.by_id(2)
+        self.task_intervals.start(second, 100)
+        self.task_intervals.stop(second, 160)
+        last_worked = first.last_worked
+        self.tasks.merge(first, [second])
+        first = self.tasks.by_id(1)
+        assert first.interval_count == 2
+        assert abs(first.total_seconds - 70) < 1e-6
+        self.tt.conn.execute("DELETE FROM TASKINTERVAL WHERE START_TIME = 100")
+        first = self.tasks.by_id(1)
+        assert first.interval_count == 1 and first.last_worked == last_worked
+
+    def test_sorted_tasks(self):
+        second = self.tasks.by_id(2)
+        self.task_intervals.start(second, 100)
+        self.task_intervals.stop(second, 1000)
+        assert [task.task_id for task in self.tasks.sorted('total')] == [2, 1]
+        assert [task.task_id for task in self.tasks.sorted('recent', 1)] == [1]
+        with pytest.raises(ValueError):
+            self.tasks.sorted('color')
+
+    def test_totals_should_be_backfilled_for_existing_databases(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE TASK(TASK INTEGER, NAME TEXT NOT NULL,"
+                     " DESCRIPTION TEXT, PRIMARY KEY(TASK))")
+        conn.execute(TaskIntervals.SCHEMA)
+        conn.execute("INSERT INTO TASK(NAME) VALUES('old')")
+        conn.execute("INSERT INTO TASKINTERVAL(TASK, START_TIME, STOP_TIME)"
+                     " VALUES(1, 10, 20)")
+        task = Tasks(conn).by_id(1)
+        assert (task.total_seconds, task.interval_count, task.last_worked) == (10, 1, 20)
+
+    def test_merging_tasks_should_move_intervals_and_delete_sources(self):
+        target, source = self.tasks.by_id(2), self.tasks.by_id(1)
+        assert self.tasks.merge(target, [target, source]) == 1
+        assert [task.task_id for task in self.tasks.all()] == [2]
+        assert len(self.task_intervals.for_task(target)) == 1
+
+    def test_merging_thousands_of_tasks(self):
+        target = self.tasks.by_id(1)
+        sources = [self.tasks.create("dup") for _ in range(2000)]
+        for i, source in enumerate(sources):
+            self.task_intervals.start(source, i * 10)
+            self.task_intervals.stop(source, i * 10 + 5)
+        assert self.tasks.merge(target, sources) == 2000
+        assert len(self.tasks.all()) == 2
+        assert len(self.task_intervals.for_task(target)) == 2001
+
     def test_should_not_be_able_to_stop_before_start(self):
         now = time.time()
         an_hour_ago = now - 60 * 60
@@ -156,3 +311,42 @@ class TestTaskIntervals(object):
         self.task_intervals.start(task, now)
         with pytest.raises(InconsistentTaskIntervals):
             self.task_intervals.stop(task, an_hour_ago)
+
+
+class TestSnapshot(object):
+
+    path = 'trackit_test_snapshot.sqlite'
+
+    def teardown_method(self, meth):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def fill(self, conn):
+        data = Data(conn)
+        task = data.tasks.create("copied")
+        data.intervals.start(task, 10)
+        data.intervals.stop(task, 20)
+        conn.commit()
+        return data
+
+    def check(self, source, copy):
+        data = Data(copy)
+        assert [task.name for task in data.tasks.all()] == ["copied"]
+        assert data.tasks.by_id(1).total_seconds == 10
+        assert revision(copy) == revision(source)
+        data.intervals.start(data.tasks.by_id(1), 30)
+        assert revision(copy) == revision(source) + 1
+        assert len(Data(source).intervals.for_task(data.tasks.by_id(1))) == 1
+
+    def test_snapshot_of_memory_database(self):
+        source = sqlite3.connect(":memory:")
+        self.fill(source)
+        self.check(source, snapshot(source))
+
+    def test_snapshot_of_database_file(self):
+        source = sqlite3.connect(self.path)
+        self.fill(source)
+        copy = snapshot(source)
+        assert copy.execute("SELECT COUNT(*) FROM SQLITE_MASTER").fetchone() \
+            == source.execute("SELECT COUNT(*) FROM SQLITE_MASTER").fetchone()
+        self.check(source, copy)
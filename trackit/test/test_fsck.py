@@ -0,0 +1,50 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import sqlite3
+
+from trackit import fsck
+from trackit.data import Data
+
+class TestFsck(object):
+
+    def setup(self):
+        self.data = Data(sqlite3.connect(":memory:"))
+        self.task = self.data.tasks.create("task")
+
+    def insert(self, *rows):
+        self.data.conn.executemany("INSERT INTO TASKINTERVAL(TASK, START_TIME,"
+                                   " STOP_TIME) VALUES(?, ?, ?)", rows)
+
+    def problems(self):
+        return [(problem.kind, problem.task_interval, problem.other)
+                for problem in fsck.check(self.data.conn)]
+
+    def test_consistent_intervals_have_no_problems(self):
+        self.insert((1, 10, 20), (1, 20, 30), (1, 40, None))
+        assert self.problems() == []
+
+    def test_finds_every_kind_of_problem(self):
+        self.insert((1, 10, 50), (1, 20, 30), (1, 40, 35), (7, 60, None),
+                    (1, 70, None))
+        assert self.problems() == [
+            (fsck.OVERLAP, 2, 1), (fsck.NEGATIVE, 3, None),
+            (fsck.ORPHAN, 4, 7), (fsck.OVERLAP, 5, 4), (fsck.OPEN, 5, 4)]
+
+    def test_finds_overlap_with_long_interval_once(self):
+        self.insert((1, 10, 100), (1, 20, 30), (1, 30, 40), (1, 90, 110))
+        assert self.problems() == [(fsck.OVERLAP, 2, 1)]
+
+    def test_repair_leaves_no_problems(self):
+        self.insert((1, 10, 50), (1, 20, 30), (1, 40, 35), (7, 60, None),
+                    (1, 70, None), (1, 70, 80))
+        problems = list(fsck.check(self.data.conn))
+        assert fsck.repair(self.data.conn, problems) == 5
+        assert self.problems() == []
+        assert self.data.tasks.by_id(7).total_seconds == 10
+        task = self.data.tasks.by_id(1)
+        assert (task.total_seconds, task.interval_count) == (30, 3)
@@ -0,0 +1,169 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import sqlite3
+import pytest
+
+from trackit.util import Path
+from trackit.data import (
+    Data, TooManyTasksInProgress, InconsistentTaskIntervals, NoTaskInProgress
+)
+from trackit.journal import Journal, JournaledIntervals, START, STOP
+
+target = Path('trackit_test_journal')
+journal_file = target.join('journal')
+
+def setup_function(func):
+    target.makedir()
+
+def teardown_function(func):
+    if target.exists():
+        target.rmdir()
+
+def journaled():
+    data = Data(sqlite3.connect(":memory:"))
+    data.intervals = JournaledIntervals(data.intervals, Journal(journal_file))
+    return data
+
+def test_journal_should_read_back_appended_events():
+    journal = Journal(journal_file)
+    journal.append(START, 10.5, u'b\xe6r')
+    journal.append(STOP, 20)
+    assert journal.events() == [(START, 10.5, u'b\xe6r'), (STOP, 20, u'')]
+
+def test_journal_should_ignore_partially_written_record():
+    journal = Journal(journal_file)
+    journal.append(START, 10, u'task')
+    with open(journal_file.path, 'ab') as outf:
+        outf.write('S\x00\x00')
+    assert len(journal) == 1
+
+def test_starting_and_stopping_should_not_touch_the_database():
+    data = journaled()
+    task = data.tasks.create("task")
+    data.intervals.start(task, 10)
+    assert data.intervals.in_progress().start_time == 10
+    data.intervals.stop(task, 20)
+    assert data.intervals.in_progress() is None
+    assert data.intervals.intervals.for_task(task) == []
+    assert [(i.start_time, i.stop_time) for i in data.intervals.for_task(task)] == [(10, 20)]
+
+def test_journal_should_validate_like_the_database():
+    data = journaled()
+    task = data.tasks.create("task")
+    with pytest.raises(NoTaskInProgress):
+        data.intervals.stop(task, 5)
+    data.intervals.start(task, 10)
+    with pytest.raises(TooManyTasksInProgress):
+        data.intervals.start(task, 15)
+    with pytest.raises(InconsistentTaskIntervals):
+        data.intervals.stop(task, 5)
+    data.intervals.stop(task, 20)
+    with pytest.raises(InconsistentTaskIntervals):
+        data.intervals.start(task, 15)
+
+def test_journal_can_stop_interval_started_in_database():
+    data = journaled()
+    task = data.tasks.create("task")
+    data.intervals.intervals.start(task, 10)
+    data.intervals.stop(task, 20)
+    assert data.intervals.in_progress() is None
+    assert data.intervals.for_task(task)[0].stop_time == 20
+    with pytest.raises(InconsistentTaskIntervals):
+        data.intervals.start(task, 15)
+
+def test_compact_should_replay_events_into_database_once():
+    data = journaled()
+    task = data.tasks.create("task")
+    data.intervals.start(task, 10)
+    data.intervals.stop(task, 20)
+    data.intervals.start(task, 30)
+    events = data.intervals.journal.events()
+    assert data.intervals.compact() == 3
+    # Until the caller has committed, the journal is kept
+    assert journal_file.exists()
+    data.conn.commit()
+    assert data.intervals.clear_compacted() == []
+    assert not journal_file.exists()
+    for kind, when, name in events:
+        data.intervals.journal.append(kind, when, name)
+    data.intervals.compact()
+    intervals = data.intervals.intervals.for_task(task)
+    assert [(i.start_time, i.stop_time) for i in intervals] == [(10, 20), (30, None)]
+
+def test_clear_should_keep_events_appended_after_compact():
+    data = journaled()
+    task = data.tasks.create("task")
+    data.intervals.start(task, 10)
+    data.intervals.compact()
+    # Another process stops the task before this one commits
+    Journal(journal_file).append(STOP, 20)
+    data.conn.commit()
+    data.intervals.clear_compacted()
+    assert data.intervals.journal.events() == [(STOP, 20, u'')]
+    assert data.intervals.in_progress() is None
+    data.intervals.compact()
+    intervals = data.intervals.intervals.for_task(task)
+    assert [(i.start_time, i.stop_time) for i in intervals] == [(10, 20)]
+
+def test_other_repository_methods_see_compacted_events():
+    data = journaled()
+    task = data.tasks.create("task")
+    data.intervals.start(task, 10)
+    page, _ = data.intervals.page()
+    assert len(page) == 1
+
+def test_compact_should_not_commit():
+    data = journaled()
+    task = data.tasks.create("task")
+    data.intervals.start(task, 10)
+    data.intervals.compact()
+    data.conn.rollback()
+    data.intervals.rolled_back()
+    assert data.intervals.intervals.in_progress() is None
+    assert data.intervals.in_progress().start_time == 10
+
+def test_delegated_attributes_should_compact_once():
+    data = journaled()
+    task = data.tasks.create("task")
+    data.intervals.start(task, 10)
+    data.intervals.check_overlap(5)
+    data.intervals.journal.append(START, 1, u'sneaked in')
+    data.intervals.check_overlap(5)
+    assert not data.intervals.started_at(1)
+
+def test_conflicting_start_should_be_moved_aside_once():
+    data = journaled()
+    task = data.tasks.create("task")
+    data.intervals.start(task, 10)
+    data.intervals.stop(task, 20)
+    # Written to the database behind the back of the journal
+    data.intervals.intervals.add(task, 5, 15)
+    data.intervals.start(task, 30)
+    assert data.intervals.compact() == 3
+    data.conn.commit()
+    messages = data.intervals.clear_compacted()
+    assert len(messages) == 2
+    assert "start of 'task' at 10" in messages[0]
+    assert Journal(target.join('journal.rejected')).events() == [
+        (START, 10, u'task'), (STOP, 20, u'')]
+    assert data.intervals.in_progress().start_time == 30
+    assert data.intervals.compact() == 0
+
+def test_journal_should_keep_tasks_with_the_same_name_apart():
+    data = journaled()
+    first = data.tasks.resolve("a/review", create=True)
+    second = data.tasks.resolve("b/review", create=True)
+    data.intervals.start(second, 10)
+    assert data.intervals.in_progress().task.task_id == second.task_id
+    assert data.intervals.for_task(first) == []
+    with pytest.raises(NoTaskInProgress):
+        data.intervals.stop(first, 20)
+    data.intervals.stop(second, 20)
+    data.intervals.compact()
+    assert data.intervals.intervals.for_task(first) == []
+    assert len(data.intervals.intervals.for_task(second)) == 1
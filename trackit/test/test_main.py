@@ -7,6 +7,7 @@
 
 import sys
 import os
+import sqlite3
 from trackit import util, main
 from trackit.exceptions import ArgumentParsingException
 
@@ -69,3 +70,283 @@ class TestMain(object):
         with self.capture:
             assert self.run('fooeuaoeu') != 0
         assert 'usage:' in self.err
+
+    def test_status_watch(self):
+        with self.capture:
+            assert self.run('start', 'watching') == 0
+        with self.capture:
+            assert self.run('status', '--watch', '-i', '0', '-n', '3') == 0
+        assert self.out.count("Tracking 'watching' for") == 3
+
+    def test_merge(self):
+        with self.capture:
+            self.run('start', 'bugfix')
+            self.run('stop')
+            self.run('start', 'bugfx')
+            self.run('stop')
+            assert self.run('merge', 'bugfix', 'bugfx') == 0
+        assert "Merged 1 tasks into 'bugfix', moving 1 intervals." in self.out
+
+    def test_merge_unknown_task(self):
+        with self.capture:
+            assert self.run('merge', 'nothing', 'here') == 1
+        assert 'No such task: nothing, here' in self.out
+
+    def test_rename(self):
+        with self.capture:
+            self.run('start', 'bugfix')
+            assert self.run('rename', '--pattern', 'bug', 'hot') == 0
+            self.run('status')
+        assert 'Renamed 1 tasks.' in self.out
+        assert "Tracking 'hotfix'" in self.out
+
+    def test_journal(self):
+        from trackit.configuration import create_home, dump_settings, DEFAULT
+        settings = dict(DEFAULT, journal=True, journal_compact_after=2)
+        SIMULATION_HOME.makedir()
+        with SIMULATION_HOME.join('config').open('w') as outf:
+            dump_settings(settings, outf)
+        journal_file = SIMULATION_HOME.join('journal')
+        with self.capture:
+            assert self.run('start', 'journaled') == 0
+            assert journal_file.exists()
+            assert self.run('status') == 0
+            assert self.run('stop') == 0
+            assert not journal_file.exists()
+            assert self.run('start', 'journaled') == 0
+            assert self.run('compact') == 0
+        assert "Tracking 'journaled' for" in self.out
+        assert "Stopped 'journaled' after" in self.out
+        assert 'Compacted 1 journal events.' in self.out
+
+    def test_journal_with_rejected_start(self):
+        from trackit.configuration import dump_settings, DEFAULT
+        from trackit.journal import Journal, START
+        SIMULATION_HOME.makedir()
+        with SIMULATION_HOME.join('config').open('w') as outf:
+            dump_settings(dict(DEFAULT, journal=True), outf)
+        with self.capture:
+            assert self.run('start', 'first', '--at', '100') == 0
+        # A start inside the interval in progress can not be replayed
+        Journal(SIMULATION_HOME.join('journal')).append(START, 150, u'late')
+        with self.capture:
+            assert self.run('tasks') == 0
+            assert self.run('tasks') == 0
+        assert self.err.count("Moved the journaled start of 'late'") == 1
+        assert 'first' in self.out
+        assert not SIMULATION_HOME.join('journal').exists()
+
+    def test_sync(self):
+        other = util.Path('.').join('trackit_simulation_other')
+        try:
+            with self.capture:
+                self.run('start', 'here')
+                self.run('stop')
+                main.main(["--home", other.path, 'start', 'there'])
+                assert self.run('sync', other.join('db.sqlite').path) == 0
+                self.run('status')
+        finally:
+            other.rmdir()
+        assert 'Sent 1 intervals.' in self.out
+        assert 'Received 1 intervals.' in self.out
+        assert "Tracking 'there'" in self.out
+
+    def test_tasks(self):
+        with self.capture:
+            self.run('start', 'first')
+            self.run('stop')
+            self.run('start', 'second')
+            assert self.run('tasks', '--sort', 'recent') == 0
+        listed = [line.split('\t')[0] for line in self.out.splitlines()[-2:]]
+        assert listed == ['second', 'first']
+
+    def test_report(self):
+        with self.capture:
+            self.run('start', 'reported')
+            self.run('stop')
+            assert self.run('report') == 0
+            assert self.run('report', '--by', 'week') == 0
+        lines = self.out.splitlines()
+        assert lines[-2].startswith('reported\t')
+        assert lines[-1].split('\t')[1] == 'reported'
+
+    def test_report_in_parallel(self):
+        with self.capture:
+            self.run('start', 'reported', '--at', '1000')
+            self.run('stop', '--at', '1500')
+            assert self.run('report', '--jobs', '2') == 0
+        assert self.out.splitlines()[-1] == 'reported\t500 seconds'
+
+    def test_batch(self):
+        commands = SIMULATION_HOME.join('commands')
+        with self.capture:
+            self.run('status')
+            with commands.open('w') as outf:
+                outf.write("# backfilled\n"
+                           "start first --at 1000\n"
+                           "stop --at 2000\n\n"
+                           "start 'second task' --at 3000\n")
+            assert self.run('batch', commands.path) == 0
+            self.run('status')
+        assert "Tracking 'second task'" in self.out
+
+    def test_batch_rolls_back(self):
+        commands = SIMULATION_HOME.join('commands')
+        with self.capture:
+            self.run('status')
+            with commands.open('w') as outf:
+                outf.write("start first --at 1000\n"
+                           "stop --at 2000\n"
+                           "start second --at 1500\n")
+            assert self.run('batch', commands.path) == 1
+            self.run('tasks')
+        assert 'Line 3: ' in self.out
+        assert 'first' not in self.out.splitlines()[-1]
+
+    def test_batch_rolls_back_schema_changes(self):
+        commands = SIMULATION_HOME.join('commands')
+        with self.capture:
+            self.run('status')
+            with commands.open('w') as outf:
+                outf.write("start first --at 1000\n"
+                           "stop --at 2000\n"
+                           "report --by day\n"
+                           "start second --at 1500\n")
+            assert self.run('batch', commands.path) == 1
+        assert 'Line 4: ' in self.out
+        conn = sqlite3.connect(SIMULATION_HOME.join('db.sqlite').path)
+        assert conn.execute("SELECT COUNT(*) FROM TASK").fetchone() == (0,)
+        assert conn.execute("SELECT COUNT(*) FROM SQLITE_MASTER"
+                            " WHERE NAME = 'CALENDAR'").fetchone() == (0,)
+        conn.close()
+
+    def test_batch_rejects_commands_it_can_not_run(self):
+        commands = SIMULATION_HOME.join('commands')
+        with self.capture:
+            self.run('status')
+            with commands.open('w') as outf:
+                outf.write("start first --at 1000\n"
+                           "serve\n")
+            assert self.run('batch', commands.path) == 1
+            with commands.open('w') as outf:
+                outf.write("maintain\n")
+            assert self.run('batch', commands.path) == 1
+        assert 'Line 2: serve can not be batched, rolled back.' in self.out
+        assert 'Line 1: maintain can not be batched, rolled back.' in self.out
+
+    def test_report_from_snapshot(self):
+        with self.capture:
+            self.run('start', 'reported')
+            self.run('stop')
+            assert self.run('report', '--snapshot') == 0
+            assert self.run('tasks', '--snapshot') == 0
+            self.run('status')
+        lines = self.out.splitlines()
+        assert lines[-3].startswith('reported\t')
+        assert lines[-2].startswith('reported\t')
+
+    def test_fsck(self):
+        with self.capture:
+            self.run('start', 'checked', '--at', '10')
+            self.run('stop', '--at', '20')
+            assert self.run('fsck') == 0
+        assert 'No problems found.' in self.out
+
+    def test_tagged_report(self):
+        with self.capture:
+            self.run('start', 'client', '--at', '1000', '--tag', 'billable')
+            self.run('stop', '--at', '1100')
+            self.run('start', 'client', '--at', '1200')
+            self.run('stop', '--at', '1250')
+            assert self.run('report', '--tags', 'billable') == 0
+            assert self.run('report', '--tags', 'not billable') == 0
+            assert self.run('report', '--tags', 'billable and') == 1
+            assert self.run('start', 'client', '--tag', 'not') == 1
+        lines = self.out.splitlines()
+        assert lines[4:6] == ['client\t100 seconds', 'client\t50 seconds']
+
+    def test_stats(self):
+        with self.capture:
+            self.run('start', 'measured', '--at', '1000')
+            self.run('stop', '--at', '1100')
+            assert self.run('stats') == 0
+            assert self.run('stats', '--task', 'missing') == 1
+        lines = self.out.splitlines()
+        assert lines[-2].startswith('measured\t1 sessions\tmean 100\t')
+        assert lines[-1] == 'No such task: missing'
+
+    def test_maintain(self):
+        with self.capture:
+            self.run('start', 'maintained')
+            assert self.run('maintain', '--force', '--vacuum') == 0
+            # Every job just ran, so none is due
+            assert self.run('maintain') == 0
+        lines = self.out.splitlines()
+        assert lines[1:] == ['Vacuumed the database.', 'Ran checkpoint.',
+                             'Ran optimize.', 'Ran incremental_vacuum.',
+                             'Ran analyze.', 'No maintenance was due.']
+        conn = sqlite3.connect(SIMULATION_HOME.join('db.sqlite').path)
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        conn.close()
+
+    def test_tracking_should_not_run_maintenance(self):
+        with self.capture:
+            self.run('start', 'fast', '--at', '1000')
+            self.run('stop', '--at', '2000')
+        conn = sqlite3.connect(SIMULATION_HOME.join('db.sqlite').path)
+        assert conn.execute("SELECT COUNT(*) FROM SQLITE_MASTER"
+                            " WHERE NAME = 'MAINTENANCE'").fetchone() == (0,)
+        conn.close()
+
+    def test_start_task_path(self):
+        with self.capture:
+            self.run('start', 'project/task', '--at', '10')
+            self.run('stop', '--at', '20')
+            assert self.run('report', '--rollup') == 0
+        lines = self.out.splitlines()
+        assert lines[-2:] == ['project\t10 seconds',
+                              'project/task\t10 seconds']
+
+    def test_export(self):
+        with self.capture:
+            self.run('start', 'exported')
+            self.run('stop')
+            assert self.run('export', SIMULATION_HOME.join('export').path) == 0
+        assert 'Exported 1 intervals.' in self.out
+
+    def test_series(self):
+        with self.capture:
+            self.run('start', 'charted', '--at', '0')
+            self.run('stop', '--at', '90')
+            assert self.run('series', '-n', '2', '-t', 'charted') == 0
+            assert self.run('series', '-t', 'missing') == 1
+        lines = self.out.splitlines()
+        assert lines[-3].endswith('\t90 seconds')
+        assert lines[-1] == 'No such task: missing'
+
+    def test_metrics(self):
+        SIMULATION_HOME.makedir()
+        with SIMULATION_HOME.join('config').open('w') as outf:
+            outf.write('{"metrics": "metrics.prom"}')
+        with self.capture:
+            self.run('start', 'measured')
+            self.run('status')
+        with SIMULATION_HOME.join('metrics.prom').open() as inf:
+            content = inf.read()
+        assert 'trackit_commands_total{command="status",outcome="ok"} 1.0' in content
+        assert 'trackit_tasks 1.0' in content
+
+    def test_metrics_should_count_exit_codes_as_errors(self):
+        SIMULATION_HOME.makedir()
+        with SIMULATION_HOME.join('config').open('w') as outf:
+            outf.write('{"metrics": "metrics.prom"}')
+        with self.capture:
+            assert self.run('merge', 'missing', 'absent') == 1
+            self.run('start', 'measured', '--at', '1000')
+            self.run('stop', '--at', '2000')
+            self.run('tasks', '--snapshot')
+        with SIMULATION_HOME.join('metrics.prom').open() as inf:
+            content = inf.read()
+        assert 'trackit_commands_total{command="merge",outcome="error"} 1.0' in content
+        assert 'trackit_commands_total{command="tasks",outcome="ok"} 1.0' in content
+        assert 'trackit_intervals 1.0' in content
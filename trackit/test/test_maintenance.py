@@ -0,0 +1,51 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import sqlite3
+
+from trackit import maintenance
+from trackit.maintenance import Job, Maintenance
+from trackit.util import Path
+
+target = Path('trackit_test_maintenance')
+
+SLOW = Job('slow', 60, "WITH RECURSIVE N(I) AS (SELECT 1 UNION ALL"
+                       " SELECT I + 1 FROM N) SELECT COUNT(*) FROM N")
+
+class TestMaintenance(object):
+
+    def setup(self):
+        self.conn = sqlite3.connect(":memory:")
+
+    def teardown(self):
+        if target.exists():
+            target.rmdir()
+
+    def test_jobs_should_only_run_when_due(self):
+        jobs = Maintenance(self.conn)
+        assert jobs.run() == [job.name for job in maintenance.JOBS]
+        assert jobs.run() == []
+        last_run = jobs.runs()['optimize'][0]
+        assert jobs.due(last_run + maintenance.DAY - 1) == \
+            [maintenance.JOBS[0]]
+        assert jobs.run(force=True) == [job.name for job in maintenance.JOBS]
+
+    def test_jobs_should_be_interrupted_when_the_budget_is_spent(self):
+        jobs = Maintenance(self.conn, jobs=(SLOW, maintenance.JOBS[0]))
+        assert jobs.run(budget=0.01) == []
+        last_run, duration = jobs.runs()['slow']
+        assert last_run is None and duration >= 0.01
+        # It needs more than the budget, so the next job gets to run
+        assert jobs.run(budget=0.01) == ['checkpoint']
+
+    def test_vacuum_should_enable_incremental_vacuum(self):
+        target.makedir()
+        conn = sqlite3.connect(target.join('db').path)
+        conn.execute("CREATE TABLE T(A)")
+        maintenance.vacuum(conn)
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        conn.close()
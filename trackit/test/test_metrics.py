@@ -0,0 +1,63 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import sqlite3
+
+from trackit import metrics
+from trackit.data import Data
+from trackit.util import Path
+
+target = Path('trackit_test_metrics')
+path = target.join('metrics.prom')
+db = target.join('db.sqlite')
+
+def setup_function(func):
+    target.makedir()
+
+def teardown_function(func):
+    if target.exists():
+        target.rmdir()
+
+def test_counting_connection_should_count_statements():
+    conn = sqlite3.connect(":memory:", factory=metrics.CountingConnection)
+    Data(conn).tasks.create("counted")
+    before = conn.statements
+    conn.execute("SELECT 1")
+    conn.executemany("INSERT INTO TASK(NAME) VALUES(?)", [("a",), ("b",)])
+    assert conn.statements == before + 2
+
+def test_record_should_accumulate_counters():
+    conn = sqlite3.connect(db.path, factory=metrics.CountingConnection)
+    Data(conn)
+    conn.commit()
+    for seconds in (0.001, 0.2):
+        metrics.record(path, 'status', False, seconds, 0.001, conn, db)
+    metrics.record(path, 'start', True, 0.3, None, conn, db)
+    samples = metrics.Metrics(path).samples
+    assert samples['trackit_commands_total{command="status",outcome="ok"}'] == 2
+    assert samples['trackit_commands_total{command="start",outcome="error"}'] == 1
+    assert samples['trackit_command_duration_seconds_bucket{command="status",le="0.005"}'] == 1
+    assert samples['trackit_command_duration_seconds_bucket{command="status",le="+Inf"}'] == 2
+    assert samples['trackit_commit_duration_seconds_count'] == 2
+    assert samples['trackit_intervals'] == 0
+    assert samples['trackit_database_size_bytes'] > 0
+    with path.open() as inf:
+        assert '# TYPE trackit_command_duration_seconds histogram\n' in inf.read()
+
+def test_record_should_read_maintained_counts():
+    conn = sqlite3.connect(db.path, factory=metrics.CountingConnection)
+    data = Data(conn)
+    task = data.tasks.create("counted")
+    data.intervals.start(task, 1000)
+    data.intervals.stop(task, 2000)
+    conn.commit()
+    metrics.record(path, 'stop', False, 0.001, 0.001, conn, db)
+    samples = metrics.Metrics(path).samples
+    assert samples['trackit_tasks'] == 1
+    assert samples['trackit_intervals'] == 1
+    metrics.record(path, 'tasks', False, 0.001, None, conn, db, gauges=False)
+    assert metrics.Metrics(path).samples['trackit_intervals'] == 1
@@ -0,0 +1,86 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from trackit import parallel, report
+from trackit.data import Data
+from trackit.util import Path
+
+target = Path('trackit_test_parallel')
+
+class TestParallel(object):
+
+    def setup(self):
+        target.makedir()
+        self.data = Data(sqlite3.connect(target.join('db').path))
+        parent = self.data.tasks.create("parent")
+        tasks = [self.data.tasks.create("child {}".format(i), parent=parent)
+                 for i in range(3)]
+        # With 12 partitions, intervals cross partition boundaries
+        for i in range(30):
+            task = tasks[i % len(tasks)]
+            self.data.intervals.start(task, 1000 * i)
+            self.data.intervals.stop(task, 1000 * i + 50 + 31 * i)
+        self.data.intervals.start(tasks[0], 40000)
+        self.data.conn.commit()
+
+    def teardown(self):
+        self.data.conn.close()
+        if target.exists():
+            target.rmdir()
+
+    def pairs(self, results):
+        return [(task.task_id, seconds) for task, seconds in results]
+
+    def test_partitions_should_cover_the_window(self):
+        bounds = parallel.partitions(10, 20, 4)
+        assert len(bounds) == 4
+        assert bounds[0][0] == 10 and bounds[-1][1] == 20
+        assert all(a[1] == b[0] for a, b in zip(bounds, bounds[1:]))
+
+    def test_totals_should_match_serial_totals(self):
+        for since, until in ((None, 50000), (1234, 28765), (500, 520)):
+            assert self.pairs(parallel.totals(self.data, since, until, 2)) \
+                == self.pairs(report.totals(self.data, since, until))
+
+    def test_rollup_should_match_serial_rollup(self):
+        assert self.pairs(parallel.rollup(self.data, 333, 45000, 3)) \
+            == self.pairs(report.rollup(self.data, 333, 45000))
+
+    def test_memory_databases_should_be_reported_on_serially(self):
+        memory = Data(sqlite3.connect(":memory:"))
+        task = memory.tasks.create("memory")
+        memory.intervals.start(task, 0)
+        memory.intervals.stop(task, 10)
+        assert self.pairs(parallel.totals(memory, until=100)) == [(1, 10)]
+
+    def test_pending_changes_should_be_summed_without_commit(self):
+        task = self.data.tasks.named("child 1")[0]
+        self.data.intervals.stop(self.data.tasks.named("child 0")[0], 40010)
+        self.data.intervals.start(task, 50000)
+        self.data.intervals.stop(task, 50100)
+        seconds = parallel.task_seconds(self.data, 40000, 60000, 2)
+        assert seconds == {task.task_id - 1: 10, task.task_id: 100}
+        with closing(sqlite3.connect(target.join('db').path)) as other:
+            assert other.execute("SELECT COUNT(*) FROM TASKINTERVAL"
+                                 " WHERE STOP_TIME IS NULL").fetchone() == (1,)
+        self.data.conn.rollback()
+
+    def test_workers_should_read_while_writers_wait(self):
+        with closing(sqlite3.connect(target.join('db').path, timeout=0)) \
+                as other:
+            lock = parallel._write_lock(target.join('db').path)
+            try:
+                assert parallel._write_lock(target.join('db').path) is None
+                with pytest.raises(sqlite3.OperationalError):
+                    other.execute("DELETE FROM TASKINTERVAL")
+            finally:
+                lock.close()
@@ -0,0 +1,101 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import re
+import sqlite3
+
+from trackit.data import Data, STATEMENTS
+
+# Statements run on every start, stop and lookup, which must search an
+# index rather than scan a table. Substring search on names (tasks.by_name)
+# can not use an index and is left out; exact names (tasks.named) are here.
+HOT = (
+    'tasks.by_id',
+    'tasks.named',
+    'tasks.child',
+    'intervals.in_progress',
+    'intervals.latest',
+    'intervals.stop',
+    'intervals.overlap',
+    'intervals.later',
+    'intervals.inside',
+    'intervals.started_at',
+    'intervals.for_task',
+)
+
+TASKS = 1000
+INTERVALS = 20000
+
+def _parameters(sql):
+    """Dummy parameters for every placeholder in sql."""
+    names = re.findall(r":(\w+)", sql)
+    if names:
+        return dict((name, 1) for name in names)
+    return (1,) * sql.count("?")
+
+class TestQueries(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.data = Data(sqlite3.connect(":memory:"))
+        parents = [None]
+        for i in range(TASKS):
+            parents.append(cls.data.tasks.create("task {}".format(i),
+                                                 parent=parents[i // 10]))
+        tasks = parents[1:]
+        cls.data.conn.executemany(
+            "INSERT INTO TASKINTERVAL(TASK, START_TIME, STOP_TIME)"
+            " VALUES(?, ?, ?)",
+            ((tasks[i * 7 % TASKS].task_id, 100 * i, 100 * i + 60)
+             for i in range(INTERVALS)))
+        cls.data.intervals.start(tasks[0], 100 * INTERVALS)
+        cls.data.conn.commit()
+        cls.data.conn.execute("ANALYZE")
+        cls.partial = set(row[0] for row in cls.data.conn.execute(
+            "SELECT NAME FROM SQLITE_MASTER WHERE TYPE = 'index'"
+            " AND SQL LIKE '% WHERE %'"))
+
+    @classmethod
+    def teardown_class(cls):
+        cls.data.conn.close()
+
+    def plan(self, name):
+        sql = STATEMENTS[name].replace("{}", "?")
+        return [row[-1] for row in self.data.conn.execute(
+            "EXPLAIN QUERY PLAN " + sql, _parameters(sql))]
+
+    def scans(self, name):
+        """Steps of the plan of name that read every row of a table or
+        index. Subquery results are at most a row here, and partial
+        indexes only hold the rows the statement is after."""
+        return [step for step in self.plan(name)
+                if step.startswith("SCAN")
+                and not step.startswith("SCAN (subquery")
+                and not any(step.endswith("INDEX " + index)
+                            for index in self.partial)]
+
+    def test_every_statement_should_be_planned(self):
+        # Inserts have no steps, but every statement must compile
+        for name in STATEMENTS:
+            assert isinstance(self.plan(name), list), name
+
+    def test_hot_statements_should_be_registered(self):
+        assert set(HOT) <= set(STATEMENTS)
+
+    def test_hot_statements_should_not_scan(self):
+        for name in HOT:
+            assert self.scans(name) == [], name
+
+    def test_bounded_streams_should_not_scan(self):
+        for name in STATEMENTS:
+            if name.startswith(('intervals.stream.', 'intervals.page.')) \
+               and not name.endswith('.0.0') \
+               and not name.endswith('.0.0.0'):
+                assert self.scans(name) == [], name
+
+    def test_scan_should_be_reported(self):
+        assert self.scans('tasks.by_name')
@@ -0,0 +1,114 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import sqlite3
+import time
+
+from trackit.data import Data, snapshot
+from trackit import report
+
+def _fixture():
+    data = Data(sqlite3.connect(":memory:"))
+    first = data.tasks.create("first")
+    second = data.tasks.create("second")
+    for task, start, stop in [(first, 100, 200), (second, 200, 250),
+                              (first, 300, 400)]:
+        data.intervals.start(task, start)
+        data.intervals.stop(task, stop)
+    data.conn.commit()
+    return data.conn
+
+# Built once, every test gets its own snapshot of it
+FIXTURE = _fixture()
+
+class TestTotals(object):
+
+    def setup(self):
+        self.data = Data(snapshot(FIXTURE))
+        self.second = self.data.tasks.by_id(2)
+
+    def totals(self, since=None, until=None):
+        return [(task.name, seconds) for task, seconds in
+                report.totals(self.data, since, until)]
+
+    def test_totals_should_sum_per_task_most_worked_first(self):
+        assert self.totals() == [("first", 200), ("second", 50)]
+
+    def test_totals_should_clip_intervals_to_window(self):
+        assert self.totals(150, 350) == [("first", 100), ("second", 50)]
+        assert self.totals(210, 300) == [("second", 40)]
+
+    def test_periods_should_split_intervals_at_local_midnight(self):
+        data = Data(sqlite3.connect(":memory:"))
+        task = data.tasks.create("late")
+        # 2013-03-30 22:00 to 2013-03-31 04:00 in Oslo, across the DST change
+        data.intervals.start(task, 1364677200)
+        data.intervals.stop(task, 1364698800)
+        days = [(label, seconds) for label, _, seconds in
+                report.periods(data, 'day', zone='Europe/Oslo')]
+        assert days == [('2013-03-30', 7200), ('2013-03-31', 14400)]
+        weeks = [(label, seconds) for label, _, seconds in
+                 report.periods(data, 'week', zone='Europe/Oslo')]
+        assert weeks == [('2013-W13', 21600)]
+
+    def test_periods_should_match_with_and_without_calendar(self):
+        def days():
+            return [(label, task.name, seconds) for label, task, seconds in
+                    report.periods(self.data, 'day', zone='Europe/Oslo')]
+        computed = days()
+        report.fill_calendar(self.data, zone='Europe/Oslo')
+        assert self.data.conn.execute(
+            "SELECT COUNT(*) FROM CALENDAR").fetchone()[0] > 0
+        assert days() == computed == [('1970-01-01', 'first', 200),
+                                      ('1970-01-01', 'second', 50)]
+
+    def test_periods_should_respect_window(self):
+        days = report.periods(self.data, 'day', since=150, until=220, zone='UTC')
+        assert [(label, task.name, seconds) for label, task, seconds in days] == [
+            ('1970-01-01', 'first', 50), ('1970-01-01', 'second', 20)]
+
+    def test_totals_should_count_interval_in_progress_until_now(self):
+        self.data.intervals.start(self.second, time.time() - 1000)
+        totals = dict(self.totals())
+        assert 1050 <= totals["second"] < 1060
+
+    def test_rollup_should_include_subtasks(self):
+        self.data.tasks.move(self.second, self.data.tasks.by_id(1))
+        rollup = [(task.name, seconds) for task, seconds in
+                  report.rollup(self.data, 150, 350)]
+        assert rollup == [("first", 150), ("second", 50)]
+
+    def test_bucket_width_should_fit_max_points(self):
+        assert report.bucket_width(0, 3600, 60) == 60
+        assert report.bucket_width(0, 3601, 60) == 3600
+        assert report.bucket_width(0, 86400 * 365, 1000) == 86400
+        assert report.bucket_width(0, 86400 * 3650, 1000) == 86400 * 4
+
+    def test_series_should_split_intervals_over_buckets(self):
+        width, points = report.series(self.data, 0, 480, 10)
+        assert width == 60
+        assert points == [(0, 0), (60, 20), (120, 60), (180, 60), (240, 10),
+                          (300, 60), (360, 40), (420, 0)]
+
+    def test_series_should_include_interval_started_before_window(self):
+        width, points = report.series(self.data, 330, 390, 10,
+                                      self.data.tasks.by_id(1))
+        assert points == [(300, 30), (360, 30)]
+        assert report.series(self.data, 330, 390, 10, self.second)[1] == \
+            [(300, 0), (360, 0)]
+
+    def test_series_should_bucket_days_at_local_midnight(self):
+        data = Data(sqlite3.connect(":memory:"))
+        task = data.tasks.create("late")
+        # 2013-03-30 22:00 to 2013-03-31 04:00 in Oslo, across the DST change
+        data.intervals.start(task, 1364677200)
+        data.intervals.stop(task, 1364698800)
+        width, points = report.series(data, 1364598000, 1364767200, 2,
+                                      zone='Europe/Oslo')
+        assert width == 86400
+        # Midnight in Oslo on 2013-03-30 and 2013-03-31, the day is 23 hours
+        assert points == [(1364598000, 7200), (1364684400, 14400)]
@@ -0,0 +1,121 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import json
+import sqlite3
+import threading
+import urllib2
+
+from trackit.journal import Journal, START
+from trackit.util import Path
+from trackit.server import Server, Trackit
+
+target = Path('trackit_test_server')
+db = target.join('db.sqlite')
+
+class TestServer(object):
+
+    def setup(self):
+        target.makedir()
+        connect = lambda: sqlite3.connect(db.path, check_same_thread=False)
+        self.trackit = Trackit(connect, readers=2)
+        self.server = Server(('127.0.0.1', 0), self.trackit)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def teardown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        target.rmdir()
+
+    def request(self, path, body=None, headers=None):
+        request = urllib2.Request(self.url + path, headers=headers or {})
+        if body is not None:
+            request.add_data(json.dumps(body))
+        try:
+            response = urllib2.urlopen(request)
+            return response.getcode(), response.info(), json.loads(response.read())
+        except urllib2.HTTPError, e:
+            content = e.read()
+            return e.code, e.info(), json.loads(content) if content else None
+
+    def test_start_status_and_stop(self):
+        assert self.request('/status')[2] == {'tracking': None}
+        code, _, started = self.request('/start', {'task': 'served'})
+        assert code == 200 and started['task']['name'] == 'served'
+        tracking = self.request('/status')[2]['tracking']
+        assert tracking['task']['name'] == 'served'
+        code, _, stopped = self.request('/stop', {})
+        assert code == 200 and stopped['stop_time'] is not None
+        assert self.request('/stop', {})[0] == 409
+
+    def test_tasks_report_and_intervals(self):
+        self.request('/start', {'task': 'one'})
+        self.request('/stop', {})
+        assert [task['name'] for task in self.request('/tasks')[2]['tasks']] == ['one']
+        totals = self.request('/report')[2]['totals']
+        assert totals[0]['task']['name'] == 'one'
+        assert len(self.request('/intervals?limit=10')[2]['intervals']) == 1
+        series = self.request('/series?points=10')[2]
+        assert series['width'] == 60 and len(series['points']) <= 10
+
+    def test_unchanged_database_gives_not_modified(self):
+        code, headers, _ = self.request('/status')
+        etag = headers['ETag']
+        assert self.request('/status', headers={'If-None-Match': etag})[0] == 304
+        self.request('/start', {'task': 'changed'})
+        assert self.request('/status', headers={'If-None-Match': etag})[0] == 200
+
+    def test_changes_from_other_connections_give_new_etag(self):
+        etag = self.request('/tasks')[1]['ETag']
+        conn = sqlite3.connect(db.path)
+        conn.execute("INSERT INTO TASK(NAME) VALUES('elsewhere')")
+        conn.commit()
+        code, headers, content = self.request('/tasks', headers={'If-None-Match': etag})
+        assert code == 200 and content['tasks'][0]['name'] == 'elsewhere'
+
+    def test_bad_requests(self):
+        assert self.request('/nothing')[0] == 404
+        assert self.request('/start', {})[0] == 400
+        assert self.request('/tasks?limit=many')[0] == 400
+        assert self.request('/series?points=0')[0] == 400
+        assert self.request('/series?task=1')[0] == 400
+        assert self.request('/start', ['task'])[0] == 400
+        assert self.request('/tasks?token=junk')[0] == 400
+        assert self.request('/tasks?limit=0')[0] == 400
+        assert self.request('/intervals?limit=-1')[0] == 400
+        assert self.request('/intervals?token=WzFd')[0] == 400
+
+    def test_database_errors_give_server_error(self):
+        conn = sqlite3.connect(db.path)
+        conn.execute("DROP TABLE TASKINTERVAL")
+        conn.commit()
+        conn.close()
+        code, _, content = self.request('/intervals')
+        assert code == 500 and 'TASKINTERVAL' in content['error']
+
+    def test_journaled_events_should_be_compacted_first(self):
+        self.trackit.journal = Journal(target.join('journal'))
+        self.trackit.journal.append(START, 1000, u'project/cli')
+        tracking = self.request('/status')[2]['tracking']
+        assert (tracking['task']['name'], tracking['start_time']) == \
+            ('cli', 1000)
+        assert self.request('/start', {'task': 'served'})[0] == 409
+        assert not target.join('journal').exists()
+
+    def test_writes_should_resolve_paths_and_keep_stats(self):
+        code, _, started = self.request('/start', {'task': 'project/served'})
+        assert code == 200 and started['task']['name'] == 'served'
+        self.request('/stop', {})
+        conn = sqlite3.connect(db.path)
+        assert conn.execute("SELECT T.NAME FROM TASK T JOIN TASK P"
+                            " ON T.PARENT = P.TASK WHERE P.NAME = 'project'"
+                            ).fetchall() == [('served',)]
+        assert conn.execute("SELECT COUNT(*) FROM TASKSTATS").fetchone() == (1,)
+        conn.close()
@@ -0,0 +1,72 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import sqlite3
+from StringIO import StringIO
+
+from trackit import main, util
+from trackit.data import Data
+from trackit.shell import Shell
+
+class TestShell(object):
+
+    def setup(self):
+        self.data = Data(sqlite3.connect(":memory:"))
+        self.output = StringIO()
+
+    def shell(self, commands=''):
+        return Shell({}, self.data, main.parser, main.subparsers.choices,
+                     stdin=StringIO(commands), stdout=self.output)
+
+    def test_runs_commands_against_one_connection(self):
+        capture = util.CaptureIO()
+        with capture:
+            self.shell("start 'first task' --at 100\n"
+                       "stop --at 200\n"
+                       "\n"
+                       "start second --at 300\n").cmdloop()
+        assert "Tracking 'second'." in capture.out
+        assert self.data.intervals.in_progress().task.name == "second"
+
+    def test_rolls_back_failing_command(self):
+        with util.CaptureIO():
+            self.shell("start first --at 100\n"
+                       "start second --at 200\n").cmdloop()
+        assert "Must stop working on" in self.output.getvalue()
+        assert self.data.tasks.names() == ["first"]
+
+    def test_completes_task_names_from_index(self):
+        shell = self.shell()
+        for name in ["bugfix", "build", "review"]:
+            self.data.tasks.create(name)
+        assert shell.completedefault("bu", "start bu", 6, 8) == \
+            ["bugfix", "build"]
+        self.data.tasks.create("bugs")
+        assert shell.task_names("bug") == ["bugfix", "bugs"]
+
+    def test_completes_command_names(self):
+        assert self.shell().completenames("st") == ["start", "stats", "status",
+                                                   "stop"]
+
+    def test_refuses_nested_shells(self):
+        with util.CaptureIO():
+            self.shell("shell\n"
+                       "batch\n"
+                       "maintain\n").cmdloop()
+        for name in ("shell", "batch", "maintain"):
+            assert "{} can not be used in the shell".format(name) in \
+                self.output.getvalue()
+
+    def test_survives_database_errors(self):
+        self.data.tasks.create("kept")
+        self.data.conn.execute("DROP TABLE TASKINTERVAL")
+        capture = util.CaptureIO()
+        with capture:
+            self.shell("status\n"
+                       "tasks\n").cmdloop()
+        assert "no such table" in self.output.getvalue()
+        assert "kept" in capture.out
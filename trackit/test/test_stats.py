@@ -0,0 +1,113 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import random
+import sqlite3
+
+from trackit.data import Data, TaskIntervals
+from trackit.stats import Sketch, Stats
+
+DAY = 24 * 60 * 60
+
+class TestSketch(object):
+
+    def test_quantiles_should_be_within_accuracy(self):
+        rng = random.Random(1)
+        values = [rng.expovariate(1 / 600.0) + 1 for _ in range(5000)]
+        assert len(set(values)) == len(values)
+        sketch = Sketch()
+        for value in values:
+            sketch.add(value)
+        values.sort()
+        for q in (0.5, 0.9, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            assert abs(sketch.quantile(q) - exact) <= 0.011 * exact
+
+    def test_merged_sketches_should_summarize_all_values(self):
+        first, second, both = Sketch(), Sketch(), Sketch()
+        for value in range(1, 101):
+            (first if value % 3 else second).add(value)
+            both.add(value)
+        first.merge(second)
+        assert first.count == 100
+        assert abs(first.mean - 50.5) < 1e-9
+        assert abs(first.variance - both.variance) < 1e-6
+        assert first.quantile(0.5) == both.quantile(0.5)
+
+    def test_sketches_should_stay_bounded(self):
+        sketch = Sketch(max_buckets=10)
+        for value in range(1, 1000):
+            sketch.add(value)
+        assert len(sketch.buckets) == 10
+        assert sketch.quantile(1) == 999
+
+    def test_sketches_should_round_trip(self):
+        sketch = Sketch()
+        for value in (0, 1, 10, 100):
+            sketch.add(value)
+        loaded = Sketch.loads(sketch.dumps())
+        assert loaded.count == 4 and loaded.zeros == 1
+        assert loaded.quantile(0.9) == sketch.quantile(0.9)
+
+
+class TestStats(object):
+
+    def setup(self):
+        conn = sqlite3.connect(":memory:")
+        self.stats = Stats(conn)
+        self.data = Data(conn, intervals=TaskIntervals(conn,
+                                                       stats=self.stats))
+        self.task = self.data.tasks.create("focused")
+
+    def work(self, start, seconds):
+        self.data.intervals.start(self.task, start)
+        self.data.intervals.stop(self.task, start + seconds)
+
+    def test_stats_should_be_updated_on_stop(self):
+        for day, seconds in ((0, 60), (1, 120), (2, 180), (4, 240)):
+            self.work(day * DAY + 43200, seconds)
+        found, = self.stats.all()
+        assert found.sketch.count == 4 and found.seconds == 600
+        assert (found.streak, found.longest_streak) == (1, 3)
+        assert self.stats.for_task(self.task).sketch.mean == 150
+
+    def test_stale_stats_should_be_rebuilt(self):
+        self.work(43200, 60)
+        self.data.intervals.add(self.task, 0, 30)
+        found = self.stats.for_task(self.task)
+        assert found.sketch.count == 2 and found.seconds == 90
+        assert found.sketch.minimum == 30
+
+    def test_fresh_stats_should_be_kept_beside_rebuilt_ones(self):
+        other = self.data.tasks.create("fresh")
+        self.data.intervals.start(other, 0)
+        self.data.intervals.stop(other, 600)
+        self.work(43200, 60)
+        self.data.intervals.add(self.task, 1000, 1030)
+        assert [(stats.task.name, stats.sketch.count)
+                for stats in self.stats.all()] == [("fresh", 1),
+                                                   ("focused", 2)]
+
+    def test_tasks_without_stopped_intervals_should_have_no_stats(self):
+        self.data.intervals.start(self.task, 0)
+        assert self.stats.all() == []
+        assert self.stats.for_task(self.task).sketch.count == 0
+
+    def test_streaks_should_be_counted_in_the_timezone(self):
+        new_york = Stats(self.data.conn, zone='America/New_York')
+        self.data.intervals.stats = new_york
+        # 23:30 and 00:30 in UTC are the same afternoon in New York
+        self.work(DAY - 1800, 60)
+        self.work(DAY + 1800, 60)
+        assert new_york.for_task(self.task).streak == 1
+        utc = Stats(self.data.conn, zone='UTC').for_task(self.task)
+        assert (utc.timezone, utc.streak) == ('UTC', 2)
+        # Stopping on top of stats for another timezone rebuilds them
+        self.work(2 * DAY + 1800, 60)
+        stored, = new_york._load([self.task.task_id])
+        assert stored.timezone == 'America/New_York'
+        assert (stored.sketch.count, stored.streak) == (3, 2)
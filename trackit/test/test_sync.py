@@ -0,0 +1,117 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import sqlite3
+
+from trackit.util import Path
+from trackit.data import Data
+from trackit.sync import Peers, export_changes, import_changes, sync, sync_file
+
+target = Path('trackit_test_sync')
+exchange = target.join('exchange.json')
+
+def setup_function(func):
+    target.makedir()
+
+def teardown_function(func):
+    if target.exists():
+        target.rmdir()
+
+def database():
+    return Data(sqlite3.connect(":memory:"))
+
+def track(data, name, start, stop=None):
+    tasks = data.tasks.named(name)
+    task = tasks[0] if tasks else data.tasks.create(name)
+    data.intervals.start(task, start)
+    if stop is not None:
+        data.intervals.stop(task, stop)
+
+def spans(data):
+    return sorted(((task.name, interval.start_time, interval.stop_time)
+                   for task in data.tasks.all()
+                   for interval in data.intervals.for_task(task)),
+                  key=lambda span: span[1])
+
+def test_peers_should_have_stable_identity_and_default_marks():
+    peers = Peers(sqlite3.connect(":memory:"))
+    assert peers.identity() == peers.identity()
+    assert peers.marks("someone") == (-1, -1)
+    peers.update("someone", 3, 4)
+    assert peers.marks("someone") == (3, 4)
+
+def test_export_should_only_include_rows_changed_after_revision():
+    data = database()
+    track(data, "old", 10, 20)
+    since = export_changes(data, -1)['revision']
+    track(data, "new", 30, 40)
+    changes = export_changes(data, since)
+    assert changes['tasks'] == [["new", None]]
+    assert changes['intervals'] == [["new", 30, 40]]
+
+def test_stopping_should_be_exported_as_change():
+    data = database()
+    track(data, "task", 10)
+    since = export_changes(data, -1)['revision']
+    data.intervals.stop(data.tasks.named("task")[0], 20)
+    assert export_changes(data, since)['intervals'] == [["task", 10, 20]]
+
+def test_import_should_resolve_tasks_by_name_and_report_overlaps():
+    data = database()
+    track(data, "task", 10, 20)
+    result = import_changes(data, {'tasks': [["task", None]],
+                                   'intervals': [["task", 30, 40],
+                                                 ["other", 15, 25]]})
+    assert result.intervals == 1 and len(result.conflicts) == 1
+    assert len(data.tasks.all()) == 1
+    assert spans(data) == [("task", 10, 20), ("task", 30, 40)]
+
+def test_sync_should_exchange_changes_in_both_directions():
+    laptop, workstation = database(), database()
+    track(laptop, "laptop", 10, 20)
+    track(workstation, "workstation", 30, 40)
+    into_laptop, into_workstation = sync(laptop, workstation)
+    assert into_laptop.intervals == 1 and into_workstation.intervals == 1
+    assert spans(laptop) == spans(workstation)
+    track(laptop, "laptop", 50)
+    into_laptop, into_workstation = sync(laptop, workstation)
+    assert into_laptop.intervals == 0 and into_workstation.intervals == 1
+    laptop.intervals.stop(laptop.tasks.named("laptop")[0], 60)
+    sync(laptop, workstation)
+    assert spans(laptop) == spans(workstation)
+    assert spans(laptop)[-1] == ("laptop", 50, 60)
+
+def test_sync_through_exchange_file():
+    laptop, workstation = database(), database()
+    track(laptop, "laptop", 10, 20)
+    track(workstation, "workstation", 30, 40)
+    sync_file(laptop, exchange)
+    assert sync_file(workstation, exchange).intervals == 1
+    assert sync_file(laptop, exchange).intervals == 1
+    assert spans(laptop) == spans(workstation)
+    track(laptop, "laptop", 50, 60)
+    sync_file(laptop, exchange)
+    sync_file(laptop, exchange)
+    assert sync_file(workstation, exchange).intervals == 1
+    assert spans(laptop) == spans(workstation)
+
+def test_sync_should_keep_tasks_with_the_same_name_apart():
+    laptop, workstation = database(), database()
+    for project, start in (("a", 10), ("b", 30)):
+        task = laptop.tasks.resolve(project + "/review", create=True)
+        laptop.intervals.start(task, start)
+        laptop.intervals.stop(task, start + 10)
+    into_laptop, into_workstation = sync(laptop, workstation)
+    assert into_workstation.intervals == 2
+    paths = sorted(workstation.tasks.path(task)
+                   for task in workstation.tasks.all())
+    assert paths == ["a", "a/review", "b", "b/review"]
+    for path, start in (("a/review", 10), ("b/review", 30)):
+        task = workstation.tasks.resolve(path)
+        assert [i.start_time for i in workstation.intervals.for_task(task)] \
+            == [start]
+    assert sync(laptop, workstation)[1].conflicts == []
@@ -0,0 +1,95 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import sqlite3
+
+import pytest
+
+from trackit import tags
+from trackit.data import Data
+from trackit.tags import Bitmap, Tags, InvalidTag, InvalidTagFilter
+
+class TestParse(object):
+
+    def test_not_should_bind_tighter_than_and_and_and_than_or(self):
+        assert tags.parse("a or b and not c") == \
+            ('or', ('tag', 'a'), ('and', ('tag', 'b'), ('not', ('tag', 'c'))))
+        assert tags.parse("(a | b) & !c") == \
+            ('and', ('or', ('tag', 'a'), ('tag', 'b')), ('not', ('tag', 'c')))
+
+    def test_malformed_filters_should_be_refused(self):
+        for expression in ("", "a and", "(a", "a b", "a )"):
+            with pytest.raises(InvalidTagFilter):
+                tags.parse(expression)
+
+    def test_tags_should_be_single_words(self):
+        tags.check_tag("client-x")
+        for name in ("", "two words", "not", "a|b"):
+            with pytest.raises(InvalidTag):
+                tags.check_tag(name)
+
+
+class TestBitmap(object):
+
+    def test_operations_should_work_across_chunks(self):
+        first = Bitmap({0: 0b0110, 2: 1})
+        second = Bitmap({0: 0b0011, 1: 1})
+        assert list(first & second) == [1]
+        assert list(first | second) == [0, 1, 2, tags.CHUNK_BITS,
+                                         2 * tags.CHUNK_BITS]
+        inverted = first.invert(tags.CHUNK_BITS + 1)
+        assert list(inverted)[:3] == [3, 4, 5]
+        assert list(inverted)[-2:] == [tags.CHUNK_BITS, tags.CHUNK_BITS + 1]
+        assert len(inverted) == tags.CHUNK_BITS - 1
+
+    def test_blobs_should_round_trip(self):
+        for bits in (0, 1, 1 << 4095, 0xff00ff):
+            assert tags._from_blob(tags._to_blob(bits)) == bits
+
+
+class TestTags(object):
+
+    def setup(self):
+        self.data = Data(sqlite3.connect(":memory:"))
+        self.tags = Tags(self.data.conn)
+        task = self.data.tasks.create("tagged")
+        self.intervals = [self.data.intervals.add(task, i * 100, i * 100 + 50)
+                          for i in range(6)]
+        for interval, names in zip(self.intervals, (
+                ["billable"], ["billable", "meeting"], ["meeting"], [],
+                ["billable", "client"], ["client"])):
+            self.tags.tag(interval, names)
+
+    def ids(self, expression):
+        return [id_ - 1 for id_ in self.tags.select(expression)]
+
+    def test_tags_should_be_listed(self):
+        assert self.tags.of(self.intervals[1]) == ["billable", "meeting"]
+        assert self.tags.names() == ["billable", "client", "meeting"]
+
+    def test_filters_should_select_intervals(self):
+        assert self.ids("billable") == [0, 1, 4]
+        assert self.ids("billable and not meeting") == [0, 4]
+        assert self.ids("meeting or client") == [1, 2, 4, 5]
+        assert self.ids("not (billable or meeting or client)") == [3]
+        assert self.ids("unknown") == []
+
+    def test_bitmaps_should_follow_changes(self):
+        assert self.ids("meeting") == [1, 2]
+        self.tags.untag(self.intervals[1], ["meeting"])
+        self.data.conn.execute("DELETE FROM TASKINTERVAL WHERE TASKINTERVAL"
+                               " = ?", (self.intervals[2].task_interval,))
+        assert self.ids("meeting") == []
+        assert self.tags.names() == ["billable", "client"]
+
+    def test_totals_should_only_count_matching_intervals(self):
+        other = self.data.tasks.create("other")
+        self.tags.tag(self.data.intervals.add(other, 1000, 1100),
+                      ["billable"])
+        totals = tags.totals(self.data, "billable", since=25, until=2000)
+        assert [(task.name, seconds) for task, seconds in totals] == \
+            [("tagged", 125), ("other", 100)]
@@ -35,6 +35,14 @@ class TestDumbConstructor(object):
         assert test_candidate.b == "b"
         assert test_candidate.c == "c"
 
+    def test_should_assign_each_default_to_its_own_argument(self):
+        class TestClass(object):
+            @dumb_constructor
+            def __init__(self, a, b=2, c=3):
+                pass
+        test_candidate = TestClass(1)
+        assert (test_candidate.a, test_candidate.b, test_candidate.c) == (1, 2, 3)
+
 class TestDefaultRepr(object):
 
     def test_repr_should_mention_all_variable_names(self):
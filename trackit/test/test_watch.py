@@ -0,0 +1,63 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+
+import sqlite3
+
+from trackit.util import Path
+from trackit.data import Data
+from trackit.watch import Watcher, watch
+
+target = Path('trackit_test_watch')
+db = target.join('db.sqlite')
+
+def setup_function(func):
+    target.makedir()
+
+def teardown_function(func):
+    if target.exists():
+        target.rmdir()
+
+def test_watcher_reports_change_on_first_check_only():
+    conn = sqlite3.connect(db.path)
+    watcher = Watcher(conn, db)
+    assert watcher.changed()
+    assert not watcher.changed()
+
+def test_watcher_notices_commits_from_other_connections():
+    conn, other = sqlite3.connect(db.path), sqlite3.connect(db.path)
+    Data(conn)
+    watcher = Watcher(conn)
+    watcher.changed()
+    Data(other).tasks.create("elsewhere")
+    other.commit()
+    assert watcher.changed()
+    assert not watcher.changed()
+
+def test_watcher_notices_changes_made_through_own_connection():
+    conn = sqlite3.connect(db.path)
+    data = Data(conn)
+    watcher = Watcher(conn)
+    watcher.changed()
+    data.tasks.create("here")
+    assert watcher.changed()
+
+def test_watch_only_yields_state_changes():
+    conn, other = sqlite3.connect(db.path), sqlite3.connect(db.path)
+    data, writer = Data(conn), Data(other)
+    task = writer.tasks.create("watched")
+    other.commit()
+    script = [lambda: None, lambda: writer.intervals.start(task, 10),
+              lambda: None, lambda: writer.intervals.stop(task, 20)]
+    def sleep(_):
+        script.pop(0)()
+        other.commit()
+    states = watch(data, db, sleep=sleep)
+    assert next(states) is None
+    started = next(states)
+    assert started.task.name == "watched" and started.in_progress
+    assert next(states) is None
+    assert not script
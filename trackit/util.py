@@ -38,7 +38,7 @@ def dumb_constructor(init_method):
         if defaults is not None:
             for i in range(len(defaults)):
                 if not hasattr(self, names[-(i+1)]):
-                    setattr(self, names[-(i+1)], defaults[i])
+                    setattr(self, names[-(i+1)], defaults[-(i+1)])
         init_method(self, *args, **kargs)
     return wrapper
 
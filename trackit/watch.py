@@ -0,0 +1,85 @@
+# coding=utf-8
+# Copyright (c) 2013 Robin Kåveland Hansen
+#
+# This file is a part of trackit. It is distributed under the terms
+# of the modified BSD license. The full license is available in
+# LICENSE, distributed as part of this software.
+"""
+Cheap change detection for long running trackit processes.
+"""
+
+import os
+import time
+
+from trackit.data import data_version
+
+
+class Watcher(object):
+    """Detects changes to a database without querying any tables.
+
+    A change is detected when another connection has committed (PRAGMA
+    data_version), when conn itself has modified rows (total_changes) or
+    when the modification time of the database file changes.
+    """
+
+    def __init__(self, conn, path=None):
+        """Create a Watcher. The first call to changed() returns True.
+
+        Arguments:
+        - `conn`: sqlite3 database connection to watch.
+        - `path`: optional Path of the database file, for mtime checks.
+        """
+        self.conn = conn
+        self.path = path
+        self._last = None
+
+    def _mtime(self):
+        if self.path is None:
+            return None
+        try:
+            return os.stat(self.path.path).st_mtime
+        except OSError:
+            return None
+
+    def version(self):
+        """Opaque value that differs whenever the database has changed."""
+        return (data_version(self.conn), self.conn.total_changes,
+                self._mtime())
+
+    def changed(self):
+        """True if the database has changed since the last call."""
+        current = self.version()
+        changed, self._last = current != self._last, current
+        return changed
+
+
+def _state(interval):
+    if interval is None:
+        return None
+    return interval.task_interval, interval.stop_time
+
+
+def watch(data, path=None, interval=1.0, sleep=time.sleep):
+    """Generator yielding the task interval in progress whenever it changes.
+
+    The first value is the current state. Later values are only yielded
+    when tracking has started, stopped or moved on to another task. None
+    is yielded when nothing is being tracked. The database is only queried
+    after a Watcher has detected a change.
+
+    Arguments:
+    - `data`: Data instance to watch.
+    - `path`: optional Path of the database file, for mtime checks.
+    - `interval`: seconds to sleep between each check.
+    - `sleep`: function used for sleeping.
+    """
+    watcher = Watcher(data.conn, path)
+    previous = current = None
+    first = True
+    while True:
+        if watcher.changed():
+            current = data.intervals.in_progress()
+        if first or _state(current) != _state(previous):
+            yield current
+        first, previous = False, current
+        sleep(interval)